@@ -1,38 +1,121 @@
 import os
-from modeller import *
-from modeller.scripts import complete_pdb
-
-# Set up the Modeller environment
-env = Environ()
-env.libs.topology.read(file='$(LIB)/top_heav.lib')
-env.libs.parameters.read(file='$(LIB)/par.lib')
-
-# Function to calculate the DOPE score for a given .pdb file
+import multiprocessing
+
+# Scores recorded by the modeling step (script_main is on PYTHONPATH when started by execute_modeller.py)
+try:
+    from score_store import ScoreStore, first_chain_selection, structure_key
+except ImportError:
+    ScoreStore = None
+
+# CPUs of this process: affinity, cgroup quota and batch allocation
+try:
+    from cpu_budget import available_cpus
+except ImportError:
+    def available_cpus():
+        return int(os.environ.get('MODELLER_SCRIPTS_NUM_CPUS', 0)) or os.cpu_count() or 1
+
+# Write the per-residue DOPE profile of every file as a NumPy array (<name>.npy in profile_dir)
+write_profiles = False
+profile_dir = "dope_profiles"
+
+# Modeller environment of the worker process, created once per worker
+env = None
+
+# Set up the Modeller environment of a worker process (MODELLER is only imported when files need scoring)
+def init_worker():
+    global env
+    from modeller import Environ
+    env = Environ()
+    env.libs.topology.read(file='$(LIB)/top_heav.lib')
+    env.libs.parameters.read(file='$(LIB)/par.lib')
+
+# Function to calculate the DOPE score (and optionally the profile) for a given .pdb file
 def calculate_dope_score(pdb_file):
+    from modeller import Selection
+    from modeller.scripts import complete_pdb
+
     mdl = complete_pdb(env, pdb_file)
     atmsel = Selection(mdl.chains[0])
-    score = atmsel.assess_dope()
-    return score
-
-# Open the summary file for writing
-with open("summary_dope_score.txt", "w") as summary_file:
-    # Write header
-    summary_file.write("Filename\tDOPE Score\n")
-
-    # Iterate over each .pdb file in the working directory and calculate the DOPE score
-    for filename in os.listdir("."):
-        if filename.endswith("_protein.pdb"):
-            print(f"Processing {filename}...")
-            dope_score = calculate_dope_score(filename)
-            print(f"DOPE score: {dope_score}")
-
-            # Extract filename without extension
-            file_name_without_extension = os.path.splitext(filename)[0]
-
-            # Write data to the summary file in real-time
-            summary_file.write(f"{file_name_without_extension}\t{dope_score}\n")
-
-print("Summary data saved to 'summary_dope_score.txt'.")
+    file_name_without_extension = os.path.splitext(pdb_file)[0]
+
+    if not write_profiles:
+        return file_name_without_extension, atmsel.assess_dope()
+
+    import numpy as np
+
+    profile_file = os.path.join(profile_dir, file_name_without_extension + '.profile')
+    score = atmsel.assess_dope(output='ENERGY_PROFILE NO_REPORT', file=profile_file,
+                               normalize_profile=True, smoothing_window=15)
+
+    # Last column of the profile file: the per-residue energy
+    with open(profile_file, 'r') as f:
+        profile = [float(line.split()[-1]) for line in f if not line.startswith('#') and len(line.split()) > 1]
+    np.save(os.path.join(profile_dir, file_name_without_extension + '.npy'), np.array(profile))
+    os.remove(profile_file)
+
+    return file_name_without_extension, score
+
+def main():
+    pdb_files = sorted(filename for filename in os.listdir(".") if filename.endswith("_protein.pdb"))
+    if write_profiles:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    # Look up the scores of structures that were already scored the same way (first chain after complete_pdb),
+    # by the modeling engine when it recorded the model or by an earlier run of this script
+    store = ScoreStore() if ScoreStore is not None else None
+    keys = {}
+    results = []
+    missing = []
+    for pdb_file in pdb_files:
+        file_name_without_extension = os.path.splitext(pdb_file)[0]
+        if store is not None:
+            key, chains = structure_key(pdb_file)
+            keys[file_name_without_extension] = (key, first_chain_selection(chains))
+            scores = store.get(*keys[file_name_without_extension])
+            profile_missing = write_profiles and not os.path.isfile(
+                os.path.join(profile_dir, file_name_without_extension + '.npy'))
+            if scores is not None and scores['dope'] is not None and not profile_missing:
+                results.append((file_name_without_extension, scores['dope']))
+                continue
+        missing.append(pdb_file)
+    print(f"{len(results)} DOPE scores found in the score store, {len(missing)} files to score")
+
+    # CPUs available to this process (or the share assigned by the batch driver)
+    cpu_count = available_cpus()
+    num_processes = max(min(int(cpu_count * 0.9), len(missing)), 1)
+
+    # Open the summary file for writing
+    with open("summary_dope_score.txt", "w") as summary_file:
+        # Write header
+        summary_file.write("Filename\tDOPE Score\n")
+        for entry in results:
+            summary_file.write(f"{entry[0]}\t{entry[1]}\n")
+
+        # Score the remaining files in parallel, writing each result as soon as it is ready. The workers are
+        # forked: run in-process by stage_runner, this script is not an importable __main__ module, so spawned
+        # workers could not find calculate_dope_score and init_worker
+        if missing:
+            with multiprocessing.get_context('fork').Pool(processes=num_processes, initializer=init_worker) as pool:
+                for file_name_without_extension, dope_score in pool.imap_unordered(calculate_dope_score, missing):
+                    print(f"{file_name_without_extension}: DOPE score {dope_score}")
+                    summary_file.write(f"{file_name_without_extension}\t{dope_score}\n")
+                    summary_file.flush()
+                    results.append((file_name_without_extension, dope_score))
+
+                    if store is not None:
+                        store.put(*keys[file_name_without_extension], dope=dope_score,
+                                  source=file_name_without_extension + '.pdb')
+
+    # Rewrite the summary file sorted by filename
+    with open("summary_dope_score.txt", "w") as summary_file:
+        summary_file.write("Filename\tDOPE Score\n")
+        for entry in sorted(results):
+            summary_file.write(f"{entry[0]}\t{entry[1]}\n")
+
+    print("Summary data saved to 'summary_dope_score.txt'.")
+
+if __name__ == "__main__":
+    main()
 
 
 #### old script ####
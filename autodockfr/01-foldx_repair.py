@@ -1,26 +1,25 @@
 import os
-import shlex
-import subprocess
-from concurrent.futures import ThreadPoolExecutor
+from tool_scheduler import ToolJob, ToolScheduler
+from docking_settings import job_name, job_parameters
 
-def process_file(file_path):
+def process_file(scheduler, file_path):
     print(f"Processing file: {file_path}")
     repair_command = f"foldx --command=RepairPDB --pdb={file_path}"
-    repair_args = shlex.split(repair_command)
-    subprocess.run(repair_args)
-
-def get_cpu_count():
-    return os.cpu_count() or 1
+    return scheduler.submit(ToolJob(repair_command, name=job_name("repair", file_path.replace("_protein.pdb", "")),
+                                    output_file=file_path.replace(".pdb", "_Repair.pdb"), stage="repair",
+                                    inputs=[file_path], parameters=job_parameters("foldx", "RepairPDB")))
 
 def main():
-    cpu_count = get_cpu_count()
-    available_cpus = int(cpu_count * 0.9)
+    # CPU slots of the tool scheduler (90% of the CPUs or of the batch share)
+    scheduler = ToolScheduler()
 
     input_file_suffix = "_protein.pdb"
     input_files = [file for file in os.listdir() if file.endswith(input_file_suffix)]
 
-    with ThreadPoolExecutor(max_workers=available_cpus) as executor:
-        executor.map(process_file, input_files)
+    for file_path in input_files:
+        process_file(scheduler, file_path)
+    scheduler.wait()
+    scheduler.write_summary("tool_jobs_repair.json")
 
 if __name__ == "__main__":
     main()
@@ -1,31 +1,31 @@
 import os
-import shlex
-import subprocess
-from concurrent.futures import ThreadPoolExecutor
+from tool_scheduler import ToolJob, ToolScheduler
+from docking_settings import job_name, job_parameters, receptor_options
 
-def process_file(file_path):
+def process_file(scheduler, file_path):
     print(f"Processing file: {file_path}")
     
     # Generate the new output file name by changing the suffix
     new_output_file = file_path.replace("_protein_Repair.pdb", "_protein.pdbqt")
 
     # Add your second shell command with the new output file name as an argument
-    prepare_receptor = f"prepare_receptor -r {file_path} -o {new_output_file} -A bonds_hydrogens"
-    additional_args = shlex.split(prepare_receptor)
-    subprocess.run(additional_args)
-
-def get_cpu_count():
-    return os.cpu_count() or 1
+    prepare_receptor = f"prepare_receptor -r {file_path} -o {new_output_file} {receptor_options}"
+    model = file_path.replace("_protein_Repair.pdb", "")
+    return scheduler.submit(ToolJob(prepare_receptor, name=job_name("prepare_receptor", model),
+                                    output_file=new_output_file, stage="pdbqt", inputs=[file_path],
+                                    parameters=job_parameters("prepare_receptor", receptor_options)))
 
 def main():
-    cpu_count = get_cpu_count()
-    available_cpus = int(cpu_count * 0.9)
+    # CPU slots of the tool scheduler (90% of the CPUs or of the batch share)
+    scheduler = ToolScheduler()
 
     input_file_suffix = "_protein_Repair.pdb"
     input_files = [file for file in os.listdir() if file.endswith(input_file_suffix)]
 
-    with ThreadPoolExecutor(max_workers=available_cpus) as executor:
-        executor.map(process_file, input_files)
+    for file_path in input_files:
+        process_file(scheduler, file_path)
+    scheduler.wait()
+    scheduler.write_summary("tool_jobs_prepare_receptor.json")
 
 if __name__ == "__main__":
     main()
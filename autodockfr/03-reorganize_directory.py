@@ -2,6 +2,13 @@
 import os
 import shutil
 
+# Overwrite policy of batch runs (script_main is on PYTHONPATH when started by execute_modeller.py)
+try:
+    from run_config import confirm_overwrite
+except ImportError:
+    def confirm_overwrite(prompt, stage):
+        return input(prompt).lower() == 'y'
+
 def move_files_to_folders():
     """
     Moves output files to their respective folders.
@@ -24,8 +31,7 @@ def move_files_to_folders():
         print("The following files already exist in the 'extracted_pdb' folder:")
         for file in split_duplicates:
             print(f"- {file}")
-        confirm = input("Do you want to replace these files? (y/n) ")
-        if confirm.lower() != 'y':
+        if not confirm_overwrite("Do you want to replace these files? (y/n) ", 'reorganize'):
             print("Skipping moving files to 'extracted_pdb' folder.")
         else:
             for file in split_files:
@@ -50,8 +56,7 @@ def move_files_to_folders():
         print("The following files already exist in the 'reduced_pdb' folder:")
         for file in reduce_duplicates:
             print(f"- {file}")
-        confirm = input("Do you want to replace these files? (y/n) ")
-        if confirm.lower() != 'y':
+        if not confirm_overwrite("Do you want to replace these files? (y/n) ", 'reorganize'):
             print("Skipping moving files to 'reduced_pdb' folder.")
         else:
             for file in reduce_files:
@@ -76,8 +81,7 @@ def move_files_to_folders():
         print("The following files already exist in the 'input_protein_pdbqt' folder:")
         for file in protein_pdbqt_duplicates:
             print(f"- {file}")
-        confirm = input("Do you want to replace these files? (y/n) ")
-        if confirm.lower() != 'y':
+        if not confirm_overwrite("Do you want to replace these files? (y/n) ", 'reorganize'):
             print("Skipping moving files to 'input_protein_pdbqt' folder.")
         else:
             for file in protein_pdbqt_files:
@@ -102,8 +106,7 @@ def move_files_to_folders():
         print("The following files already exist in the 'input_ligand_pdbqt' folder:")
         for file in ligand_pdbqt_duplicates:
             print(f"- {file}")
-        confirm = input("Do you want to replace these files? (y/n) ")
-        if confirm.lower() != 'y':
+        if not confirm_overwrite("Do you want to replace these files? (y/n) ", 'reorganize'):
             print("Skipping moving files to 'input_ligand_pdbqt' folder.")
         else:
             for file in ligand_pdbqt_files:
@@ -128,8 +131,7 @@ def move_files_to_folders():
         print("The following files already exist in the 'input_dock_pdbqt' folder:")
         for file in dock_pdbqt_duplicates:
             print(f"- {file}")
-        confirm = input("Do you want to replace these files? (y/n) ")
-        if confirm.lower() != 'y':
+        if not confirm_overwrite("Do you want to replace these files? (y/n) ", 'reorganize'):
             print("Skipping moving files to 'input_dock_pdbqt' folder.")
         else:
             for file in dock_pdbqt_files:
@@ -2,8 +2,6 @@
 ### Generate affinity maps using AGFR
 
 import os
-import subprocess
-import multiprocessing
         
         
 # Set the paths to the input directories and the output directory
@@ -13,14 +11,15 @@ output_directory = "affinity_maps"
 
 
 import os
-import subprocess
-import multiprocessing
+from tool_scheduler import ToolJob, ToolScheduler
+from docking_settings import job_name, job_parameters
 
-def process_file(receptor_file, receptor_dir, ligand_dir, output_dir):
+def process_file(scheduler, receptor_file, receptor_dir, ligand_dir, output_dir):
     """
     Process a single receptor file and generate the affinity map using AutodockFR.
 
     Parameters:
+        scheduler (ToolScheduler): Scheduler running the agfr command.
         receptor_file (str): The name of the receptor file to process.
         receptor_dir (str): Path to the directory containing receptor protein files in pdbqt format.
         ligand_dir (str): Path to the directory containing ligand files in pdbqt format.
@@ -39,8 +38,10 @@ def process_file(receptor_file, receptor_dir, ligand_dir, output_dir):
     # Construct the command to run the agfr tool with the output path
     command = f"agfr -r {receptor_path} -l {ligand_path} -o {target_file}"
 
-    # Run the command using subprocess
-    subprocess.run(command, shell=True)
+    # Queue the command on the tool scheduler
+    return scheduler.submit(ToolJob(command, name=job_name("agfr", protein_name), output_file=target_file,
+                                    stage="map", inputs=[receptor_path, ligand_path],
+                                    parameters=job_parameters("agfr")))
 
 def generate_affinity_maps(receptor_dir="input_protein_pdbqt", ligand_dir="input_ligand_pdbqt", output_dir="input_affinity_maps"):
     """
@@ -60,11 +61,12 @@ def generate_affinity_maps(receptor_dir="input_protein_pdbqt", ligand_dir="input
     # Make sure the output directory exists
     os.makedirs(output_dir, exist_ok=True)
 
-    # Use multiprocessing.Pool to process receptor files in parallel
-    num_processes = int(multiprocessing.cpu_count() * 0.9)  # Get the number of CPU cores
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        # Use starmap to pass multiple arguments to process_file function
-        pool.starmap(process_file, [(receptor_file, receptor_dir, ligand_dir, output_dir) for receptor_file in receptor_files])   
+    # Run the receptor files in parallel on the CPU slots of the tool scheduler (90% of the CPUs or of the batch share)
+    scheduler = ToolScheduler()
+    for receptor_file in receptor_files:
+        process_file(scheduler, receptor_file, receptor_dir, ligand_dir, output_dir)
+    scheduler.wait()
+    scheduler.write_summary("tool_jobs_agfr.json")
 
 
 # Call the function to generate affinity maps in parallel
@@ -1,10 +1,12 @@
 import os
-import subprocess
-from concurrent.futures import ThreadPoolExecutor
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from tool_scheduler import ToolJob, ToolScheduler
+from docking_settings import (adfr_arguments, adfr_options, job_name, job_parameters, max_evals, max_gens, nb_runs,
+                              no_improve_stop, seed_value)
 
 #### Molecular docking and virtual screening
-def perform_molecular_docking_parallel(ligand_file, affinity_map_file, output_dir, nb_runs, max_evals, no_improve_stop, max_gens, seed_value, adfr_options='--overwriteFiles'):
+def perform_molecular_docking_parallel(scheduler, ligand_file, affinity_map_file, output_dir, nb_runs, max_evals, no_improve_stop, max_gens, seed_value, adfr_options='--overwriteFiles'):
     ligand_path = os.path.join(ligand_dir, ligand_file)
     ligand_name = os.path.splitext(ligand_file)[0]
     ligand_short = os.path.splitext(ligand_file)[0].replace("_dock", "")
@@ -14,7 +16,8 @@ def perform_molecular_docking_parallel(ligand_file, affinity_map_file, output_di
     output_prefix = os.path.join(output_dir, f"{affinity_map_name}-{ligand_name}")
 
     # Construct the adfr command
-    adfr_command = f"adfr -l {ligand_path} -t {affinity_map_path} -o {output_prefix} --nbRuns {nb_runs} --maxEvals {max_evals} --noImproveStop {no_improve_stop} --maxGens {max_gens} --seed {seed_value} {adfr_options}"
+    arguments = adfr_arguments(nb_runs, max_evals, no_improve_stop, max_gens, seed_value, adfr_options)
+    adfr_command = f"adfr -l {ligand_path} -t {affinity_map_path} -o {output_prefix} {arguments}"
 
     # Print information and perform molecular docking using adfr
     print(f"##############################")
@@ -27,7 +30,18 @@ def perform_molecular_docking_parallel(ligand_file, affinity_map_file, output_di
     print(f"  - affinity_map_path = {affinity_map_path}")
     print(f"  - affinity_map_name = {affinity_map_name}")
     print(f"  - output_prefix     = {output_prefix}")
-    subprocess.run(adfr_command, shell=True)
+    # The scheduler reserves the --maxCores CPUs of every adfr run. The run journal skips the pair if it was
+    # docked in an earlier run with the same ligand, maps and parameters and its moved outputs still exist.
+    output_pdbqt_dir = "output_dock_pdbqt"
+    final_pdbqt = os.path.join(output_pdbqt_dir, f"{affinity_map_name}-{ligand_short}_out.pdbqt")
+    job = ToolJob(adfr_command, name=job_name("adfr", affinity_map_name, ligand_short),
+                  output_file=f"{output_prefix}_out.pdbqt", stage="dock", inputs=[ligand_path, affinity_map_path],
+                  outputs=[final_pdbqt, f"{output_prefix}_summary.dlg"], parameters=job_parameters("adfr", arguments))
+    if not scheduler.run(job):
+        print(f"Docking of {ligand_name} with {affinity_map_name} failed (log: {job.log_file})")
+        return
+    if job.skipped:
+        return
 
     # Rename the output files and move them to their respective directories
     output_pdbqt = f"{output_prefix}_out.pdbqt"
@@ -38,9 +52,8 @@ def perform_molecular_docking_parallel(ligand_file, affinity_map_file, output_di
     os.rename(f"{output_prefix}_summary.dlg", output_dlg)
     os.rename(f"{output_prefix}.dro", output_dro)
 
-    output_pdbqt_dir = "output_dock_pdbqt"
     os.makedirs(output_pdbqt_dir, exist_ok=True)
-    shutil.move(output_pdbqt, os.path.join(output_pdbqt_dir, f"{affinity_map_name}-{ligand_short}_out.pdbqt"))
+    shutil.move(output_pdbqt, final_pdbqt)
 
     docking_objects_dir = os.path.join(output_dir, "docking_objects")
     os.makedirs(docking_objects_dir, exist_ok=True)
@@ -60,26 +73,21 @@ def perform_molecular_docking(ligand_dir, affinity_map_dir, output_dir, nb_runs,
     # Make sure the output directory exists
     os.makedirs(output_dir, exist_ok=True)
     
-    # Specify the number of parallel jobs
-    #num_workers = int(os.cpu_count() * 0.9)  # use 90% of CPU cores
-    num_workers =  int((os.cpu_count() * 0.9)/2)
-    
+    # CPU slots of the tool scheduler (90% of the CPUs or of the batch share); each adfr run takes --maxCores slots
+    scheduler = ToolScheduler()
+    num_workers = scheduler.cpu_slots
+
     with ThreadPoolExecutor(max_workers=num_workers) as executor:
         for ligand_file in ligand_files:
             for affinity_map_file in affinity_map_files:
-                executor.submit(perform_molecular_docking_parallel, ligand_file, affinity_map_file, output_dir, nb_runs, max_evals, no_improve_stop, max_gens, seed_value, adfr_options)
+                executor.submit(perform_molecular_docking_parallel, scheduler, ligand_file, affinity_map_file, output_dir, nb_runs, max_evals, no_improve_stop, max_gens, seed_value, adfr_options)
+    scheduler.write_summary("tool_jobs_adfr.json")
 
 # Specify the input/output files directory
 ligand_dir = "input_dock_pdbqt"
 affinity_map_dir = "affinity_maps"
 output_dir = "docking_results"
 
-# Define the docking parameters
-nb_runs = 50
-max_evals = 2500000
-no_improve_stop = 5
-max_gens = 10000000
-seed_value = 8
-adfr_options = "--maxCores 2 --overwriteFiles"
-
+# The docking parameters (nb_runs, max_evals, no_improve_stop, max_gens, seed_value, adfr_options) are defined in
+# docking_settings.py, shared with the streaming docking pipeline
 perform_molecular_docking(ligand_dir, affinity_map_dir, output_dir, nb_runs, max_evals, no_improve_stop, max_gens, seed_value, adfr_options)
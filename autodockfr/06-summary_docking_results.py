@@ -1,7 +1,6 @@
 ## Summary of Results
 
 import os
-import pandas as pd
 import re
 
 
@@ -18,6 +17,8 @@ def collect_binding_scores(docking_results_dir, output_file="summary_binding_sco
         output_file (str, optional): Path to the output file to save the summary. Default is 'summary_binding_score.txt'.
     """
 
+    import pandas as pd
+
     binding_scores = []
     dlg_files = [f for f in os.listdir(docking_results_dir) if f.endswith(".dlg")]
 
@@ -76,6 +77,8 @@ def collect_binding_scores(docking_results_dir, output_file="summary_binding_sco
     binding_scores_df.to_csv(output_file, sep="\t", index=False)
 
 def save_top_scores(summary_file="summary_binding_score.txt"):
+    import pandas as pd
+
     binding_scores_df = pd.read_csv(summary_file, sep="\t")
 
     top_10_best_scores = binding_scores_df.sort_values(by='affinity_(kcal/mol)', ascending=True).head(10)
@@ -85,8 +88,12 @@ def save_top_scores(summary_file="summary_binding_score.txt"):
     top_10_worst_scores.to_csv("top-10-worst-score.txt", sep="\t", index=False)
 
 
-# Collect the binding scores and save to 'summary_binding_score.txt'
-collect_binding_scores(docking_results_dir)
+# Nothing to summarize (and no pandas import) without docking results
+if os.path.isdir(docking_results_dir) and any(f.endswith(".dlg") for f in os.listdir(docking_results_dir)):
+    # Collect the binding scores and save to 'summary_binding_score.txt'
+    collect_binding_scores(docking_results_dir)
 
-# Save top 10 best and worst scores to separate files
-save_top_scores()
+    # Save top 10 best and worst scores to separate files
+    save_top_scores()
+else:
+    print(f"No docking results (.dlg files) in '{docking_results_dir}', nothing to summarize.")
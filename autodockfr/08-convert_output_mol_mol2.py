@@ -1,15 +1,29 @@
 ### Convert the output pdbqt to mol and mol2
 
 import os
-import subprocess
-from openbabel import openbabel
+import time
+from tool_scheduler import ToolJob, ToolScheduler
 
-# Check if Open Babel is available and import the module
+# Run journal of the conversions (script_main is on PYTHONPATH when started by execute_modeller.py)
 try:
-    from openbabel import openbabel as ob
-    OPENBABEL_AVAILABLE = True
+    from run_journal import RunJournal, input_hash
 except ImportError:
-    OPENBABEL_AVAILABLE = False
+    RunJournal = None
+
+# Open Babel Python module, imported only when there are files to convert
+ob = None
+OPENBABEL_AVAILABLE = False
+
+
+def import_openbabel():
+    """Check if Open Babel is available and import the module."""
+
+    global ob, OPENBABEL_AVAILABLE
+    try:
+        from openbabel import openbabel as ob
+        OPENBABEL_AVAILABLE = True
+    except ImportError:
+        OPENBABEL_AVAILABLE = False
 
 
 # Input and output directories
@@ -72,9 +86,26 @@ def convert_pdbqt_to_mol2(input_dir, output_dir):
     return converted_files
 
 
+# Journal of the Open Babel conversions, opened with the first conversion
+journal = None
+
+
 def convert_file_using_openbabel(input_file_path, output_file_path, in_format, out_format):
-    """Convert a file using Open Babel."""
+    """Convert a file using Open Babel, unless the run journal shows the same conversion done earlier."""
 
+    global journal
+    if journal is None and RunJournal is not None:
+        journal = RunJournal()
+
+    job = f"openbabel_{os.path.basename(output_file_path)}"
+    parameters = {'in_format': in_format, 'out_format': out_format}
+    if journal is not None:
+        inputs = input_hash([input_file_path])
+        if journal.is_complete("convert", job, inputs, parameters, [output_file_path]):
+            return
+        journal.start("convert", job, inputs, parameters)
+
+    start = time.perf_counter()
     conv = ob.OBConversion()
     conv.SetInFormat(in_format)
     conv.SetOutFormat(out_format)
@@ -82,14 +113,36 @@ def convert_file_using_openbabel(input_file_path, output_file_path, in_format, o
     conv.ReadFile(mol, input_file_path)
     conv.WriteFile(mol, output_file_path)
 
+    if journal is not None:
+        state = "done" if os.path.isfile(output_file_path) else "failed"
+        journal.finish("convert", job, state, outputs=[output_file_path], wall_time=time.perf_counter() - start)
+
+
+# Tool scheduler of the obabel conversions (used when the Open Babel Python module is not available)
+scheduler = None
+
 
 def convert_file_using_subprocess(input_file_path, output_file_path, format_type):
-    """Convert a file using the subprocess module."""
+    """Convert a file with the obabel command, queued on the tool scheduler."""
+
+    global scheduler
+    if scheduler is None:
+        scheduler = ToolScheduler()
 
     command = f"obabel {input_file_path} -O {output_file_path} -d {format_type}"
-    subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    scheduler.submit(ToolJob(command, name=f"obabel_{os.path.basename(output_file_path)}", output_file=output_file_path,
+                             stage="convert", inputs=[input_file_path]))
 
 
 # Convert pdbqt to mol and mol2
-convert_pdbqt_to_mol(INPUT_DIRECTORY, OUTPUT_DIRECTORY_MOL)
-convert_pdbqt_to_mol2(INPUT_DIRECTORY, OUTPUT_DIRECTORY_MOL2)
+if os.path.isdir(INPUT_DIRECTORY) and any(f.endswith(".pdbqt") for f in os.listdir(INPUT_DIRECTORY)):
+    import_openbabel()
+    convert_pdbqt_to_mol(INPUT_DIRECTORY, OUTPUT_DIRECTORY_MOL)
+    convert_pdbqt_to_mol2(INPUT_DIRECTORY, OUTPUT_DIRECTORY_MOL2)
+else:
+    print(f"No pdbqt files in '{INPUT_DIRECTORY}', nothing to convert.")
+
+# Wait for the obabel conversions
+if scheduler is not None:
+    scheduler.wait()
+    scheduler.write_summary("tool_jobs_obabel.json")
@@ -0,0 +1,266 @@
+## Streaming docking pipeline: FoldX repair, receptor preparation, AGFR maps and ADFR docking per model
+import os
+import sys
+import time
+import heapq
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tool_scheduler import ToolJob, ToolScheduler
+from docking_settings import adfr_arguments, job_name, job_parameters, receptor_options
+
+# Input/output directories (same layout as 03-reorganize_directory.py, 04 and 05)
+extracted_pdb_dir = "extracted_pdb"
+protein_pdbqt_dir = "input_protein_pdbqt"
+ligand_pdbqt_dir = "input_ligand_pdbqt"
+dock_pdbqt_dir = "input_dock_pdbqt"
+affinity_map_dir = "affinity_maps"
+docking_output_dir = "docking_results"
+output_pdbqt_dir = "output_dock_pdbqt"
+
+# Stages of every model, in dependency order. Later stages are started first, so that models already
+# in flight finish before new models are repaired.
+STAGES = ('repair', 'prepare_receptor', 'agfr', 'adfr')
+
+# Run journal stage of every stage
+JOURNAL_STAGES = {'repair': 'repair', 'prepare_receptor': 'pdbqt', 'agfr': 'map', 'adfr': 'dock'}
+
+# Scheduler of the tool runs of the running pipeline
+scheduler = None
+
+
+class StageTask:
+    """
+    One stage of one model (for 'adfr': of one model and one docking ligand).
+
+    Parameters:
+        model (str): Model name (the file prefix before '_protein.pdb').
+        stage (str): Stage name, one of STAGES.
+        ligand (str, optional): Docking ligand file (adfr only).
+    """
+
+    def __init__(self, model, stage, ligand=None):
+        self.model = model
+        self.stage = stage
+        self.ligand = ligand
+        self.status = 'pending'  # pending, done or failed
+        self.wall_time = None
+
+    @property
+    def name(self):
+        """Job name, as the stage scripts name the job (see docking_settings.job_name)."""
+        ligand_short = os.path.splitext(self.ligand)[0].replace("_dock", "") if self.ligand else None
+        return job_name(self.stage, self.model, ligand_short)
+
+
+# Path of an input file in the first directory that contains it
+def find_file(file_name, directories):
+    for directory in directories:
+        path = os.path.join(directory, file_name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+# Run a tool on the scheduler and report whether it produced its output file
+def run_command(task, command, output_file, inputs, outputs=None, parameters=None):
+    """
+    Runs an external tool of a stage task, unless the run journal shows it done in an earlier run with the
+    same inputs and command line.
+
+    Parameters:
+        task (StageTask): The stage task (names the job and sets its priority).
+        command (str): Command line.
+        output_file (str): File the tool must create.
+        inputs (list): Input files of the tool.
+        outputs (list, optional): Files that must still exist to skip the run. Defaults to [output_file].
+        parameters (dict, optional): Journal parameters (see docking_settings.job_parameters). Defaults to
+                                     the command line.
+
+    Returns:
+        ToolJob: The finished job (succeeded, skipped, log_file).
+    """
+
+    job = ToolJob(command, name=task.name, output_file=output_file, priority=-STAGES.index(task.stage),
+                  stage=JOURNAL_STAGES[task.stage], inputs=inputs, outputs=outputs, parameters=parameters)
+    scheduler.run(job)
+    return job
+
+
+# Stage 1: FoldX repair of the protein model
+def repair_model(task):
+    model = task.model
+    pdb_path = find_file(f"{model}_protein.pdb", [".", extracted_pdb_dir])
+    if pdb_path is None:
+        return False
+
+    pdb_dir, pdb_file = os.path.split(pdb_path)
+    command = f"foldx --command=RepairPDB --pdb={pdb_file} --pdb-dir={pdb_dir or '.'} --output-dir=."
+    return run_command(task, command, f"{model}_protein_Repair.pdb", [pdb_path],
+                       parameters=job_parameters("foldx", "RepairPDB")).succeeded
+
+
+# Stage 2: Receptor PDBQT of the repaired model
+def prepare_receptor(task):
+    model = task.model
+    os.makedirs(protein_pdbqt_dir, exist_ok=True)
+    receptor_file = os.path.join(protein_pdbqt_dir, f"{model}_protein.pdbqt")
+    command = f"prepare_receptor -r {model}_protein_Repair.pdb -o {receptor_file} {receptor_options}"
+    return run_command(task, command, receptor_file, [f"{model}_protein_Repair.pdb"],
+                       parameters=job_parameters("prepare_receptor", receptor_options)).succeeded
+
+
+# Stage 3: AGFR affinity maps around the ligand of the model
+def generate_affinity_map(task):
+    model = task.model
+    ligand_path = find_file(f"{model}_ligand.pdbqt", [ligand_pdbqt_dir, "."])
+    if ligand_path is None:
+        print(f"No ligand file '{model}_ligand.pdbqt' for the affinity maps of {model}")
+        return False
+
+    os.makedirs(affinity_map_dir, exist_ok=True)
+    receptor_file = os.path.join(protein_pdbqt_dir, f"{model}_protein.pdbqt")
+    target_file = os.path.join(affinity_map_dir, f"{model}.trg")
+    command = f"agfr -r {receptor_file} -l {ligand_path} -o {target_file}"
+    return run_command(task, command, target_file, [receptor_file, ligand_path],
+                       parameters=job_parameters("agfr")).succeeded
+
+
+# Stage 4: ADFR docking of one ligand into the affinity maps of the model
+def dock_ligand(task):
+    model, ligand_file = task.model, task.ligand
+    ligand_path = find_file(ligand_file, [dock_pdbqt_dir, "."])
+    ligand_name = os.path.splitext(ligand_file)[0]
+    ligand_short = ligand_name.replace("_dock", "")
+    affinity_map_path = os.path.join(affinity_map_dir, f"{model}.trg")
+    output_prefix = os.path.join(docking_output_dir, f"{model}-{ligand_name}")
+
+    os.makedirs(docking_output_dir, exist_ok=True)
+    arguments = adfr_arguments()
+    command = f"adfr -l {ligand_path} -t {affinity_map_path} -o {output_prefix} {arguments}"
+    final_pdbqt = os.path.join(output_pdbqt_dir, f"{model}-{ligand_short}_out.pdbqt")
+    job = run_command(task, command, f"{output_prefix}_out.pdbqt", [ligand_path, affinity_map_path],
+                      [final_pdbqt, f"{output_prefix}_summary.dlg"], job_parameters("adfr", arguments))
+    if not job.succeeded:
+        return False
+    if job.skipped:
+        return True
+
+    # Move the outputs to their respective directories (as 05-autodockfr.py)
+    os.makedirs(output_pdbqt_dir, exist_ok=True)
+    shutil.move(f"{output_prefix}_out.pdbqt", final_pdbqt)
+
+    docking_objects_dir = os.path.join(docking_output_dir, "docking_objects")
+    os.makedirs(docking_objects_dir, exist_ok=True)
+    if os.path.isfile(f"{output_prefix}.dro"):
+        shutil.move(f"{output_prefix}.dro", os.path.join(docking_objects_dir, f"{model}-{ligand_short}.dro"))
+
+    return True
+
+
+# Run one stage task
+def run_task(task):
+    start = time.perf_counter()
+    if task.stage == 'repair':
+        succeeded = repair_model(task)
+    elif task.stage == 'prepare_receptor':
+        succeeded = prepare_receptor(task)
+    elif task.stage == 'agfr':
+        succeeded = generate_affinity_map(task)
+    else:
+        succeeded = dock_ligand(task)
+    task.wall_time = time.perf_counter() - start
+    return succeeded
+
+
+def run_pipeline(models=None, dock_ligands=None, cpu_slots=None):
+    """
+    Runs repair -> prepare_receptor -> agfr -> adfr for every model as a dependency graph on one shared
+    CPU budget: each model moves on to its next stage as soon as its previous stage is done, so the
+    stages of different models overlap and a slow model only delays itself. A failed stage skips the
+    remaining stages of its model.
+
+    Parameters:
+        models (list, optional): Model names. Defaults to every '<model>_protein.pdb' in the current
+                                 directory or in extracted_pdb.
+        dock_ligands (list, optional): Docking ligand files. Defaults to every '*_dock.pdbqt' in
+                                       input_dock_pdbqt or in the current directory.
+        cpu_slots (int, optional): CPU slots of the tool scheduler (an ADFR run with --maxCores 2 takes
+                                   two). Defaults to 90% of the CPUs.
+
+    Returns:
+        list: All stage tasks with their status and wall time.
+    """
+
+    if models is None:
+        pdb_files = set()
+        for directory in (".", extracted_pdb_dir):
+            if os.path.isdir(directory):
+                pdb_files.update(f for f in os.listdir(directory) if f.endswith("_protein.pdb"))
+        models = sorted(f[:-len("_protein.pdb")] for f in pdb_files)
+
+    if dock_ligands is None:
+        ligand_files = set()
+        for directory in (dock_pdbqt_dir, "."):
+            if os.path.isdir(directory):
+                ligand_files.update(f for f in os.listdir(directory) if f.endswith("_dock.pdbqt"))
+        dock_ligands = sorted(ligand_files)
+
+    if not dock_ligands:
+        raise ValueError(f"No ligand files found in the ligand directory ({dock_pdbqt_dir}).")
+
+    global scheduler
+    scheduler = ToolScheduler(cpu_slots)
+    # Stage threads only wait for their tool runs; the scheduler decides which runs start
+    num_workers = 2 * scheduler.cpu_slots
+    print(f"Docking pipeline: {len(models)} models, {len(dock_ligands)} ligands, {scheduler.cpu_slots} CPU slots")
+
+    # Step 1: The first stage of every model is ready
+    tasks = []
+    ready = []  # heap of (-stage rank, sequence number, task)
+    for model in models:
+        task = StageTask(model, STAGES[0])
+        tasks.append(task)
+        heapq.heappush(ready, (0, len(tasks), task))
+
+    # Step 2: Start ready tasks (latest stage first) and queue the next stages of finished ones
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        running = {}
+        while ready or running:
+            while ready and len(running) < num_workers:
+                _, _, task = heapq.heappop(ready)
+                running[executor.submit(run_task, task)] = task
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    succeeded = future.result()
+                except Exception as error:
+                    print(f"{task.name} raised {error!r}")
+                    succeeded = False
+
+                task.status = 'done' if succeeded else 'failed'
+                print(f"[{time.strftime('%H:%M:%S')}] {task.name} {task.status} after {task.wall_time or 0:.1f} s")
+                if not succeeded or task.stage == 'adfr':
+                    continue
+
+                next_stage = STAGES[STAGES.index(task.stage) + 1]
+                next_ligands = dock_ligands if next_stage == 'adfr' else [None]
+                for ligand in next_ligands:
+                    next_task = StageTask(task.model, next_stage, ligand)
+                    tasks.append(next_task)
+                    heapq.heappush(ready, (-STAGES.index(next_stage), len(tasks), next_task))
+
+    # Step 3: Report the models that did not reach docking
+    for task in tasks:
+        if task.status == 'failed':
+            print(f"Failed: {task.name} (later stages of {task.model} skipped)")
+    scheduler.write_summary()
+
+    return tasks
+
+
+if __name__ == "__main__":
+    results = run_pipeline()
+    sys.exit(0 if all(task.status == 'done' for task in results) else 1)
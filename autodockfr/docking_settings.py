@@ -0,0 +1,43 @@
+## Docking parameters and job names shared by the stage scripts (01, 02, 04, 05) and docking_pipeline.py
+
+# ADFR docking parameters
+nb_runs = 50
+max_evals = 2500000
+no_improve_stop = 5
+max_gens = 10000000
+seed_value = 8
+adfr_options = "--maxCores 2 --overwriteFiles"
+
+# prepare_receptor options of the receptor PDBQT files
+receptor_options = "-A bonds_hydrogens"
+
+
+# ADFR command line options (everything but the ligand, map and output paths)
+def adfr_arguments(nb_runs=nb_runs, max_evals=max_evals, no_improve_stop=no_improve_stop, max_gens=max_gens,
+                   seed_value=seed_value, adfr_options=adfr_options):
+    return (f"--nbRuns {nb_runs} --maxEvals {max_evals} --noImproveStop {no_improve_stop} --maxGens {max_gens} "
+            f"--seed {seed_value} {adfr_options}")
+
+
+# Name of the tool job of a model (and docking ligand), e.g. 'agfr_hkkp_1' or 'adfr_hkkp_1-lig1'
+def job_name(tool, model, ligand=None):
+    """
+    Names a tool job the same way in the stage scripts and in the streaming pipeline, so that the run
+    journal recognizes a job done by either of them.
+
+    Parameters:
+        tool (str): 'repair', 'prepare_receptor', 'agfr' or 'adfr'.
+        model (str): Model name (the file prefix before '_protein.pdb').
+        ligand (str, optional): Short docking ligand name (the file prefix before '_dock.pdbqt').
+
+    Returns:
+        str: Job name.
+    """
+
+    return f"{tool}_{model}-{ligand}" if ligand else f"{tool}_{model}"
+
+
+# Run journal parameters of a tool job: the tool and its options, without the file paths that differ
+# between the stage scripts and the streaming pipeline
+def job_parameters(tool, options=''):
+    return {'tool': tool, 'options': options}
@@ -0,0 +1,25 @@
+# Test setup: the stage scripts and script_main on the import path, as execute_modeller.py runs them
+import os
+import sys
+import importlib.util
+
+import pytest
+
+AUTODOCKFR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_MAIN = os.path.join(os.path.dirname(AUTODOCKFR), 'script_main')
+for path in (SCRIPT_MAIN, AUTODOCKFR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+# Import a numbered stage script (e.g. 00-summary_dope.py) as a module
+def _load_stage(filename):
+    spec = importlib.util.spec_from_file_location(filename.replace('-', '_')[:-3], os.path.join(AUTODOCKFR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def load_stage():
+    return _load_stage
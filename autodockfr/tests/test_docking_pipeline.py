@@ -0,0 +1,48 @@
+import docking_pipeline
+from docking_pipeline import StageTask
+from docking_settings import adfr_arguments, job_name, job_parameters
+from tool_scheduler import ToolJob
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.jobs = []
+
+    def run(self, job):
+        self.jobs.append(job)
+        job.status, job.skipped = 'done', True
+        return True
+
+
+def test_job_names_match_the_stage_scripts():
+    assert job_name('repair', 'hkkp_1') == 'repair_hkkp_1'
+    assert job_name('adfr', 'hkkp_1', 'lig1') == 'adfr_hkkp_1-lig1'
+
+    assert StageTask('hkkp_1', 'prepare_receptor').name == 'prepare_receptor_hkkp_1'
+    assert StageTask('hkkp_1', 'agfr').name == 'agfr_hkkp_1'
+    assert StageTask('hkkp_1', 'adfr', 'lig1_dock.pdbqt').name == 'adfr_hkkp_1-lig1'
+
+
+def test_adfr_arguments():
+    assert adfr_arguments() == ('--nbRuns 50 --maxEvals 2500000 --noImproveStop 5 --maxGens 10000000 --seed 8 '
+                                '--maxCores 2 --overwriteFiles')
+    assert adfr_arguments(nb_runs=10, adfr_options='--maxCores 4').startswith('--nbRuns 10 ')
+
+
+def test_journal_parameters_leave_out_the_paths():
+    job = ToolJob('agfr -r a.pdbqt -l b.pdbqt -o c.trg', parameters=job_parameters('agfr'))
+    assert job.parameters == {'tool': 'agfr', 'options': ''}
+    assert ToolJob('agfr -r a.pdbqt').parameters == {'command': 'agfr -r a.pdbqt'}
+
+
+def test_dock_ligand_uses_the_shared_parameters(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'lig1_dock.pdbqt').write_text('')
+    scheduler = FakeScheduler()
+    monkeypatch.setattr(docking_pipeline, 'scheduler', scheduler)
+
+    assert docking_pipeline.dock_ligand(StageTask('hkkp_1', 'adfr', 'lig1_dock.pdbqt'))
+    job = scheduler.jobs[0]
+    assert job.name == 'adfr_hkkp_1-lig1' and job.stage == 'dock'
+    assert ' '.join(job.args).endswith(adfr_arguments())
+    assert job.parameters == job_parameters('adfr', adfr_arguments())
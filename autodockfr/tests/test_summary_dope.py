@@ -0,0 +1,120 @@
+import sys
+import types
+
+import pytest
+
+from score_store import ScoreStore, score_selection, structure_key
+
+ATOM = 'ATOM      1  CA  ALA A   1       1.000   1.000   1.000  1.00  0.00           C\n'
+
+
+class FakePool:
+    """multiprocessing.Pool running the tasks in this process."""
+
+    def __init__(self, processes, initializer):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def imap_unordered(self, function, items):
+        return map(function, items)
+
+
+def test_only_scores_computed_the_same_way_are_reused(tmp_path, monkeypatch, load_stage):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('MODELLER_SCRIPTS_SCORE_DB', str(tmp_path / 'scores.sqlite'))
+    (tmp_path / 'm1_protein.pdb').write_text(ATOM + 'END\n')
+    (tmp_path / 'm2_protein.pdb').write_text(ATOM.replace('1.000', '2.000') + 'END\n')
+
+    # m1 was scored by 00 before; m2 only has the in-run score of the modeling step
+    store = ScoreStore()
+    key1, chains = structure_key('m1_protein.pdb')
+    store.put(key1, score_selection(chains, 'A', method='complete_pdb'), dope=-11.0)
+    store.put(structure_key('m2_protein.pdb')[0], 'all', dope=-99.0)
+
+    stage = load_stage('00-summary_dope.py')
+    scored = []
+    monkeypatch.setattr(stage, 'calculate_dope_score', lambda pdb: scored.append(pdb) or (pdb[:-4], -22.0))
+    contexts = []
+    monkeypatch.setattr(stage, 'multiprocessing',
+                        types.SimpleNamespace(get_context=lambda method: contexts.append(method) or
+                                              types.SimpleNamespace(Pool=FakePool)))
+    stage.main()
+
+    assert scored == ['m2_protein.pdb']
+    assert contexts == ['fork']
+    assert (tmp_path / 'summary_dope_score.txt').read_text() == \
+        'Filename\tDOPE Score\nm1_protein\t-11.0\nm2_protein\t-22.0\n'
+    key2, chains = structure_key('m2_protein.pdb')
+    assert ScoreStore().get(key2, score_selection(chains, 'A', method='complete_pdb'))['dope'] == -22.0
+
+
+class FakeLibrary:
+    def __init__(self, files):
+        self.files = files
+
+    def read(self, file):
+        self.files.append(file)
+
+
+class FakeEnviron:
+    created = 0
+
+    def __init__(self):
+        FakeEnviron.created += 1
+        self.files = []
+        self.libs = types.SimpleNamespace(topology=FakeLibrary(self.files), parameters=FakeLibrary(self.files))
+
+
+class FakeChainSelection:
+    def __init__(self, chain):
+        self.chain = chain
+
+    def assess_dope(self, output=None, file=None, **kwargs):
+        if file:
+            with open(file, 'w') as f:
+                f.write('# profile\n1 A 0.1\n2 A 0.4\n')
+        return {'A': -50.0}[self.chain]
+
+
+@pytest.fixture
+def fake_modeller(monkeypatch):
+    completed = []
+    modeller = types.ModuleType('modeller')
+    modeller.Environ, modeller.Selection = FakeEnviron, FakeChainSelection
+    scripts = types.ModuleType('modeller.scripts')
+    scripts.complete_pdb = lambda env, file: completed.append((env, file)) or types.SimpleNamespace(chains=['A', 'B'])
+    modeller.scripts = scripts
+    monkeypatch.setitem(sys.modules, 'modeller', modeller)
+    monkeypatch.setitem(sys.modules, 'modeller.scripts', scripts)
+    return completed
+
+
+def test_workers_score_the_first_chain_with_one_environment(tmp_path, monkeypatch, load_stage, fake_modeller):
+    monkeypatch.chdir(tmp_path)
+    stage = load_stage('00-summary_dope.py')
+    FakeEnviron.created = 0
+    stage.init_worker()
+    assert stage.env.files == ['$(LIB)/top_heav.lib', '$(LIB)/par.lib']
+
+    assert stage.calculate_dope_score('m1_protein.pdb') == ('m1_protein', -50.0)
+    assert stage.calculate_dope_score('m2_protein.pdb') == ('m2_protein', -50.0)
+    assert FakeEnviron.created == 1
+    assert [x[0] for x in fake_modeller] == [stage.env, stage.env]
+
+
+def test_profiles_are_saved_as_arrays(tmp_path, monkeypatch, load_stage, fake_modeller):
+    np = pytest.importorskip('numpy')
+    monkeypatch.chdir(tmp_path)
+    stage = load_stage('00-summary_dope.py')
+    stage.init_worker()
+    monkeypatch.setattr(stage, 'write_profiles', True)
+    (tmp_path / stage.profile_dir).mkdir()
+
+    assert stage.calculate_dope_score('m1_protein.pdb') == ('m1_protein', -50.0)
+    assert np.load(tmp_path / stage.profile_dir / 'm1_protein.npy').tolist() == [0.1, 0.4]
+    assert not (tmp_path / stage.profile_dir / 'm1_protein.profile').exists()
@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+
+import pytest
+
+from tool_scheduler import ToolJob, ToolScheduler, tool_cores
+
+
+class FakeJournal:
+    def __init__(self, complete=False, fail_finish=False):
+        self.complete = complete
+        self.fail_finish = fail_finish
+        self.finished = []
+
+    def is_complete(self, stage, job, inputs, parameters, outputs):
+        return self.complete
+
+    def start(self, stage, job, inputs, parameters):
+        pass
+
+    def finish(self, stage, job, state, returncode, outputs, wall_time, cpu_time):
+        if self.fail_finish:
+            raise RuntimeError('database is locked')
+        self.finished.append((job, state, list(outputs)))
+
+
+def python_job(code, **kwargs):
+    return ToolJob([sys.executable, '-c', code], **kwargs)
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return ToolScheduler(cpu_slots=2, backoff=0.0, journal=False)
+
+
+def test_tool_cores():
+    assert tool_cores(['adfr', '-l', 'x', '--maxCores', '4'], 8) == 4
+    assert tool_cores(['adfr', '-l', 'x'], 8) == 8
+    assert tool_cores(['/usr/bin/adfr', '--maxCores=16'], 8) == 8
+    assert tool_cores(['foldx', '--command=RepairPDB'], 8) == 1
+
+
+def test_output_file_is_relative_to_the_working_directory(scheduler, tmp_path):
+    (tmp_path / 'work').mkdir()
+    job = python_job("open('out.txt', 'w').write('x')", name='write', output_file='out.txt', cwd=str(tmp_path / 'work'))
+    assert scheduler.run(job)
+    assert job.attempts == 1 and job.returncode == 0
+    assert os.path.isfile(job.log_file)
+
+
+def test_failed_jobs_are_retried(scheduler):
+    job = python_job('raise SystemExit(3)', name='fail', max_retries=2)
+    assert not scheduler.run(job)
+    assert (job.status, job.attempts, job.returncode) == ('failed', 3, 3)
+
+    missing = python_job('pass', name='no_output', output_file='never.txt', max_retries=0)
+    assert not scheduler.run(missing)
+
+
+def test_timeout_kills_the_process_group(scheduler, tmp_path):
+    code = ("import subprocess, sys, time\n"
+            "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+            "open('child.pid', 'w').write(str(child.pid))\n"
+            "time.sleep(60)\n")
+    job = python_job(code, name='slow', timeout=1.0, max_retries=0)
+    start = time.perf_counter()
+    assert not scheduler.run(job)
+    assert job.status == 'timeout'
+    assert time.perf_counter() - start < 30
+
+    # The grandchild was killed with its parent (gone, or a zombie waiting for its new parent)
+    pid = int((tmp_path / 'child.pid').read_text())
+    for _ in range(50):
+        try:
+            with open('/proc/%d/stat' % pid) as f:
+                state = f.read().rsplit(')', 1)[1].split()[0]
+        except FileNotFoundError:
+            state = 'gone'
+        if state in ('gone', 'Z', 'X'):
+            break
+        time.sleep(0.1)
+    assert state in ('gone', 'Z', 'X')
+
+
+def test_jobs_done_earlier_are_skipped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scheduler = ToolScheduler(cpu_slots=1, journal=FakeJournal(complete=True))
+    job = python_job('raise SystemExit(1)', name='done_before', stage='dock')
+    assert scheduler.run(job)
+    assert job.skipped and job.attempts == 0
+
+
+def test_journal_errors_do_not_hang_the_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = FakeJournal(fail_finish=True)
+    scheduler = ToolScheduler(cpu_slots=1, journal=journal)
+    future = scheduler.submit(python_job('pass', name='recorded', stage='dock'))
+    assert future.result(timeout=30).succeeded
+
+
+def test_journal_records_the_resolved_outputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'work').mkdir()
+    journal = FakeJournal()
+    scheduler = ToolScheduler(cpu_slots=1, journal=journal)
+    scheduler.run(python_job("open('out.txt', 'w').write('x')", name='recorded', stage='map', output_file='out.txt',
+                             cwd='work'))
+    assert journal.finished == [('recorded', 'done', [os.path.join('work', 'out.txt')])]
+
+
+def test_jobs_share_the_cpu_slots(scheduler, tmp_path):
+    code = "import time; start = time.time(); time.sleep(0.5); open('%s', 'w').write('%%f %%f' %% (start, time.time()))"
+    futures = [scheduler.submit(python_job(code % ('job%d' % i), name='job%d' % i)) for i in range(3)]
+    scheduler.wait()
+    assert all(x.result().succeeded for x in futures)
+
+    # Two one-core jobs fill the two slots: the third one starts after one of them has finished
+    spans = sorted(tuple(map(float, (tmp_path / ('job%d' % i)).read_text().split())) for i in range(3))
+    assert spans[2][0] >= min(spans[0][1], spans[1][1]) - 0.05
+
+    scheduler.write_summary('summary.json')
+    assert os.path.isfile('summary.json')
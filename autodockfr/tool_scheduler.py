@@ -0,0 +1,328 @@
+## CPU-slot-aware scheduler of the external tools (FoldX, prepare_receptor, AGFR, ADFR, Open Babel)
+import os
+import re
+import json
+import time
+import heapq
+import shlex
+import signal
+import threading
+import subprocess
+from concurrent.futures import Future
+
+# CPUs of this process: affinity, cgroup quota and batch allocation (script_main is on PYTHONPATH when
+# started by execute_modeller.py)
+try:
+    from cpu_budget import available_cpus
+except ImportError:
+    def available_cpus():
+        return int(os.environ.get('MODELLER_SCRIPTS_NUM_CPUS', 0)) or os.cpu_count() or 1
+
+# Run journal: jobs done in an earlier run with the same inputs and command line are skipped
+try:
+    from run_journal import RunJournal, input_hash
+except ImportError:
+    RunJournal = None
+
+# Cores used by one run of every tool
+TOOL_CORES = {'foldx': 1, 'prepare_receptor': 1, 'agfr': 1, 'adfr': None, 'obabel': 1}  # adfr: --maxCores
+
+# Per-job log files and the summary of all jobs
+log_directory = "tool_logs"
+summary_file = "tool_jobs.json"
+
+# Record the jobs that have a stage in the run journal (needs script_main on PYTHONPATH)
+use_journal = True
+
+
+# Default number of CPU slots: 90% of the available CPUs, as the stage scripts used before
+def default_cpu_slots():
+    return max(int(available_cpus() * 0.9), 1)
+
+
+# Number of cores a command line uses
+def tool_cores(args, cpu_slots):
+    """
+    Looks up the core footprint of a tool run.
+
+    Parameters:
+        args (list): Command line.
+        cpu_slots (int): Total number of CPU slots (the footprint is capped to it).
+
+    Returns:
+        int: Number of CPU slots the run occupies.
+    """
+
+    tool = os.path.basename(args[0])
+    cores = TOOL_CORES.get(tool, 1)
+    if tool == 'adfr':
+        # ADFR uses all cores unless --maxCores is given
+        match = re.search(r'--maxCores[ =](\d+)', ' '.join(args))
+        cores = int(match.group(1)) if match else cpu_slots
+
+    return max(min(cores, cpu_slots), 1)
+
+
+class ToolJob:
+    """
+    One run of an external tool.
+
+    Parameters:
+        command (str or list): Command line.
+        name (str, optional): Job name, also the name of its log file. Defaults to the tool and a counter.
+        output_file (str, optional): File the tool must create for the run to count as successful. Relative
+                                     paths (also of inputs and outputs) are relative to cwd.
+        priority (int, optional): Lower values start first. Defaults to 0.
+        timeout (float, optional): Seconds after which the run is killed. Defaults to None (no limit).
+        max_retries (int, optional): Additional attempts after a failure. Defaults to the scheduler setting.
+        cwd (str, optional): Working directory of the tool.
+        stage (str, optional): Journal stage ('repair', 'pdbqt', 'map', 'dock' or 'convert'). Jobs without a
+                               stage are not journaled.
+        inputs (list, optional): Input files; the job runs again when their content changes.
+        outputs (list, optional): Files that must still exist for a journaled job to be skipped. Defaults
+                                  to [output_file].
+        parameters (dict, optional): Journal parameters of the job. Defaults to the command line.
+    """
+
+    def __init__(self, command, name=None, output_file=None, priority=0, timeout=None, max_retries=None, cwd=None,
+                 stage=None, inputs=(), outputs=None, parameters=None):
+        self.args = shlex.split(command) if isinstance(command, str) else list(command)
+        self.name = name
+        self.output_file = output_file
+        self.priority = priority
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.cwd = cwd
+        self.stage = stage
+        self.inputs = list(inputs)
+        self.outputs = list(outputs) if outputs is not None else [x for x in [output_file] if x]
+        self._parameters = parameters
+        self.input_hash = None
+        self.skipped = False  # done in an earlier run
+        self.cores = None
+        self.attempts = 0
+        self.status = 'pending'  # pending, running, done, failed or timeout
+        self.returncode = None
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_rss_mb = 0.0
+        self.log_file = None
+
+    @property
+    def succeeded(self):
+        return self.status == 'done'
+
+    # Paths relative to the working directory of the tool
+    def resolve(self, paths):
+        return [os.path.join(self.cwd, x) if self.cwd else x for x in paths]
+
+    @property
+    def parameters(self):
+        return self._parameters or {'command': ' '.join(self.args)}
+
+    def summary(self):
+        return {'name': self.name, 'command': ' '.join(self.args), 'cores': self.cores, 'priority': self.priority,
+                'status': self.status, 'skipped': self.skipped, 'returncode': self.returncode,
+                'attempts': self.attempts, 'wall_time': self.wall_time, 'cpu_time': self.cpu_time,
+                'peak_rss_mb': self.peak_rss_mb, 'log_file': self.log_file}
+
+
+class ToolScheduler:
+    """
+    Runs external tools on a fixed number of CPU slots. Every job occupies as many slots as its tool
+    uses cores (see TOOL_CORES), so multi-core ADFR runs and single-core FoldX/AGFR runs share the CPUs
+    without oversubscription. Waiting jobs start in priority order; a job that does not fit yet holds
+    back lower-priority jobs, so wide jobs are not starved. Failed or timed-out runs are retried after
+    an exponentially growing delay. The output of every run goes to its own log file, and the wall
+    time, CPU time and peak RSS of every run are recorded. Jobs with a stage are recorded in the run
+    journal, and skipped when the journal shows them done with the same inputs and command line and
+    their outputs still exist.
+
+    Parameters:
+        cpu_slots (int, optional): Number of CPU slots. Defaults to 90% of the CPUs.
+        max_retries (int, optional): Default number of additional attempts after a failure. Defaults to 1.
+        backoff (float, optional): Delay (seconds) before the first retry, doubled for every further
+                                   retry. Defaults to 5.
+        log_dir (str, optional): Directory of the per-job log files. Defaults to 'tool_logs'.
+        journal (RunJournal, optional): Run journal. Defaults to the journal of the run ($MODELLER_SCRIPTS_JOURNAL)
+                                        if use_journal is set; False disables it.
+    """
+
+    def __init__(self, cpu_slots=None, max_retries=1, backoff=5.0, log_dir=None, journal=None):
+        self.cpu_slots = cpu_slots or default_cpu_slots()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.log_dir = log_dir or log_directory
+        self.jobs = []
+        self._futures = []
+        self._free = self.cpu_slots
+        self._waiting = []  # heap of (priority, sequence number, job, future)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+        if journal is None and use_journal and RunJournal is not None:
+            journal = RunJournal()
+        self.journal = journal or None
+
+    def submit(self, job):
+        """
+        Queues a job.
+
+        Parameters:
+            job (ToolJob): The job.
+
+        Returns:
+            Future: Resolves to the job once it has finished (successfully or not).
+        """
+
+        future = Future()
+        with self._lock:
+            self._counter += 1
+            job.cores = tool_cores(job.args, self.cpu_slots)
+            job.name = job.name or '%s_%d' % (os.path.basename(job.args[0]), self._counter)
+            if job.max_retries is None:
+                job.max_retries = self.max_retries
+            self.jobs.append(job)
+            self._futures.append(future)
+
+        try:
+            skipped = self._skip_completed(job)
+        except Exception as error:  # e.g. a locked or corrupt journal: run the job anyway
+            print(f"{job.name}: run journal not available ({error}), running the job")
+            skipped = False
+
+        if skipped:
+            future.set_result(job)
+        else:
+            self._enqueue(job, future)
+        return future
+
+    def run(self, job):
+        """Runs a job and waits for it. Returns True if it succeeded."""
+        return self.submit(job).result().succeeded
+
+    def wait(self):
+        """Waits until every submitted job has finished (including its retries)."""
+        for future in list(self._futures):
+            future.result()
+
+    # Skip a job the journal records as done and still valid, or record its start
+    def _skip_completed(self, job):
+        if self.journal is None or not job.stage:
+            return False
+
+        job.input_hash = input_hash(job.resolve(job.inputs))
+        if self.journal.is_complete(job.stage, job.name, job.input_hash, job.parameters, job.resolve(job.outputs)):
+            job.status = 'done'
+            job.skipped = True
+            print(f"{job.name}: done in an earlier run, skipped")
+            return True
+
+        self.journal.start(job.stage, job.name, job.input_hash, job.parameters)
+        return False
+
+    def _enqueue(self, job, future):
+        with self._lock:
+            self._counter += 1
+            heapq.heappush(self._waiting, (job.priority, self._counter, job, future))
+        self._dispatch()
+
+    # Start the waiting jobs that fit into the free slots, in priority order
+    def _dispatch(self):
+        with self._lock:
+            while self._waiting and self._waiting[0][2].cores <= self._free:
+                _, _, job, future = heapq.heappop(self._waiting)
+                self._free -= job.cores
+                job.status = 'running'
+                threading.Thread(target=self._run_job, args=(job, future), daemon=True).start()
+
+    def _run_job(self, job, future):
+        try:
+            self._execute(job)
+        except Exception as error:  # e.g. the tool is not installed
+            job.status = 'failed'
+            print(f"{job.name}: {error}")
+
+        with self._lock:
+            self._free += job.cores
+
+        if job.status != 'done' and job.attempts <= job.max_retries:
+            delay = self.backoff * 2 ** (job.attempts - 1)
+            print(f"{job.name} {job.status} (attempt {job.attempts}), retrying in {delay:.1f} s")
+            threading.Timer(delay, self._enqueue, args=(job, future)).start()
+        else:
+            try:
+                if self.journal is not None and job.stage:
+                    self.journal.finish(job.stage, job.name, 'done' if job.succeeded else 'failed', job.returncode,
+                                        job.resolve(job.outputs) if job.succeeded else (), job.wall_time,
+                                        job.cpu_time)
+            except Exception as error:  # the job has finished either way; waiters must not hang
+                print(f"{job.name}: could not be recorded in the run journal ({error})")
+            finally:
+                future.set_result(job)
+        self._dispatch()
+
+    # Run one attempt of a job
+    def _execute(self, job):
+        job.attempts += 1
+        os.makedirs(self.log_dir, exist_ok=True)
+        job.log_file = os.path.join(self.log_dir, re.sub(r'[^\w.-]', '_', job.name) + '.log')
+
+        with open(job.log_file, 'a') as log:
+            log.write(f"### attempt {job.attempts}: {' '.join(job.args)}\n")
+            log.flush()
+
+            start = time.perf_counter()
+            # The tool runs in its own process group, so a timeout also kills the processes it started
+            process = subprocess.Popen(job.args, cwd=job.cwd, stdout=log, stderr=subprocess.STDOUT,
+                                       start_new_session=True)
+            killed = threading.Event()
+
+            def kill():
+                killed.set()
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:  # finished in the meantime
+                    pass
+
+            timer = threading.Timer(job.timeout, kill) if job.timeout else None
+            if timer:
+                timer.start()
+
+            # wait4 reaps the process and reports its resource usage
+            _, status, usage = os.wait4(process.pid, 0)
+            if timer:
+                timer.cancel()
+            process.returncode = os.waitstatus_to_exitcode(status)
+            timed_out = killed.is_set()
+
+        job.wall_time += time.perf_counter() - start
+        job.cpu_time += usage.ru_utime + usage.ru_stime
+        job.peak_rss_mb = max(job.peak_rss_mb, usage.ru_maxrss / 1024.0)  # ru_maxrss is in KiB on Linux
+        job.returncode = process.returncode
+
+        output_missing = job.output_file and not os.path.isfile(job.resolve([job.output_file])[0])
+        if timed_out:
+            job.status = 'timeout'
+        elif process.returncode != 0 or output_missing:
+            job.status = 'failed'
+        else:
+            job.status = 'done'
+
+    def write_summary(self, path=None):
+        """
+        Writes the record of every job to a JSON file and prints the totals.
+
+        Parameters:
+            path (str, optional): Summary filename. Defaults to 'tool_jobs.json'.
+        """
+
+        path = path or summary_file
+        with open(path, 'w') as f:
+            json.dump([job.summary() for job in self.jobs], f, indent=2)
+
+        failed = sum(1 for job in self.jobs if job.status != 'done')
+        skipped = sum(1 for job in self.jobs if job.skipped)
+        cpu_time = sum(job.cpu_time for job in self.jobs)
+        print(f"Tool scheduler: {len(self.jobs)} jobs on {self.cpu_slots} CPU slots, {skipped} done earlier, "
+              f"{failed} failed, {cpu_time:.0f} s CPU time (details in {path})")
@@ -12,11 +12,24 @@
 import sys
 import os
 import pickle
+import importlib.util
+import modeller
 from modeller import *
 
-# Import core_func.py in script_main
-sys.path.append('../script_main')
+# Import core_func.py in script_main (already on sys.path when started by pipeline.py)
+if importlib.util.find_spec('core_func') is None:
+    sys.path.append('../script_main')
 from core_func import *
+from content_cache import (CACHE_DIR, ArtifactCache, content_key, directory_state, file_digest, find_atom_file,
+                           produced_files)
+from template_search import read_target_sequence, search_templates, select_diverse_templates
+from template_index import TemplateIndex
+from score_store import SCORE_DB, SCORE_DB_ENV
+from results_store import RESULTS_DIR, RESULTS_DIR_ENV
+from run_journal import JOURNAL_DB, JOURNAL_DB_ENV
+from run_config import apply_settings, export_run_options, parse_run_options, stage_policy
+from stage_runner import docking_stages, run_stages
+from worker_pool import set_pool_enabled
 
 # *** Step 1: Specify input variables *** #
 
@@ -32,6 +45,7 @@ loop_model_multiple = True
 # Identify template for homology modeling
 template_auto_detect = True
 template_auto_alignment = True
+alignment_cache = True  # reuse the alignments of an earlier run when the target and templates are unchanged
 
 # Specify the index number of starting and ending models
 single_start_index = 1  # index of the first model
@@ -44,9 +58,51 @@ mult_end_index = 100  # index of the last model (number of multi-template models
 mult_loop_start_index = 1  # index of the first model
 mult_loop_end_index = 10  # index of the last model (number of loop models for multi-template)
 
+# Adaptive sampling: stop generating models once the DOPE ranking has converged
+adaptive_sampling = False
+adaptive_top_k = 5  # number of best models tracked for convergence
+adaptive_patience = 20  # stop after this many models without improvement of the top models
+adaptive_min_models = 20  # minimum number of models before stopping
+
+# Loop refinement of the best core models only (None = loops of every core model are refined)
+loop_top_k = None  # number of best core models (by DOPE score) whose loops are refined
+loop_dope_threshold = None  # refine only residues above this normalized DOPE profile value (None = automatic loops)
+
+# Pocket ensemble for docking: one full model, the other models re-optimize only the ligand pocket
+pocket_ensemble = False  # needs ligand_presence_single/ligand_presence_multiple, replaces the loop refinement
+pocket_radius = 8.0  # residues within this distance (angstroms) of the ligands are re-optimized
+pocket_deviation = 1.0  # random displacement (angstroms) of the pocket atoms of every ensemble member
+
+# Tiered modeling: screen all models with a fast optimization, refine only the best ones slowly
+tiered_modeling = False
+tiered_refine_top = 10  # number of screened models refined with the slow optimization
+
+# Resume an interrupted run: keep the completed models and build only the missing ones
+resume_modeling = False
+
+# Number of independent MODELLER processes sharing the model indices (1 = a single parallel job; not with
+# tiered_modeling)
+num_shards = 1
+
+# Build the single-template and multi-template models at the same time (both must be enabled; not with
+# tiered_modeling or pocket_ensemble)
+concurrent_modeling = False
+concurrent_cpu_split = [0.5, 0.5]  # CPU fractions of the single/multi-template models, None = shared CPU slots
+concurrent_slots = 4  # number of model processes running at once with shared CPU slots
+
+# Reuse the MODELLER workers across the modeling modes of this process (single/multi-template, loops, tiers,
+# pocket ensemble). The pool is per process: it is turned off automatically with shards or concurrent modeling.
+shared_worker_pool = True
+
+# Docking: every model moves from FoldX repair to receptor preparation, AGFR and ADFR as soon as its
+# previous step is done (False runs the autodockfr scripts 01, 02, 04 and 05 one after the other)
+streaming_docking = True
+in_process_stages = True  # run the autodockfr scripts inside this process (False: one interpreter per script)
+
 # Sequence database filename
 database_search = False
 seq_database = 'pdball.pir'
+database_max_hits = 5  # number of templates taken from the database search
 
 # Target filename in PIR format
 target_seq_code = 'hkkp'
@@ -58,10 +114,76 @@ template_single_chain = 'A'
 # Template code and chains for multiple template modeling
 template_manual = [('kp_alphafold', 'A'), ('4biw', 'A')]
 
+# Remove redundant templates before the multi-template alignment
+template_pruning = False
+template_max_count = 8  # maximum number of templates kept
+template_max_identity = 0.95  # templates more similar than this to a kept template are dropped
+
 # Specify the desired number of CPUs
 num_cpus = calculate_num_cpus(0.95)  # use 95% of available CPU cores
+
+# Unattended runs: python execute_modeller.py --batch [--config run.json] [--overwrite skip] [--resume]
+# The "settings" of the config file override the variables above; the stage policies are passed
+# to the autodockfr scripts through environment variables.
+run_options = parse_run_options()
+apply_settings(run_options.settings, globals())
+export_run_options(run_options)
+
+# Score store shared by the modeling step and the DOPE summary of the docking step
+os.environ.setdefault(SCORE_DB_ENV, os.path.abspath(SCORE_DB))
+
+# Results store (one row per model, needs pyarrow), shared with the shard processes
+os.environ.setdefault(RESULTS_DIR_ENV, os.path.abspath(RESULTS_DIR))
+
+# Run journal of the models and tool runs, so that a rerun skips the jobs that are done and still valid
+os.environ.setdefault(JOURNAL_DB_ENV, os.path.abspath(JOURNAL_DB))
+
+# Steps to run (--stage): all of them by default
+run_alignment = run_options.stage in ('all', 'align')
+run_modeling = run_options.stage in ('all', 'model')
+run_docking = run_options.stage in ('all', 'dock')
+
+# Existing models: rebuild them ('overwrite'), keep them ('skip') or build only the missing ones ('resume')
+modeling_policy = stage_policy('modeling')
+if modeling_policy == 'resume':
+    resume_modeling = True
+
+# Number of refined models of the tiered modeling (None = every model is built with the slow optimization)
+refine_top = tiered_refine_top if tiered_modeling else None
+
+# Concurrent branches build their models in shard processes, which know neither the tiers nor the pocket ensemble
+if (concurrent_modeling and single_template_modeling and multi_template_modeling
+        and (tiered_modeling or pocket_ensemble)):
+    raise ValueError('concurrent_modeling cannot be combined with tiered_modeling or pocket_ensemble')
+if tiered_modeling and num_shards > 1:
+    raise ValueError('tiered_modeling cannot be combined with num_shards > 1')
+
+# The worker pool cannot be shared with other processes: shards and concurrent modeling start their own workers
+if shared_worker_pool and (num_shards > 1 or concurrent_modeling):
+    print('Worker pool disabled: the workers cannot be shared with num_shards > 1 or concurrent_modeling')
+    shared_worker_pool = False
+set_pool_enabled(shared_worker_pool)
+
 print(num_cpus)
 
+# Search the sequence database for templates (the template PDB files must be available locally)
+if database_search:
+    if run_alignment:
+        template_hits = search_templates(target_seq_code + '.ali', target_seq_code, seq_database,
+                                         max_hits=database_max_hits)
+        with open('template_hits.pickle', "wb") as f:
+            pickle.dump(template_hits, f)
+    else:
+        # Templates found by the alignment step of an earlier run
+        with open('template_hits.pickle', "rb") as f:
+            template_hits = pickle.load(f)
+    print('Templates found in the sequence database: {}'.format(template_hits))
+
+    if template_hits:
+        template_single_code, template_single_chain = template_hits[0]
+        template_manual = template_hits
+        template_auto_detect = False
+
 ######################################################################
 
 # *** Step 2: Set alias variables *** #
@@ -89,7 +211,7 @@ mtop_loop_pickle = 'mtop_loop.pickle'
 template_multiple_tuple_pickle = "template_multiple_tuple.pickle"
 
 # Specify the input filename as variables
-# aln_single_ali = target_seq_code + '_' + template_single + '.ali'
+aln_single_ali = target_seq_code + '_' + template_single + '.ali'
 # aln_single_pap = target_seq_code + '_' + template_single + '.pap'
 aln_multiple_ali = target_seq_code + '_mult.ali'
 
@@ -98,42 +220,64 @@ aln_multiple_ali = target_seq_code + '_mult.ali'
 
 # *** Step 3: Perform target-template auto-alignment *** #
 
-if template_auto_alignment:
+# Content-addressed cache of the alignment outputs
+aln_cache = ArtifactCache(os.path.join(CACHE_DIR, 'alignments')) if alignment_cache else None
+
+# Persistent index of the template PDB files (chains, sequences, ligands)
+template_index = TemplateIndex()
+
+if template_auto_alignment and run_alignment:
     # Alignment for single template modeling
     if single_template_modeling:
 
-        env = Environ()  # Create a new Modeller environment to build this model
-        aln = Alignment(env)  # Read in the target sequence/alignment
+        # Specify the output filename as variables
+        aln_single_ali = target_seq_code + '_' + template_single + '.ali'
+        aln_single_pap = target_seq_code + '_' + template_single + '.pap'
 
-        # specify a template structure (in complex with ligand)
-        mdl = Model(env,
-                    file=template_single_code,
-                    model_segment=('FIRST:A', 'LAST:A'))
+        # Cache key of the align2d outputs
+        single_aln_key = content_key('align2d', modeller.info.version, file_digest(target_seq_file),
+                                     file_digest(template_single_file), template_single, target_seq_code,
+                                     'max_gap_length=50')
 
-        aln.append_model(mdl,
-                         align_codes=template_single,
-                         atom_files=template_single_file)
+        if aln_cache is not None and aln_cache.restore_entry(single_aln_key, [aln_single_ali, aln_single_pap]):
+            print('Single-template alignment restored from the cache')
 
-        # specify a target sequence
-        aln.append(file=target_seq_file, align_codes=target_seq_code)
+        else:
+            files_before = directory_state()
 
-        # Perform sequence alignment
-        aln.align2d(max_gap_length=50)
+            env = Environ()  # Create a new Modeller environment to build this model
+            aln = Alignment(env)  # Read in the target sequence/alignment
 
-        # Specify the output filename as variables
-        aln_single_ali = target_seq_code + '_' + template_single + '.ali'
-        aln_single_pap = target_seq_code + '_' + template_single + '.pap'
+            # specify a template structure (in complex with ligand)
+            mdl = Model(env,
+                        file=template_single_code,
+                        model_segment=('FIRST:A', 'LAST:A'))
 
-        # write the output file
-        aln.write(file=aln_single_ali, alignment_format='PIR')
-        aln.write(file=aln_single_pap, alignment_format='PAP', alignment_features='INDICES HELIX BETA')
+            aln.append_model(mdl,
+                             align_codes=template_single,
+                             atom_files=template_single_file)
+
+            # specify a target sequence
+            aln.append(file=target_seq_file, align_codes=target_seq_code)
+
+            # Perform sequence alignment
+            aln.align2d(max_gap_length=50)
+
+            # write the output file
+            aln.write(file=aln_single_ali, alignment_format='PIR')
+            aln.write(file=aln_single_pap, alignment_format='PAP', alignment_features='INDICES HELIX BETA')
+
+            # Cache every file the alignment step wrote
+            if aln_cache is not None:
+                aln_cache.store(single_aln_key, produced_files(files_before))
 
         # Process the PIR file and write the output to a new file
         if ligand_presence_single:
             print('Perform a homology modeling with ligand/HETATM information')
 
             aln_single_ligand_ali = target_seq_code + '_' + template_single + '_ligand' + '.ali'
-            process_pir_file(aln_single_ali, aln_single_ligand_ali)
+            num_ligands = max(template_index.count_ligands(template_single_file, 'A'), 1)
+            process_pir_file(aln_single_ali, aln_single_ligand_ali, num_ligands)
 
             aln_single_input = aln_single_ligand_ali
 
@@ -156,122 +300,169 @@ if template_auto_alignment:
 
         else:
             print('Fetching all templates in pdb format inside the current directory')
-            # Automatic detect template in the working directory
-            template_multiple = []
-
-            # Get the files in the current working directory with .pdb extension
-            pdb_files = [file for file in os.listdir() if file.endswith('.pdb')]
-
-            # Extract the filename and chain ID from each pdb file
-            for pdb_file in pdb_files:
-                with open(pdb_file, 'r', encoding="utf8", errors='ignore') as file:
-                    for line in file:
-                        if line.startswith('ATOM'):
-                            line_data = line.split()
-                            chain_id = line_data[4]
-                            template_multiple.append((pdb_file.split('.')[0], chain_id))
-                            break
+            # Automatic detect template in the working directory (first chain of every pdb file)
+            template_multiple = template_index.detect_templates()
 
             print(template_multiple)
 
             # Create a variable of all template IDs
             template_multiple_tuple = tuple([x + y for x, y in template_multiple])
 
+        # Keep a diverse, non-redundant subset of the templates
+        if template_pruning:
+            template_sequences = {}
+            for (code, chain) in template_multiple:
+                template_file = find_atom_file(code, ['.', '../atom_files/'])
+                if template_file is None:
+                    print('Template {}{} skipped: no atom file found in . or ../atom_files/'.format(code, chain))
+                    continue
+
+                template_sequences[(code, chain)] = template_index.chain_sequence(template_file, chain)
+
+            template_multiple = select_diverse_templates(read_target_sequence(target_seq_file, target_seq_code),
+                                                         template_sequences, template_max_count,
+                                                         template_max_identity)
+            print('Templates kept after redundancy pruning: {}'.format(template_multiple))
+
+            template_multiple_tuple = tuple([x + y for x, y in template_multiple])
+
         # Exporting template_multiple_tuple
         with open("template_multiple_tuple.pickle", "wb") as f:
             pickle.dump(template_multiple_tuple, f)
 
     if multi_template_modeling:
-        # Create a new Modeller environment to build this model
-        env = Environ()
+        # Cache key of the structure alignment of the templates (no caching when a template file is missing)
+        template_files = [find_atom_file(code, ['.', '../atom_files/']) for (code, _) in template_multiple]
+        mult_aln_cache = aln_cache if None not in template_files else None
+        if mult_aln_cache is None and aln_cache is not None:
+            print('Alignment cache skipped: not every template atom file was found in . or ../atom_files/')
 
-        # Directories for input atom files
-        env.io.atom_files_directory = ['.', '../atom_files/']
+        template_digests = [(code, chain, file_digest(template_file) if template_file else None)
+                            for (code, chain), template_file in zip(template_multiple, template_files)]
+        mult_aln_key = content_key('salign_tree', modeller.info.version, template_digests)
+        mult_aln_files = ['fm00495.pap', 'fm00495.ali', 'fm00495_edited.ali']
 
-        # Read in the target sequence/alignment
-        aln = Alignment(env)
+        # A hit also restores the fitted template PDBs and the dendrograms
+        if mult_aln_cache is not None and mult_aln_cache.restore_entry(mult_aln_key, mult_aln_files):
+            print('Multi-template structure alignment restored from the cache')
 
-        for (code, chain) in template_multiple:
-            m = Model(env, file=code, model_segment=('FIRST:' + chain, 'LAST:' + chain))
-
-            aln.append_model(m, align_codes=code + chain, atom_files=code)
-
-        for (weights, write_fit, whole) in (((1., 0., 0., 0., 1., 0.), False, True),
-                                            ((1., 0.5, 1., 1., 1., 0.), False, True),
-                                            ((1., 1., 1., 1., 1., 0.), True, False)):
-            aln.salign(rms_cutoff=3.5, normalize_pp_scores=False,
+        else:
+            files_before = directory_state()
+
+            # Create a new Modeller environment to build this model
+            env = Environ()
+
+            # Directories for input atom files
+            env.io.atom_files_directory = ['.', '../atom_files/']
+
+            # Read in the target sequence/alignment
+            aln = Alignment(env)
+
+            for (code, chain) in template_multiple:
+                m = Model(env, file=code, model_segment=('FIRST:' + chain, 'LAST:' + chain))
+
+                aln.append_model(m, align_codes=code + chain, atom_files=code)
+
+            for (weights, write_fit, whole) in (((1., 0., 0., 0., 1., 0.), False, True),
+                                                ((1., 0.5, 1., 1., 1., 0.), False, True),
+                                                ((1., 1., 1., 1., 1., 0.), True, False)):
+                aln.salign(rms_cutoff=3.5, normalize_pp_scores=False,
+                           rr_file='$(LIB)/as1.sim.mat', overhang=30,
+                           gap_penalties_1d=(-450, -50),
+                           gap_penalties_3d=(0, 3),
+                           gap_gap_score=0,
+                           gap_residue_score=0,
+                           dendrogram_file='fm00495.tree',
+                           alignment_type='tree',  # If 'progresive', the tree is not
+                           # computed and all structues will be
+                           # aligned sequentially to the first
+                           feature_weights=weights,  # For a multiple sequence alignment only
+                           # the first feature needs to be non-zero
+                           improve_alignment=True, fit=True, write_fit=write_fit,
+                           write_whole_pdb=whole, output='ALIGNMENT QUALITY')
+
+            # Alignment output files
+            aln.write(file='fm00495.pap', alignment_format='PAP')
+            aln.write(file='fm00495.ali', alignment_format='PIR')
+
+            # Preprocess the output files
+            replace_fit_pdb('fm00495.ali', 'fm00495_edited.ali')
+
+            # Calculate quality score
+            aln.salign(rms_cutoff=1.0, normalize_pp_scores=False,
                        rr_file='$(LIB)/as1.sim.mat', overhang=30,
                        gap_penalties_1d=(-450, -50),
                        gap_penalties_3d=(0, 3),
                        gap_gap_score=0,
                        gap_residue_score=0,
-                       dendrogram_file='fm00495.tree',
-                       alignment_type='tree',  # If 'progresive', the tree is not
-                       # computed and all structues will be
-                       # aligned sequentially to the first
-                       feature_weights=weights,  # For a multiple sequence alignment only
-                       # the first feature needs to be non-zero
-                       improve_alignment=True, fit=True, write_fit=write_fit,
-                       write_whole_pdb=whole, output='ALIGNMENT QUALITY')
-
-        # Alignment output files
-        aln.write(file='fm00495.pap', alignment_format='PAP')
-        aln.write(file='fm00495.ali', alignment_format='PIR')
-
-        # Preprocess the output files
-        replace_fit_pdb('fm00495.ali', 'fm00495_edited.ali')
-
-        # Calculate quality score
-        aln.salign(rms_cutoff=1.0, normalize_pp_scores=False,
-                   rr_file='$(LIB)/as1.sim.mat', overhang=30,
-                   gap_penalties_1d=(-450, -50),
-                   gap_penalties_3d=(0, 3),
-                   gap_gap_score=0,
-                   gap_residue_score=0,
-                   dendrogram_file='1is3A.tree',
-                   alignment_type='progressive', feature_weights=[0] * 6,
-                   improve_alignment=False, fit=False, write_fit=True,
-                   write_whole_pdb=False, output='QUALITY')
+                       dendrogram_file='1is3A.tree',
+                       alignment_type='progressive', feature_weights=[0] * 6,
+                       improve_alignment=False, fit=False, write_fit=True,
+                       write_whole_pdb=False, output='QUALITY')
+
+            # Cache every file the structure alignment wrote
+            if mult_aln_cache is not None:
+                mult_aln_cache.store(mult_aln_key, produced_files(files_before))
 
     if multi_template_modeling:
 
-        # Create a new Modeller environment to build this model
-        env = Environ()
+        # Specify the output filename
+        aln_multiple_ali = target_seq_code + '_mult.ali'
+        aln_multiple_pap = target_seq_code + '_mult.pap'
 
-        # Read topology
-        env.libs.topology.read(file='$(LIB)/top_heav.lib')
+        # Cache key of the target-template alignment
+        target_aln_key = content_key('salign_pairwise', modeller.info.version, file_digest('fm00495_edited.ali'),
+                                     template_digests, file_digest(target_seq_file), target_seq_code)
 
-        # Read aligned structure(s):
-        aln = Alignment(env)
-        aln.append(file='fm00495_edited.ali', align_codes='all')
-        aln_block = len(aln)
+        if mult_aln_cache is not None and mult_aln_cache.restore_entry(target_aln_key,
+                                                                       [aln_multiple_ali, aln_multiple_pap]):
+            print('Multi-template target alignment restored from the cache')
 
-        # Read aligned sequence(s):
-        aln.append(file=target_seq_file, align_codes=target_seq_code)
+        else:
+            files_before = directory_state()
 
-        # Structure sensitive variable gap penalty sequence-sequence alignment:
-        aln.salign(output='', max_gap_length=20,
-                   gap_function=True,  # to use structure-dependent gap penalty
-                   alignment_type='PAIRWISE', align_block=aln_block,
-                   feature_weights=(1., 0., 0., 0., 0., 0.), overhang=0,
-                   gap_penalties_1d=(-450, 0),
-                   gap_penalties_2d=(0.35, 1.2, 0.9, 1.2, 0.6, 8.6, 1.2, 0., 0.),
-                   similarity_flag=True)
+            # Create a new Modeller environment to build this model
+            env = Environ()
 
-        # Specify the output filename
-        aln_multiple_ali = target_seq_code + '_mult.ali'
-        aln_multiple_pap = target_seq_code + '_mult.pap'
+            # Read topology
+            env.libs.topology.read(file='$(LIB)/top_heav.lib')
+
+            # Read aligned structure(s):
+            aln = Alignment(env)
+            aln.append(file='fm00495_edited.ali', align_codes='all')
+            aln_block = len(aln)
 
-        # Write alignment output files
-        aln.write(file=aln_multiple_ali, alignment_format='PIR')
-        aln.write(file=aln_multiple_pap, alignment_format='PAP', alignment_features='INDICES HELIX BETA')
+            # Read aligned sequence(s):
+            aln.append(file=target_seq_file, align_codes=target_seq_code)
+
+            # Structure sensitive variable gap penalty sequence-sequence alignment:
+            aln.salign(output='', max_gap_length=20,
+                       gap_function=True,  # to use structure-dependent gap penalty
+                       alignment_type='PAIRWISE', align_block=aln_block,
+                       feature_weights=(1., 0., 0., 0., 0., 0.), overhang=0,
+                       gap_penalties_1d=(-450, 0),
+                       gap_penalties_2d=(0.35, 1.2, 0.9, 1.2, 0.6, 8.6, 1.2, 0., 0.),
+                       similarity_flag=True)
+
+            # Write alignment output files
+            aln.write(file=aln_multiple_ali, alignment_format='PIR')
+            aln.write(file=aln_multiple_pap, alignment_format='PAP', alignment_features='INDICES HELIX BETA')
+
+            # Cache every file the alignment step wrote
+            if mult_aln_cache is not None:
+                mult_aln_cache.store(target_aln_key, produced_files(files_before))
 
         # Process the PIR file and write the output to a new file
         if ligand_presence_multiple:
             print('Perform a homology modeling with ligand/HETATM information')
 
             aln_multiple_ligand_ali = target_seq_code + '_mult_ligand.ali'
-            process_pir_file(aln_multiple_ali, aln_multiple_ligand_ali)
+
+            # Ligands of every template chain (one block residue, as before, when they are unknown or absent)
+            template_ligands = template_index.ligand_counts(template_multiple, ['.', '../atom_files/'])
+            if not template_ligands or not any(template_ligands.values()):
+                template_ligands = 1
+            process_pir_file(aln_multiple_ali, aln_multiple_ligand_ali, template_ligands)
 
             # Assign alignment file with ligand info as an input parameter
             aln_multiple_input = aln_multiple_ligand_ali
@@ -282,11 +473,14 @@ if template_auto_alignment:
             # Assign alignment file without ligand info as an input parameter
             aln_multiple_input = aln_multiple_ali
 
+    # Save the template entries read by the pruning and ligand counting steps for the next run
+    template_index.save()
+
 """
 # Perform sequence alignment -> Error from infinite loop!
 if template_auto_alignment:
     print('Perform automatic target-template alignment')
-    # subprocess.run(["python", "01-template_alignment.py"])
+    # subprocess.run(["python", "01-template_alignment.py"], env=stage_env)
     os.system("python 01-template_alignment.py")
 else:
     print('Skip the automatic target-template alignment process')
@@ -296,13 +490,25 @@ else:
 print('############################################################')
 print('Recheck the alignment files before creating a homology model')
 print('############################################################')
-if not confirm_continue():
+if run_options.stage == 'all' and not confirm_continue():
     print("Script terminated by user.")
     exit()  # Terminate the script
 
 # *** Step 4: Create homology models *** #
 
-if single_template_modeling:
+if single_template_modeling and run_modeling and modeling_policy == 'skip' and os.path.isfile('best_single_model.pdb'):
+    print('Skip the single-template modeling: best_single_model.pdb already exists')
+    single_template_modeling = False
+
+if multi_template_modeling and run_modeling and modeling_policy == 'skip' and os.path.isfile('best_mult_model.pdb'):
+    print('Skip the multi-template modeling: best_mult_model.pdb already exists')
+    multi_template_modeling = False
+
+# Branches collected for concurrent modeling
+concurrent = concurrent_modeling and single_template_modeling and multi_template_modeling
+model_branches = []
+
+if single_template_modeling and run_modeling:
 
     if ligand_presence_single:
         print('Perform a single-template homology modeling with ligand/HETATM information')
@@ -321,20 +527,39 @@ if single_template_modeling:
     include_ligand = ligand_presence_single
     num_cpus = num_cpus
 
+    # Convergence criterion of the adaptive sampling
+    convergence = None
+    if adaptive_sampling:
+        convergence = ConvergenceMonitor(adaptive_top_k, adaptive_patience, adaptive_min_models)
+
     # Execute MODELLER software
-    if not loop_model_single:
+    if concurrent:
+        print('Queue the single-template models for concurrent modeling')
+        loop_range = (single_loop_start_index, single_loop_end_index) if loop_model_single else (None, None)
+        model_branches.append(model_branch(alignment_file, template_code, target_seq_code, start_index, end_index,
+                                           include_ligand, 'single', *loop_range, num_shards=num_shards,
+                                           convergence=convergence, resume=resume_modeling, loop_top_k=loop_top_k,
+                                           loop_dope_threshold=loop_dope_threshold))
+    elif pocket_ensemble and include_ligand:
+        print('Perform pocket-focused ensemble modeling around the template ligands')
+        pocket_ensemble_model(alignment_file, template_code, target_seq_code, start_index, end_index, num_cpus,
+                              'single', pocket_radius, pocket_deviation, resume=resume_modeling)
+    elif not loop_model_single:
         print('Perform homology modeling using AutoModel')
         single_auto_model(alignment_file, template_code, target_seq_code, start_index, end_index,
-                          include_ligand, num_cpus)
+                          include_ligand, num_cpus, convergence=convergence, resume=resume_modeling,
+                          num_shards=num_shards, refine_top=refine_top)
     else:
         print('Perform homology modeling using LoopModel')
         start_loop_index = single_loop_start_index
         end_loop_index = single_loop_end_index
 
         single_loop_model(alignment_file, template_code, target_seq_code, start_index, end_index, start_loop_index,
-                          end_loop_index, include_ligand, num_cpus)
+                          end_loop_index, include_ligand, num_cpus, convergence=convergence, resume=resume_modeling,
+                          num_shards=num_shards, refine_top=refine_top, loop_top_k=loop_top_k,
+                          loop_dope_threshold=loop_dope_threshold)
 
-if multi_template_modeling:
+if multi_template_modeling and run_modeling:
 
     if ligand_presence_multiple:
         print('Perform a multi-template homology modeling with ligand/HETATM information')
@@ -359,35 +584,45 @@ if multi_template_modeling:
     else:
         template_tuple = template_manual
 
+    # Convergence criterion of the adaptive sampling
+    convergence = None
+    if adaptive_sampling:
+        convergence = ConvergenceMonitor(adaptive_top_k, adaptive_patience, adaptive_min_models)
+
     # Execute MODELLER software
-    if not loop_model_multiple:
+    if concurrent:
+        print('Queue the multi-template models for concurrent modeling')
+        loop_range = (single_loop_start_index, single_loop_end_index) if loop_model_multiple else (None, None)
+        model_branches.append(model_branch(alignment_file, template_tuple, target_seq_code, start_index, end_index,
+                                           include_ligand, 'mult', *loop_range, num_shards=num_shards,
+                                           convergence=convergence, resume=resume_modeling, loop_top_k=loop_top_k,
+                                           loop_dope_threshold=loop_dope_threshold))
+    elif pocket_ensemble and include_ligand:
+        print('Perform pocket-focused ensemble modeling around the template ligands')
+        pocket_ensemble_model(alignment_file, template_tuple, target_seq_code, start_index, end_index, num_cpus,
+                              'mult', pocket_radius, pocket_deviation, resume=resume_modeling)
+    elif not loop_model_multiple:
         print('Perform homology modeling using AutoModel')
         mult_auto_model(alignment_file, template_tuple, target_seq_code, start_index, end_index,
-                        include_ligand, num_cpus)
+                        include_ligand, num_cpus, convergence=convergence, resume=resume_modeling,
+                        num_shards=num_shards, refine_top=refine_top)
     else:
         print('Perform homology modeling using LoopModel')
         start_loop_index = single_loop_start_index
         end_loop_index = single_loop_end_index
 
         mult_loop_model(alignment_file, template_tuple, target_seq_code, start_index, end_index, start_loop_index,
-                        end_loop_index, include_ligand, num_cpus)
+                        end_loop_index, include_ligand, num_cpus, convergence=convergence, resume=resume_modeling,
+                        num_shards=num_shards, refine_top=refine_top, loop_top_k=loop_top_k,
+                        loop_dope_threshold=loop_dope_threshold)
+
+if model_branches:
+    print('Perform single-template and multi-template modeling concurrently')
+    concurrent_model(model_branches, num_cpus, concurrent_cpu_split, concurrent_slots)
 
 # *** Step 5: Perform molecular docking with AutodockFR *** #
-import subprocess
-
-# Change the working directory to the autodockfr folder
-os.chdir("autodockfr")
-
-# Execute the AutodockFR scripts sequentially
-subprocess.run(["python", "00-summary_dope.py"])
-subprocess.run(["python", "01-foldx_repair.py"])
-subprocess.run(["python", "02-prepare_ligand_parallel.py"])
-subprocess.run(["python", "03-reorganize_directory.py"])
-subprocess.run(["python", "04-generate_affinity_map.py"])
-subprocess.run(["python", "05-autodockfr.py"])
-subprocess.run(["python", "06-summary_docking_results.py"])
-subprocess.run(["python", "07-select_top_conformations.py"])
-subprocess.run(["python", "08-convert_output_mol_mol2.py"])
-
-# Change the working directory back to the original directory
-os.chdir("..")
+
+if run_docking:
+    # Run the AutodockFR scripts of the autodockfr folder one after the other (inside this process by
+    # default, so MODELLER and the other packages are imported once)
+    run_stages(docking_stages(streaming_docking), "autodockfr", in_process_stages)
@@ -0,0 +1,52 @@
+# *** Single entry point of the modeling and docking pipeline *** #
+
+# Runs execute_modeller.py and the autodockfr stages inside one Python process, so that every package
+# (MODELLER, pandas, Open Babel) is imported at most once and only by the stages that need it.
+#
+#   python pipeline.py run [execute_modeller.py options]   # Steps 1-5 of execute_modeller.py
+#   python pipeline.py dock [--stage 00 06 ...]           # docking stages of ./autodockfr only
+#
+# Run it from the working directory (the one holding execute_modeller.py and autodockfr).
+
+import os
+import sys
+import argparse
+
+# script_main next to this file, instead of the '../script_main' path of the working directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script_main'))
+
+from stage_runner import DOCKING_STAGES, docking_stages, print_stage_report, run_stage, run_stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the modeling and docking pipeline in one process')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run execute_modeller.py (remaining options are passed on)')
+    run_parser.add_argument('--script', default='execute_modeller.py', help='pipeline script of the working directory')
+
+    dock_parser = commands.add_parser('dock', help='run the docking stages of ./autodockfr')
+    dock_parser.add_argument('--stage', nargs='+', help='stage numbers or script names (default: all stages)')
+    dock_parser.add_argument('--sequential', action='store_true',
+                             help='run the per-tool scripts 01-05 instead of the streaming docking pipeline')
+    dock_parser.add_argument('--directory', default='autodockfr', help='folder of the docking stage scripts')
+
+    args, rest = parser.parse_known_args(argv)
+
+    if args.command == 'run':
+        results = [run_stage(args.script, '.', rest)]
+        print_stage_report(results)
+    else:
+        if rest:
+            parser.error('unrecognized arguments: %s' % ' '.join(rest))
+        scripts = docking_stages(streaming=not args.sequential)
+        if args.stage:
+            known = list(DOCKING_STAGES) + ['docking_pipeline.py']
+            scripts = [x for x in known if any(x == y or x.startswith(y + '-') for y in args.stage)]
+        results = run_stages(scripts, args.directory)
+
+    return 0 if all(x['status'] == 'done' for x in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
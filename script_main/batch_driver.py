@@ -0,0 +1,200 @@
+# Multi-target batch runs of execute_modeller.py sharing one CPU budget
+import os
+import sys
+import json
+import time
+import subprocess
+
+from cpu_budget import cpu_budget
+from run_config import NUM_CPUS_ENV, stage_environment
+
+# Steps of every target, in dependency order
+STAGES = ('align', 'model', 'dock')
+
+# Order in which ready stages are started: the short serial alignments first, so that they run
+# next to the parallel model building and docking of other targets
+START_ORDER = {'align': 0, 'dock': 1, 'model': 2}
+
+
+class StageJob:
+    """
+    One step of one target, run as 'execute_modeller.py --batch --stage <stage>' in the target directory.
+
+    Args:
+        target (dict): Target entry of the manifest.
+        stage (str): 'align', 'model' or 'dock'.
+        cpus (int): Number of CPUs requested.
+        min_cpus (int): Smallest CPU share the job is started with.
+    """
+
+    def __init__(self, target, stage, cpus, min_cpus):
+        self.target = target
+        self.stage = stage
+        self.cpus = cpus
+        self.min_cpus = min(min_cpus, cpus)
+        self.status = 'pending'  # pending, running, done, failed or skipped
+        self.allocated = 0
+        self.process = None
+        self.log = None
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def name(self):
+        return '%s:%s' % (self.target['name'], self.stage)
+
+    def summary(self):
+        return {'target': self.target['name'], 'stage': self.stage, 'status': self.status, 'cpus': self.allocated,
+                'wall_time': (self.end_time - self.start_time) if self.end_time else None,
+                'returncode': self.process.returncode if self.process else None}
+
+
+# Read the manifest of a batch run
+def load_manifest(manifest_file):
+    """
+    Reads a batch manifest. Target directories are resolved relative to the manifest.
+
+    Manifest format (JSON):
+        {"cpu_budget": 64,                      # total CPUs, defaults to 95% of the available CPUs
+         "script": "execute_modeller.py",       # defaults to the copy in every target directory
+         "min_model_cpus": 4, "dock_cpus": 16,  # smallest model share, docking share
+         "policies": {"modeling": "resume"},    # batch policies (see run_config.py)
+         "settings": {...},                     # Step 1 variables shared by all targets
+         "targets": [{"name": "hkkp", "work_dir": "hkkp", "num_cpus": 32,
+                      "stages": ["align", "model", "dock"], "settings": {"target_seq_code": "hkkp"}}]}
+
+    Args:
+        manifest_file (str): Manifest filename.
+
+    Returns:
+        dict: The manifest with defaults filled in.
+    """
+
+    with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    manifest.setdefault('cpu_budget', cpu_budget(0.95))
+    manifest.setdefault('dock_cpus', manifest['cpu_budget'])
+    manifest.setdefault('min_model_cpus', 1)
+    if 'script' in manifest:
+        manifest['script'] = os.path.join(base_dir, manifest['script'])
+
+    for target in manifest['targets']:
+        target['work_dir'] = os.path.join(base_dir, target.get('work_dir', target['name']))
+        target.setdefault('stages', list(STAGES))
+        target.setdefault('num_cpus', manifest['cpu_budget'])
+
+    return manifest
+
+
+# Write the config file of one step and start execute_modeller.py
+def _start_job(job, manifest):
+    target = job.target
+    settings = dict(manifest.get('settings', {}))
+    settings.update(target.get('settings', {}))
+    settings['num_cpus'] = job.allocated
+
+    config_file = os.path.join(target['work_dir'], 'batch_%s.json' % job.stage)
+    with open(config_file, 'w') as f:
+        json.dump({'batch': True, 'policies': manifest.get('policies', {}), 'settings': settings}, f, indent=2)
+
+    script = manifest.get('script', os.path.join(target['work_dir'], 'execute_modeller.py'))
+    env = stage_environment()
+    env[NUM_CPUS_ENV] = str(job.allocated)
+
+    job.log = open(os.path.join(target['work_dir'], 'batch_%s.log' % job.stage), 'w')
+    job.process = subprocess.Popen([sys.executable, script, '--batch', '--config', config_file,
+                                    '--stage', job.stage],
+                                   cwd=target['work_dir'], env=env, stdout=job.log, stderr=subprocess.STDOUT)
+    job.start_time = time.time()
+    job.status = 'running'
+    print("[%s] started %s with %d CPUs" % (time.strftime('%H:%M:%S'), job.name, job.allocated))
+
+
+def run_batch(manifest_file, poll_interval=5.0):
+    """
+    Runs the alignment, model building and docking of every target in a manifest against one CPU budget.
+    Steps of a target run in order; steps of different targets run concurrently whenever CPUs are free.
+    Serial steps (alignment) are started first and take one CPU; model building and docking take their
+    requested share, or what is left of the budget if that is at least min_model_cpus (resp. 1).
+
+    Args:
+        manifest_file (str): Manifest filename (see load_manifest).
+        poll_interval (float, optional): Seconds between checks of the running steps. Defaults to 5.
+
+    Returns:
+        list: Summary dict of every step (also written to batch_summary.json next to the manifest).
+    """
+
+    manifest = load_manifest(manifest_file)
+    budget = manifest['cpu_budget']
+
+    # Step 1: One job per target and stage
+    jobs = []
+    for target in manifest['targets']:
+        for stage in STAGES:
+            if stage not in target['stages']:
+                continue
+            if stage == 'align':
+                jobs.append(StageJob(target, stage, 1, 1))
+            elif stage == 'model':
+                jobs.append(StageJob(target, stage, target['num_cpus'], manifest['min_model_cpus']))
+            else:
+                jobs.append(StageJob(target, stage, manifest['dock_cpus'], 1))
+
+    # Step 2: Start ready jobs while CPUs are free, until all jobs have finished
+    free = budget
+    while True:
+        for job in jobs:
+            if job.status == 'running' and job.process.poll() is not None:
+                job.end_time = time.time()
+                job.status = 'done' if job.process.returncode == 0 else 'failed'
+                job.log.close()
+                free += job.allocated
+                print("[%s] %s %s after %.0f s" % (time.strftime('%H:%M:%S'), job.name, job.status,
+                                                   job.end_time - job.start_time))
+
+        ready = []
+        for job in jobs:
+            if job.status != 'pending':
+                continue
+            previous = [x for x in jobs if x.target is job.target and STAGES.index(x.stage) < STAGES.index(job.stage)]
+            if any(x.status in ('failed', 'skipped') for x in previous):
+                job.status = 'skipped'
+            elif all(x.status == 'done' for x in previous):
+                ready.append(job)
+
+        num_running = sum(1 for x in jobs if x.status == 'running')
+        for job in sorted(ready, key=lambda x: START_ORDER[x.stage]):
+            share = min(job.cpus, free)
+            if share < job.min_cpus and num_running > 0:
+                continue
+            job.allocated = max(share, 1) if num_running > 0 else min(job.cpus, budget)
+            free -= job.allocated
+            num_running += 1
+            _start_job(job, manifest)
+
+        if num_running == 0:
+            break
+        time.sleep(poll_interval)
+
+    # Step 3: Report
+    summary = [job.summary() for job in jobs]
+    with open(os.path.join(os.path.dirname(os.path.abspath(manifest_file)), 'batch_summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    for job in jobs:
+        if job.status != 'done':
+            print("%s: %s" % (job.name, job.status))
+
+    return summary
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python batch_driver.py manifest.json")
+        sys.exit(1)
+
+    results = run_batch(sys.argv[1])
+    sys.exit(0 if all(x['status'] == 'done' for x in results) else 1)
@@ -0,0 +1,254 @@
+# Benchmark of the modeling presets: cost and model quality across presets and CPU counts
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import subprocess
+
+from cpu_budget import available_cpus, cpu_limits
+
+# Result file written by every benchmark run inside its working directory
+RUN_RESULT = 'benchmark_result.json'
+
+# Relative change of the wall time or mean DOPE score reported as a regression against a baseline
+REGRESSION_TOLERANCE = 0.10
+
+
+# Summary statistics of a list of scores
+def describe(values):
+    """
+    Returns the count, min, mean, median, standard deviation and max of the values, ignoring None.
+
+    Args:
+        values (list): Scores.
+
+    Returns:
+        dict: The statistics, or {'count': 0} for an empty list.
+    """
+
+    values = [x for x in values if x is not None]
+    if not values:
+        return {'count': 0}
+
+    return {'count': len(values),
+            'min': min(values),
+            'mean': statistics.mean(values),
+            'median': statistics.median(values),
+            'std': statistics.stdev(values) if len(values) > 1 else 0.0,
+            'max': max(values)}
+
+
+# Read the benchmark configuration
+def load_benchmark(config_file):
+    """
+    Reads a benchmark configuration. Input files are resolved relative to the configuration.
+
+    Configuration format (JSON):
+        {"alignment_file": "hkkp_4biwA.ali", "knowns": "4biwA", "sequence": "hkkp", "include_ligand": false,
+         "num_models": 8, "repeats": 1, "num_cpus": [1, 4, 8],
+         "presets": ["fast", "slow",
+                     {"name": "medium", "md_level": "fast", "library_schedule": "normal",
+                      "max_var_iterations": 300, "repeat_optimization": 2}]}
+
+    Presets given by name refer to REFINEMENT_PRESETS of model_engine.py; presets given as a dict name
+    MODELLER refine/autosched members by their attribute names.
+
+    Args:
+        config_file (str): Configuration filename.
+
+    Returns:
+        dict: The configuration with defaults filled in.
+    """
+
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(config_file))
+    config['alignment_file'] = os.path.join(base_dir, config['alignment_file'])
+    config['atom_files_directory'] = [os.path.join(base_dir, x) for x in config.get('atom_files_directory', ['.'])]
+    config.setdefault('include_ligand', False)
+    config.setdefault('num_models', 8)
+    config.setdefault('repeats', 1)
+    config.setdefault('num_cpus', [1, available_cpus()])
+    config.setdefault('presets', ['fast', 'slow'])
+
+    return config
+
+
+# Build the models of one benchmark run (runs inside the run process)
+def run_benchmark_case(run_file):
+    """
+    Builds the models of one preset and CPU count in the current directory and writes their scores
+    to benchmark_result.json.
+
+    Args:
+        run_file (str): Path to the run configuration (JSON).
+    """
+
+    from modeller import refine
+    from modeller.automodel import autosched
+    from model_engine import DOPE_KEY, REFINEMENT_PRESETS, ModelEngine
+
+    with open(run_file, 'r') as f:
+        run = json.load(f)
+
+    preset = run['preset']
+    if isinstance(preset, dict):
+        REFINEMENT_PRESETS[preset['name']] = {'md_level': getattr(refine, preset['md_level']),
+                                              'library_schedule': getattr(autosched, preset['library_schedule']),
+                                              'max_var_iterations': preset['max_var_iterations'],
+                                              'repeat_optimization': preset['repeat_optimization']}
+        preset = preset['name']
+
+    knowns = run['knowns'] if isinstance(run['knowns'], str) else tuple(run['knowns'])
+    engine = ModelEngine(os.path.basename(run['alignment_file']), knowns, run['sequence'], 1, run['num_models'],
+                         run['include_ligand'], run['num_cpus'], refinement=preset)
+    engine.atom_files_directory = run['atom_files_directory']
+    engine.restraint_cache = None  # every run pays for its own restraints
+    engine.run()
+
+    with open(RUN_RESULT, 'w') as f:
+        json.dump({'dope': [x[DOPE_KEY] for x in engine.outputs if x['failure'] is None],
+                   'ga341': [x['GA341 score'][0] if isinstance(x['GA341 score'], (list, tuple))
+                             else x['GA341 score'] for x in engine.outputs if x['failure'] is None],
+                   'failures': sum(1 for x in engine.outputs if x['failure'] is not None)}, f)
+
+
+# Run one benchmark case as a child process and measure its resource usage
+def _measure_case(run_dir):
+    with open(os.path.join(run_dir, 'run.log'), 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run', 'run.json'],
+                                   cwd=run_dir, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports the usage of the run process and of the MODELLER workers it waited for
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start
+
+    return {'returncode': os.waitstatus_to_exitcode(status),
+            'wall_time': wall_time,
+            'cpu_time_user': usage.ru_utime,
+            'cpu_time_system': usage.ru_stime,
+            'peak_rss_mb': usage.ru_maxrss / 1024.0}  # ru_maxrss is in KiB on Linux
+
+
+def run_benchmark(config_file, output_dir='benchmarks'):
+    """
+    Runs every preset at every CPU count (repeats times) on the benchmark target and collects
+    wall time, CPU time, peak RSS and the DOPE/GA341 distributions of the models.
+
+    Args:
+        config_file (str): Benchmark configuration (see load_benchmark).
+        output_dir (str, optional): Directory of the run working directories. Defaults to 'benchmarks'.
+
+    Returns:
+        dict: The report, with one entry per preset, CPU count and repeat in 'runs'.
+    """
+
+    config = load_benchmark(config_file)
+    report = {'config': config,
+              'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                       'cpu_count': os.cpu_count(), 'cpu_limits': cpu_limits()},
+              'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'runs': []}
+
+    for preset in config['presets']:
+        preset_name = preset['name'] if isinstance(preset, dict) else preset
+        for num_cpus in config['num_cpus']:
+            for repeat in range(config['repeats']):
+                run_dir = os.path.abspath(os.path.join(output_dir, '%s_%dcpu_r%d' % (preset_name, num_cpus, repeat)))
+                shutil.rmtree(run_dir, ignore_errors=True)
+                os.makedirs(run_dir)
+                shutil.copy(config['alignment_file'], run_dir)
+
+                with open(os.path.join(run_dir, 'run.json'), 'w') as f:
+                    json.dump(dict(config, preset=preset, num_cpus=num_cpus), f, indent=2)
+
+                print("Benchmark %s, %d CPUs, repeat %d" % (preset_name, num_cpus, repeat + 1))
+                result = {'preset': preset_name, 'num_cpus': num_cpus, 'repeat': repeat}
+                result.update(_measure_case(run_dir))
+
+                result_file = os.path.join(run_dir, RUN_RESULT)
+                if os.path.isfile(result_file):
+                    with open(result_file, 'r') as f:
+                        scores = json.load(f)
+                    result['failures'] = scores['failures']
+                    result['dope'] = describe(scores['dope'])
+                    result['ga341'] = describe(scores['ga341'])
+
+                report['runs'].append(result)
+                print("  %.1f s wall, %.1f s CPU, %.0f MB peak RSS, mean DOPE %s"
+                      % (result['wall_time'], result['cpu_time_user'] + result['cpu_time_system'],
+                         result['peak_rss_mb'], result.get('dope', {}).get('mean')))
+
+    return report
+
+
+# Compare a report with a baseline report
+def compare_reports(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Lists the runs (preset, CPU count) whose mean wall time or mean DOPE score got worse than in the
+    baseline by more than the tolerance.
+
+    Args:
+        report (dict): New report.
+        baseline (dict): Baseline report.
+        tolerance (float, optional): Relative change reported as a regression. Defaults to 0.10.
+
+    Returns:
+        list: Descriptions of the regressions.
+    """
+
+    def means(runs):
+        grouped = {}
+        for run in runs:
+            if run['returncode'] != 0 or not run.get('dope', {}).get('count'):
+                continue
+            grouped.setdefault((run['preset'], run['num_cpus']), []).append(run)
+        return {key: (statistics.mean(x['wall_time'] for x in runs),
+                      statistics.mean(x['dope']['mean'] for x in runs)) for key, runs in grouped.items()}
+
+    regressions = []
+    old = means(baseline['runs'])
+    for key, (wall_time, dope) in sorted(means(report['runs']).items()):
+        if key not in old:
+            continue
+        old_wall_time, old_dope = old[key]
+        if wall_time > old_wall_time * (1 + tolerance):
+            regressions.append("%s, %d CPUs: wall time %.1f s -> %.1f s" % (key + (old_wall_time, wall_time)))
+        # DOPE scores are negative, lower is better
+        if dope > old_dope + abs(old_dope) * tolerance:
+            regressions.append("%s, %d CPUs: mean DOPE %.1f -> %.1f" % (key + (old_dope, dope)))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the modeling presets')
+    parser.add_argument('config', nargs='?', help='benchmark configuration (JSON)')
+    parser.add_argument('--output', default='benchmark_report.json', help='report filename')
+    parser.add_argument('--output-dir', default='benchmarks', help='directory of the run working directories')
+    parser.add_argument('--baseline', help='earlier report to compare with')
+    parser.add_argument('--run', help=argparse.SUPPRESS)  # internal: build the models of one run
+    args = parser.parse_args()
+
+    if args.run:
+        run_benchmark_case(args.run)
+        sys.exit(0)
+    if not args.config:
+        parser.error('the benchmark configuration is required')
+
+    benchmark_report = run_benchmark(args.config, args.output_dir)
+    with open(args.output, 'w') as f:
+        json.dump(benchmark_report, f, indent=2)
+    print("Benchmark report written to '%s'" % args.output)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            found = compare_reports(benchmark_report, json.load(f))
+        for regression in found:
+            print('Regression: ' + regression)
+        sys.exit(1 if found else 0)
@@ -0,0 +1,217 @@
+# Content-addressed cache of pipeline artifacts (restraints, initial models, alignments)
+import os
+import shutil
+import hashlib
+import tempfile
+
+# Default cache location, relative to the working directory
+CACHE_DIR = '.modeller_cache'
+
+
+# Compute the SHA-256 digest of a file
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Computes the SHA-256 hex digest of a file's content.
+
+    Args:
+        path (str): Path to the file.
+        chunk_size (int, optional): Number of bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        str: The hex digest.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# Combine several inputs into a single cache key
+def content_key(*parts):
+    """
+    Builds a cache key from strings, numbers, booleans and tuples/lists of them. Parts are
+    separated so that ('ab', 'c') and ('a', 'bc') do not collide.
+
+    Returns:
+        str: The hex digest identifying the inputs.
+    """
+
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (list, tuple)):
+            part = content_key(*part)
+        digest.update(repr(part).encode('utf8'))
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+# Find an atom file the way MODELLER does
+def find_atom_file(name, atom_files_directory):
+    """
+    Looks up a template coordinate file in the atom file directories.
+
+    Args:
+        name (str): Atom file name, with or without extension.
+        atom_files_directory (list): Directories searched for atom files.
+
+    Returns:
+        str: Path of the atom file, or None if it was not found.
+    """
+
+    for directory in atom_files_directory:
+        for ext in ('', '.pdb', '.atm', '.ent', '.cif'):
+            path = os.path.join(directory, name + ext)
+            if os.path.isfile(path):
+                return path
+
+    return None
+
+
+# Find the atom files referenced by the structure entries of a PIR alignment
+def alignment_atom_files(alignment_file, atom_files_directory):
+    """
+    Returns the paths of the template coordinate files referenced by the 'structure' entries of a PIR
+    alignment, looked up like MODELLER does in the atom file directories.
+
+    Args:
+        alignment_file (str): PIR alignment filename.
+        atom_files_directory (list): Directories searched for atom files.
+
+    Returns:
+        list: Paths of the atom files that were found, in alignment order.
+    """
+
+    atom_files = []
+    with open(alignment_file, 'r', encoding="utf8", errors='ignore') as f:
+        for line in f:
+            if not line.startswith('structure'):
+                continue
+
+            path = find_atom_file(line.split(':')[1].strip(), atom_files_directory)
+            if path is not None:
+                atom_files.append(path)
+
+    return atom_files
+
+
+# Regular files of a directory with their modification times
+def directory_state(directory='.'):
+    """
+    Records the files of a directory, to find the files a step writes (see produced_files).
+
+    Args:
+        directory (str, optional): Directory to list. Defaults to the working directory.
+
+    Returns:
+        dict: Filename -> modification time (ns).
+    """
+
+    return {x.name: x.stat().st_mtime_ns for x in os.scandir(directory) if x.is_file()}
+
+
+# Files written since an earlier directory_state()
+def produced_files(before, directory='.'):
+    """
+    Lists the files of a directory that were created or modified since `before` was recorded.
+
+    Args:
+        before (dict): Result of directory_state() before the step ran.
+        directory (str, optional): Directory to list. Defaults to the working directory.
+
+    Returns:
+        list: Sorted filenames.
+    """
+
+    return sorted(name for name, mtime in directory_state(directory).items() if before.get(name) != mtime)
+
+
+class ArtifactCache:
+    """
+    Directory of cached artifacts: every key owns a subdirectory holding copies of the files
+    that were produced for it.
+
+    Args:
+        root (str): Cache directory.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def contains(self, key, files):
+        """Returns True if all files are cached under the key."""
+        return all(os.path.isfile(os.path.join(self.path(key), os.path.basename(x))) for x in files)
+
+    def restore(self, key, files, dest='.'):
+        """
+        Copies cached files into the destination directory.
+
+        Args:
+            key (str): Cache key.
+            files (list): Filenames to restore.
+            dest (str, optional): Destination directory. Defaults to the working directory.
+
+        Returns:
+            bool: True if all files were restored, False on a cache miss.
+        """
+
+        if not self.contains(key, files):
+            return False
+
+        for name in files:
+            shutil.copy(os.path.join(self.path(key), os.path.basename(name)), os.path.join(dest, name))
+
+        return True
+
+    def restore_entry(self, key, required=(), dest='.'):
+        """
+        Copies every file cached under the key into the destination directory, e.g. all the files a
+        step wrote, not only the ones the caller reads next.
+
+        Args:
+            key (str): Cache key.
+            required (list, optional): Filenames that must be cached for the entry to count as a hit.
+            dest (str, optional): Destination directory. Defaults to the working directory.
+
+        Returns:
+            list: The restored filenames, or None on a cache miss.
+        """
+
+        if not os.path.isdir(self.path(key)) or not self.contains(key, required):
+            return None
+
+        names = sorted(os.listdir(self.path(key)))
+        for name in names:
+            shutil.copy(os.path.join(self.path(key), name), os.path.join(dest, name))
+
+        return names
+
+    def store(self, key, files):
+        """
+        Stores copies of files under the key. The files are first copied into a temporary directory
+        which is then renamed, so concurrent runs never see a partially written entry.
+
+        Args:
+            key (str): Cache key.
+            files (list): Paths of the files to cache.
+        """
+
+        if self.contains(key, files):
+            return
+
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp_', dir=self.root)
+        for name in files:
+            shutil.copy(name, os.path.join(tmp_dir, os.path.basename(name)))
+
+        try:
+            os.replace(tmp_dir, self.path(key))
+        except OSError:
+            # Another run stored the same key first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -2,33 +2,30 @@
 import os
 import re
 import pickle
-import shutil
-import pandas as pd
 from modeller import *
 from modeller.automodel import *
 from modeller.parallel import Job, LocalWorker
+from model_engine import ModelEngine, TopModelRanking, ConvergenceMonitor, run_pocket_ensemble, run_tiered
+from model_shards import run_concurrent, run_sharded
+from run_config import confirm_overwrite, is_batch_mode
+from cpu_budget import cpu_budget
 
 
 # Calculate number of CPUs for parallel computing
 def calculate_num_cpus(percentage=0.95):
     """
     Calculates the number of CPUs to use for parallel computing, using a
-    percentage of the total available CPUs.
+    percentage of the CPUs available to this process (CPU affinity, cgroup
+    quota and batch scheduler allocation, see cpu_budget.py).
 
     Args:
-        percentage (float, optional): Percentage of total CPUs to use. Defaults to 0.95.
+        percentage (float, optional): Percentage of available CPUs to use. Defaults to 0.95.
 
     Returns:
-        int: The number of CPUs to use for parallel computing.
+        int: The number of CPUs to use for parallel computing (at least 1).
     """
 
-    num_cpus = int(os.cpu_count() * percentage)
-
-    # Ensure at least one CPU is used
-    if num_cpus < 1:
-        num_cpus = 1
-
-    return num_cpus
+    return cpu_budget(percentage)
 
 
 # Generates the MODELLER command with the specified number of workers
@@ -54,7 +51,11 @@ def parallel_setup(num_cpus):
 
 # Create a script check point
 def confirm_continue():
-    """Asks the user for continuation, returns True if 'yes', False otherwise."""
+    """Asks the user for continuation, returns True if 'yes', False otherwise. Batch runs always continue."""
+    if is_batch_mode():
+        print("Batch mode: continuing without confirmation.")
+        return True
+
     while True:
         answer = input("Do you want to continue? (yes/no): ").lower()
         if answer == 'yes':
@@ -75,36 +76,67 @@ def replace_fit_pdb(input_file, output_file):
 
 
 # Adding ligand information into the alignment file
-def process_pir_file(input_file, output_file):
+def process_pir_file(input_file, output_file, num_ligands=1):
+    """
+    Appends ligand block residues ('.') to every entry of a PIR alignment and extends the residue range
+    of the structure entries accordingly.
+
+    Args:
+        input_file (str): Input PIR alignment.
+        output_file (str): Output PIR alignment.
+        num_ligands (int or dict, optional): Number of ligands of every entry, or a dict mapping the
+            alignment code of each structure entry to its number of ligands. With a dict, templates with
+            fewer ligands are padded with gaps and the target gets the largest number. Defaults to 1.
+    """
+
     # Read the input file
     with open(input_file, 'r', encoding="utf8", errors='ignore') as file:
         lines = file.readlines()
 
+    if isinstance(num_ligands, dict):
+        width = max(list(num_ligands.values()) + [0])
+        counts = num_ligands
+    else:
+        width = num_ligands
+        counts = {}
+
     # Find the line starting with "structureX"
     pattern = r'^structureX.*$'
+    code = None
+    blocks = {}  # alignment code -> residues added before "*"
     for i, line in enumerate(lines):
+        if line.startswith('>P1;'):
+            code = line[4:].strip()
+            blocks[code] = '.' * width
         if re.match(pattern, line):
-            # Find the fifth column and increment its value by 1
+            count = counts.get(code, 0) if counts else width
+            blocks[code] = '.' * count + '-' * (width - count)
+
+            # Find the fifth column and increment its value by the number of ligands
             columns = line.split(':')
             if len(columns) >= 5:
                 try:
                     number = columns[4].lstrip('+')  # Remove the leading "+"
                     number = int(number)
-                    columns[4] = '+' + str(number + 1)  # Add the "+" back
+                    columns[4] = '+' + str(number + count)  # Add the "+" back
                     lines[i] = ':'.join(columns)
 
                 except ValueError:
                     print('Invalid number in the fifth column.')
 
-    # Add "." before "*" in each line
+    # Add the ligand residues of every entry before "*"
+    code = None
     for i, line in enumerate(lines):
-        lines[i] = line.replace('*', '.*')
+        if line.startswith('>P1;'):
+            code = line[4:].strip()
+        elif '*' in line:
+            lines[i] = line.replace('*', blocks.get(code, '.' * width) + '*')
 
     # Check if the output file already exists
     if os.path.exists(output_file):
-        # Prompt the user for confirmation to replace the file
-        user_input = input(f"File '{output_file}' already exists. Do you want to replace it? (y/n): ")
-        if user_input.lower() != 'y':
+        # Prompt the user for confirmation to replace the file (or apply the batch policy)
+        prompt = f"File '{output_file}' already exists. Do you want to replace it? (y/n): "
+        if not confirm_overwrite(prompt, 'alignment'):
             print('Operation cancelled. Output file was not replaced.')
             return
 
@@ -115,8 +147,34 @@ def process_pir_file(input_file, output_file):
     print(f"Output file '{output_file}' has been created.")
 
 
+# Build the models with the streaming engine, or across independent shard processes
+def _build_models(alignment_file, knowns, target_seq_code, start_index, end_index, include_ligand, num_cpus,
+                  template_mode, loop_range, top_k, batch_size, convergence, resume, num_shards, refine_top=None,
+                  loop_top_k=None, loop_dope_threshold=None):
+    if refine_top:
+        if num_shards > 1:
+            raise ValueError("Tiered modeling (refine_top) runs in one process; it cannot be combined with num_shards")
+        return run_tiered(alignment_file, knowns, target_seq_code, start_index, end_index, include_ligand, num_cpus,
+                          refine_top, template_mode=template_mode, loop_range=loop_range, top_k=top_k,
+                          batch_size=batch_size, convergence=convergence, resume=resume, loop_top_k=loop_top_k,
+                          loop_dope_threshold=loop_dope_threshold)
+
+    if num_shards > 1:
+        return run_sharded(alignment_file, knowns, target_seq_code, start_index, end_index, include_ligand,
+                           num_cpus, num_shards, template_mode=template_mode, loop_range=loop_range, top_k=top_k,
+                           batch_size=batch_size, convergence=convergence, resume=resume, loop_top_k=loop_top_k,
+                           loop_dope_threshold=loop_dope_threshold)
+
+    engine = ModelEngine(alignment_file, knowns, target_seq_code, start_index, end_index, include_ligand, num_cpus,
+                         template_mode=template_mode, loop_range=loop_range, top_k=top_k, batch_size=batch_size,
+                         convergence=convergence, resume=resume, loop_top_k=loop_top_k,
+                         loop_dope_threshold=loop_dope_threshold)
+    return engine.run()
+
+
 # Homology modeling of single template model
-def single_auto_model(alignment_file, template_code, target_seq_code, start_index, end_index, include_ligand, num_cpus):
+def single_auto_model(alignment_file, template_code, target_seq_code, start_index, end_index, include_ligand, num_cpus,
+                      top_k=10, batch_size=None, convergence=None, resume=False, num_shards=1, refine_top=None):
     """
     This function performs homology modeling using Modeller based-on single template.
     It takes input parameters, generates models, ranks them based on DOPE score, and saves the top model.
@@ -129,76 +187,27 @@ def single_auto_model(alignment_file, template_code, target_seq_code, start_inde
         end_index (int): Index of the last model to generate.
         include_ligand (bool): Whether to include HETATM records.
         num_cpus (int): Number of CPUs to use for parallel processing.
-    """
-
-    # Step 1: Parallel Configuration Setup
-    j = Job()
-    for _ in range(num_cpus):
-        j.append(LocalWorker())
-
-    # Step 2: Modeller Environment Setup
-    env = Environ()  # Create a new Modeller environment
-    env.io.atom_files_directory = ['.', '../atom_files/']  # Set input atom file directories
-
-    if include_ligand:
-        env.io.hetatm = True  # Read HETATM records from template PDBs
-
-    # Step 3: Model Generation
-    a = AutoModel(env,
-                  alnfile=alignment_file,
-                  knowns=template_code,
-                  sequence=target_seq_code,
-                  assess_methods=(assess.DOPE, assess.GA341))
-
-    a.starting_model = start_index
-    a.ending_model = end_index
-
-    a.use_parallel_job(j)  # Enable parallel processing
-
-    a.md_level = refine.slow  # Set a slow MD optimization level
-
-    a.library_schedule = autosched.slow  # Set a slow optimization schedule
-    a.max_var_iterations = 300  # Increase maximum variable iterations
-    a.repeat_optimization = 3  # Repeat optimization 3 times
-    a.max_molpdf = 1e6  # Set a maximum objective function value
-
-    a.make()  # Build the models
-
-    # Step 4: Summarize the outputs
-    ok_models_single = [x for x in a.outputs]  # List all generated models
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        batch_size (int, optional): Number of models built between summary flushes. Defaults to
+            num_cpus (fewer with convergence, see default_batch_size).
+        convergence (ConvergenceMonitor, optional): Stop generating models once the DOPE ranking has converged.
+        resume (bool, optional): Keep completed models of an interrupted run and build only the missing ones.
+        num_shards (int, optional): Split the model indices across this many independent processes. Defaults to 1.
+        refine_top (int, optional): Screen all models with fast settings and refine only this many of the best
+            ones with the slow settings (run_tiered). Defaults to None (every model is built slowly).
 
-    # Save all modeller outputs to pickle format
-    with open('output_models_single.pickle', "wb") as f:
-        pickle.dump(ok_models_single, f)
-
-    # Export summary output to dataframe
-    data_single = a.outputs
-
-    # Convert the list of dictionaries to a dataframe
-    df_single = pd.DataFrame(data_single)
-
-    # Write the summary of model evaluating score
-    df_single.to_csv('summary_single_model.csv', sep=",", header=True, index=True, index_label='model')
-
-    # Step 5: Rank the models by DOPE score
-    key = 'DOPE score'
-    ok_models_single.sort(key=lambda a: a[key])
-
-    # Get top model
-    mtop_single = ok_models_single[0]
-    print("Top single model: %s (DOPE score %.3f)" % (mtop_single['name'], mtop_single[key]))
-
-    # Save the top single model to pickle format
-    with open('mtop_single.pickle', "wb") as f:
-        pickle.dump(mtop_single, f)
+    Returns:
+        dict: The top model.
+    """
 
-    # Rename the best model's pdb file
-    shutil.copy(mtop_single['name'], 'best_single_model.pdb')
+    return _build_models(alignment_file, template_code, target_seq_code, start_index, end_index, include_ligand,
+                         num_cpus, 'single', None, top_k, batch_size, convergence, resume, num_shards, refine_top)
 
 
 # Homology modeling of multiple template model
 def mult_auto_model(alignment_file, template_tuple, target_seq_code, start_index, end_index, include_ligand,
-                    num_cpus):
+                    num_cpus, top_k=10, batch_size=None, convergence=None, resume=False, num_shards=1,
+                    refine_top=None):
     """
     This function performs homology modeling using Modeller based-on multiple template.
     It takes input parameters, generates models, ranks them based on DOPE score, and saves the top model.
@@ -211,80 +220,31 @@ def mult_auto_model(alignment_file, template_tuple, target_seq_code, start_index
         end_index (int): Index of the last model to generate.
         include_ligand (bool): Whether to include HETATM records.
         num_cpus (int): Number of CPUs to use for parallel processing.
-    """
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        batch_size (int, optional): Number of models built between summary flushes. Defaults to
+            num_cpus (fewer with convergence, see default_batch_size).
+        convergence (ConvergenceMonitor, optional): Stop generating models once the DOPE ranking has converged.
+        resume (bool, optional): Keep completed models of an interrupted run and build only the missing ones.
+        num_shards (int, optional): Split the model indices across this many independent processes. Defaults to 1.
+        refine_top (int, optional): Screen all models with fast settings and refine only this many of the best
+            ones with the slow settings (run_tiered). Defaults to None (every model is built slowly).
 
-    # Step 1: Parallel Configuration Setup
-    j = Job()
-    for _ in range(num_cpus):
-        j.append(LocalWorker())
-
-    # Step 2: Modeller Environment Setup
-    env = Environ()  # Create a new Modeller environment
-    env.io.atom_files_directory = ['.', '../atom_files/']  # Set input atom file directories
-
-    if include_ligand:
-        env.io.hetatm = True  # Read HETATM records from template PDBs
+    Returns:
+        dict: The top model.
+    """
 
     if os.path.isfile('template_multiple_tuple.pickle'):
         with open('template_multiple_tuple.pickle', "rb") as f:
             template_tuple = pickle.load(f)
 
-    # Step 3: Model Generation
-    a = AutoModel(env,
-                  alnfile=alignment_file,
-                  knowns=template_tuple,
-                  sequence=target_seq_code,
-                  assess_methods=(assess.DOPE, assess.GA341))
-
-    a.starting_model = start_index
-    a.ending_model = end_index
-
-    a.use_parallel_job(j)  # Enable parallel processing
-
-    a.md_level = refine.slow  # Set a slow MD optimization level
-
-    a.library_schedule = autosched.slow  # Set a slow optimization schedule
-    a.max_var_iterations = 300  # Increase maximum variable iterations
-    a.repeat_optimization = 3  # Repeat optimization 3 times
-    a.max_molpdf = 1e6  # Set a maximum objective function value
-
-    a.make()  # Build the models
-
-    # Step 4: Summarize the outputs
-    ok_models_mult = [x for x in a.outputs]  # List all generated models
-
-    # Save all modeller outputs to pickle format
-    with open('output_models_single.pickle', "wb") as f:
-        pickle.dump(ok_models_mult, f)
-
-    # Export summary output to dataframe
-    data_mult = a.outputs
-
-    # Convert the list of dictionaries to a dataframe
-    df_mult = pd.DataFrame(data_mult)
-
-    # Write the summary of model evaluating score
-    df_mult.to_csv('summary_mult_model.csv', sep=",", header=True, index=True, index_label='model')
-
-    # Step 5: Rank the models by DOPE score
-    key = 'DOPE score'
-    ok_models_mult.sort(key=lambda a: a[key])
-
-    # Get top model
-    mtop_mult = ok_models_mult[0]
-    print("Top multi-template model: %s (DOPE score %.3f)" % (mtop_mult['name'], mtop_mult[key]))
-
-    # Save the top single model to pickle format
-    with open('mtop_mult.pickle', "wb") as f:
-        pickle.dump(mtop_mult, f)
-
-    # Rename the best model's pdb file
-    shutil.copy(mtop_mult['name'], 'best_mult_model.pdb')
+    return _build_models(alignment_file, template_tuple, target_seq_code, start_index, end_index, include_ligand,
+                         num_cpus, 'mult', None, top_k, batch_size, convergence, resume, num_shards, refine_top)
 
 
 # Homology modeling of single-template model with AutoLoop Refinement
 def single_loop_model(alignment_file, template_code, target_seq_code, start_index, end_index, start_loop_index,
-                      end_loop_index, include_ligand, num_cpus):
+                      end_loop_index, include_ligand, num_cpus, top_k=10, batch_size=None, convergence=None,
+                      resume=False, num_shards=1, refine_top=None, loop_top_k=None, loop_dope_threshold=None):
     """
     This function performs homology modeling using Modeller based on single template and performs an automatic
     loop refinement. It takes input parameters, generates models, ranks them based on DOPE score, and saves
@@ -300,91 +260,32 @@ def single_loop_model(alignment_file, template_code, target_seq_code, start_inde
         end_loop_index (int): Index of the last loop model to generate.
         include_ligand (bool): Whether to include HETATM records.
         num_cpus (int): Number of CPUs to use for parallel processing.
-    """
-
-    # Step 1: Parallel Configuration Setup
-    j = Job()
-    for _ in range(num_cpus):
-        j.append(LocalWorker())
-
-    # Step 2: Modeller Environment Setup
-    env = Environ()  # Create a new Modeller environment
-    env.io.atom_files_directory = ['.', '../atom_files/']  # Set input atom file directories
-
-    if include_ligand:
-        env.io.hetatm = True  # Read HETATM records from template PDBs
-
-    # Step 3: Model Generation
-    a = LoopModel(env,
-                  alnfile=alignment_file,
-                  knowns=template_code,
-                  sequence=target_seq_code,
-                  assess_methods=(assess.DOPE, assess.GA341),
-                  loop_assess_methods=(assess.DOPE, assess.GA341))
-
-    a.starting_model = start_index
-    a.ending_model = end_index
-
-    a.loop.starting_model = start_loop_index
-    a.loop.ending_model = end_loop_index
-
-    a.use_parallel_job(j)  # Enable parallel processing
-
-    a.md_level = refine.slow  # Set a slow MD optimization level
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        batch_size (int, optional): Number of core models built between summary flushes. Defaults to
+            num_cpus (fewer with convergence, see default_batch_size).
+        convergence (ConvergenceMonitor, optional): Stop generating models once the DOPE ranking has converged.
+        resume (bool, optional): Keep completed models of an interrupted run and build only the missing ones.
+        num_shards (int, optional): Split the model indices across this many independent processes. Defaults to 1.
+        refine_top (int, optional): Screen all models with fast settings and refine only this many of the best
+            ones with the slow settings (run_tiered). Defaults to None (every model is built slowly).
+        loop_top_k (int, optional): Refine the loops of this many best core models only, after all core models
+            are built. Defaults to None (loops of every core model are refined).
+        loop_dope_threshold (float, optional): With loop_top_k, refine only the segments whose normalized DOPE
+            profile exceeds this value instead of the automatically selected loops. Defaults to None.
 
-    a.library_schedule = autosched.slow  # Set a slow optimization schedule
-    a.max_var_iterations = 300  # Increase maximum variable iterations
-    a.repeat_optimization = 3  # Repeat optimization 3 times
-    a.max_molpdf = 1e6  # Set a maximum objective function value
-
-    a.make()  # Build the models
-
-    # Step 4: Summarize the outputs
-    ok_models_single = [x for x in a.outputs]  # List all generated core models
-    ok_models_loop = [x for x in a.loop.outputs]  # List all generated loop models
-    ok_models = ok_models_single + ok_models_loop  # Combine all results
-
-    # Save all modeller outputs to pickle format
-    with open('output_loop_single.pickle', "wb") as f:
-        pickle.dump(ok_models, f)
-
-    # Export summary output to dataframe
-    data_single = a.outputs
-    data_loop = a.loop.outputs
-
-    # Update the value of 'failure' key in each dictionary to string
-    # for key in data_single:
-    #    key['failure'] = str(key['failure'])
-    # for key in data_loop:
-    #    key['failure'] = str(key['failure'])
-
-    # Convert the list of dictionaries to a dataframe
-    df_single = pd.DataFrame(data_single)
-    df_loop = pd.DataFrame(data_loop)
-
-    # Write the summary of model evaluating score
-    df_single.to_csv('summary_single_model.csv', sep=",", header=True, index=True, index_label='model')
-    df_loop.to_csv('summary_loop_single_model.csv', sep=",", header=True, index=True, index_label='model')
-
-    # Step 5: Rank the models by DOPE score
-    key = 'DOPE score'
-    ok_models.sort(key=lambda a: a[key])
-
-    # Get top model
-    mtop_single = ok_models[0]
-    print("Top single model: %s (DOPE score %.3f)" % (mtop_single['name'], mtop_single[key]))
-
-    # Save the top single model to pickle format
-    with open('mtop_single.pickle', "wb") as f:
-        pickle.dump(mtop_single, f)
+    Returns:
+        dict: The top model (core or loop model).
+    """
 
-    # Rename the best model's pdb file
-    shutil.copy(mtop_single['name'], 'best_single_model.pdb')
+    return _build_models(alignment_file, template_code, target_seq_code, start_index, end_index, include_ligand,
+                         num_cpus, 'single', (start_loop_index, end_loop_index), top_k, batch_size, convergence,
+                         resume, num_shards, refine_top, loop_top_k, loop_dope_threshold)
 
 
 # Homology modeling of multi-template model with AutoLoop Refinement
 def mult_loop_model(alignment_file, template_tuple, target_seq_code, start_index, end_index, start_loop_index,
-                    end_loop_index, include_ligand, num_cpus):
+                    end_loop_index, include_ligand, num_cpus, top_k=10, batch_size=None, convergence=None,
+                    resume=False, num_shards=1, refine_top=None, loop_top_k=None, loop_dope_threshold=None):
     """
     This function performs homology modeling using Modeller based on multiple templates and performs an automatic
     loop refinement. It takes input parameters, generates models, ranks them based on DOPE score, and saves
@@ -400,87 +301,117 @@ def mult_loop_model(alignment_file, template_tuple, target_seq_code, start_index
         end_loop_index (int): Index of the last loop model to generate.
         include_ligand (bool): Whether to include HETATM records.
         num_cpus (int): Number of CPUs to use for parallel processing.
-    """
-
-    # Step 1: Parallel Configuration Setup
-    j = Job()
-    for _ in range(num_cpus):
-        j.append(LocalWorker())
-
-    # Step 2: Modeller Environment Setup
-    env = Environ()  # Create a new Modeller environment
-    env.io.atom_files_directory = ['.', '../atom_files/']  # Set input atom file directories
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        batch_size (int, optional): Number of core models built between summary flushes. Defaults to
+            num_cpus (fewer with convergence, see default_batch_size).
+        convergence (ConvergenceMonitor, optional): Stop generating models once the DOPE ranking has converged.
+        resume (bool, optional): Keep completed models of an interrupted run and build only the missing ones.
+        num_shards (int, optional): Split the model indices across this many independent processes. Defaults to 1.
+        refine_top (int, optional): Screen all models with fast settings and refine only this many of the best
+            ones with the slow settings (run_tiered). Defaults to None (every model is built slowly).
+        loop_top_k (int, optional): Refine the loops of this many best core models only, after all core models
+            are built. Defaults to None (loops of every core model are refined).
+        loop_dope_threshold (float, optional): With loop_top_k, refine only the segments whose normalized DOPE
+            profile exceeds this value instead of the automatically selected loops. Defaults to None.
 
-    if include_ligand:
-        env.io.hetatm = True  # Read HETATM records from template PDBs
+    Returns:
+        dict: The top model (core or loop model).
+    """
 
     if os.path.isfile('template_multiple_tuple.pickle'):
         with open('template_multiple_tuple.pickle', "rb") as f:
             template_tuple = pickle.load(f)
 
-    # Step 3: Model Generation
-    a = LoopModel(env,
-                  alnfile=alignment_file,
-                  knowns=template_tuple,
-                  sequence=target_seq_code,
-                  assess_methods=(assess.DOPE, assess.GA341),
-                  loop_assess_methods=(assess.DOPE, assess.GA341))
+    return _build_models(alignment_file, template_tuple, target_seq_code, start_index, end_index, include_ligand,
+                         num_cpus, 'mult', (start_loop_index, end_loop_index), top_k, batch_size, convergence,
+                         resume, num_shards, refine_top, loop_top_k, loop_dope_threshold)
 
-    a.starting_model = start_index
-    a.ending_model = end_index
 
-    a.loop.starting_model = start_loop_index
-    a.loop.ending_model = end_loop_index
+# Pocket-focused ensemble of docking receptors
+def pocket_ensemble_model(alignment_file, knowns, target_seq_code, start_index, end_index, num_cpus,
+                          template_mode='single', pocket_radius=8.0, pocket_deviation=1.0, top_k=10, resume=False):
+    """
+    This function builds one full model with the template ligands and generates the rest of the ensemble
+    by re-optimizing only the residues around the ligands, keeping the other atoms fixed. It ranks the
+    ensemble based on DOPE score and saves the top model.
 
-    a.use_parallel_job(j)  # Enable parallel processing
+    Args:
+        alignment_file (str): Alignment input filename with ligand positions (see process_pir_file).
+        knowns (str or tuple): Code(s) of the templates in the alignment file.
+        target_seq_code (str): Code of target in the alignment file.
+        start_index (int): Index of the full model.
+        end_index (int): Index of the last ensemble member.
+        num_cpus (int): Number of CPUs to use for parallel processing.
+        template_mode (str, optional): 'single' or 'mult', selects the output filenames. Defaults to 'single'.
+        pocket_radius (float, optional): Distance (angstroms) from the ligands of the re-optimized residues.
+            Defaults to 8.0.
+        pocket_deviation (float, optional): Randomization (angstroms) of the pocket atoms. Defaults to 1.0.
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        resume (bool, optional): Keep completed models of an interrupted run and build only the missing ones.
 
-    a.md_level = refine.slow  # Set a slow MD optimization level
+    Returns:
+        dict: The top model.
+    """
 
-    a.library_schedule = autosched.slow  # Set a slow optimization schedule
-    a.max_var_iterations = 300  # Increase maximum variable iterations
-    a.repeat_optimization = 3  # Repeat optimization 3 times
-    a.max_molpdf = 1e6  # Set a maximum objective function value
+    return run_pocket_ensemble(alignment_file, knowns, target_seq_code, start_index, end_index, num_cpus,
+                               pocket_radius=pocket_radius, pocket_deviation=pocket_deviation,
+                               template_mode=template_mode, top_k=top_k, resume=resume)
 
-    a.make()  # Build the models
 
-    # Step 4: Summarize the outputs
-    ok_models_mult = [x for x in a.outputs]  # List all generated core models
-    ok_models_loop = [x for x in a.loop.outputs]  # List all generated loop models
-    ok_models = ok_models_mult + ok_models_loop  # Combine all results
+# Describe one modeling branch of concurrent_model
+def model_branch(alignment_file, knowns, target_seq_code, start_index, end_index, include_ligand, template_mode,
+                 start_loop_index=None, end_loop_index=None, top_k=10, num_shards=1, batch_size=None, convergence=None,
+                 resume=False, loop_top_k=None, loop_dope_threshold=None):
+    """
+    Collects the inputs of a single-template or multi-template modeling run for concurrent_model.
 
-    # Save all modeller outputs to pickle format
-    with open('output_loop_multiple.pickle', "wb") as f:
-        pickle.dump(ok_models, f)
+    Args:
+        alignment_file (str): Alignment input filename.
+        knowns (str or tuple): Code(s) of the templates in the alignment file.
+        target_seq_code (str): Code of target in the alignment file.
+        start_index (int): Index of the first core model to generate.
+        end_index (int): Index of the last core model to generate.
+        include_ligand (bool): Whether to include HETATM records.
+        template_mode (str): 'single' or 'mult'.
+        start_loop_index (int, optional): Index of the first loop model. Enables LoopModel when given.
+        end_loop_index (int, optional): Index of the last loop model.
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        num_shards (int, optional): Number of processes of the branch with a fixed CPU split. Defaults to 1.
+        batch_size (int, optional): Number of core models per batch within a process.
+        convergence (ConvergenceMonitor, optional): Adaptive sampling criterion, applied by every process of the
+            branch to its own models.
+        resume (bool, optional): Keep completed models of an interrupted run and build only the missing ones.
+        loop_top_k (int, optional): Refine the loops of this many best core models of the branch only.
+        loop_dope_threshold (float, optional): Refine only the residue segments above this DOPE profile value.
 
-    # Export summary output to dataframe
-    data_mult = a.outputs
-    data_loop = a.loop.outputs
+    Returns:
+        dict: The branch description.
+    """
 
-    # Update the value of 'failure' key in each dictionary to string
-    # for key in data_mult:
-    #    key['failure'] = str(key['failure'])
-    # for key in data_loop:
-    #    key['failure'] = str(key['failure'])
+    loop_range = None if start_loop_index is None else (start_loop_index, end_loop_index)
 
-    # Convert the list of dictionaries to a dataframe
-    df_mult = pd.DataFrame(data_mult)
-    df_loop = pd.DataFrame(data_loop)
+    return {'alignment_file': alignment_file, 'knowns': knowns, 'sequence': target_seq_code,
+            'start_index': start_index, 'end_index': end_index, 'include_ligand': include_ligand,
+            'template_mode': template_mode, 'loop_range': loop_range, 'top_k': top_k, 'num_shards': num_shards,
+            'batch_size': batch_size, 'convergence': convergence, 'resume': resume, 'loop_top_k': loop_top_k,
+            'loop_dope_threshold': loop_dope_threshold}
 
-    # Write the summary of model evaluating score
-    df_mult.to_csv('summary_mult_model.csv', sep=",", header=True, index=True, index_label='model')
-    df_loop.to_csv('summary_loop_mult_model.csv', sep=",", header=True, index=True, index_label='model')
 
-    # Step 5: Rank the models by DOPE score
-    key = 'DOPE score'
-    ok_models.sort(key=lambda a: a[key])
+# Homology modeling of several branches (single-template and multi-template) at the same time
+def concurrent_model(branches, num_cpus, cpu_split=None, num_slots=4):
+    """
+    Builds the models of all branches concurrently in separate working directories and writes the
+    summary files, top model pickle and best model PDB of every branch, as the *_model functions do.
 
-    # Get top model
-    mtop_mult = ok_models[0]
-    print("Top multiple model: %s (DOPE score %.3f)" % (mtop_mult['name'], mtop_mult[key]))
+    Args:
+        branches (list): Branches created with model_branch.
+        num_cpus (int): Total number of CPUs shared by the branches.
+        cpu_split (list, optional): Fraction of num_cpus given to each branch, e.g. [0.5, 0.5].
+            Defaults to shared CPU slots, where a branch that finishes early leaves its CPUs to the others.
+        num_slots (int, optional): Number of model processes running at once with shared slots. Defaults to 4.
 
-    # Save the top multiple model to pickle format
-    with open('mtop_multiple.pickle', "wb") as f:
-        pickle.dump(mtop_mult, f)
+    Returns:
+        list: The top model of every branch.
+    """
 
-    # Rename the best model's pdb file
-    shutil.copy(mtop_mult['name'], 'best_mult_model.pdb')
+    return run_concurrent(branches, num_cpus, cpu_split=cpu_split, num_slots=num_slots)
@@ -0,0 +1,151 @@
+# CPU budget of the pipeline: CPU affinity, cgroup quota and batch scheduler allocations
+import os
+import math
+
+from run_config import NUM_CPUS_ENV
+
+# cgroup filesystem mount point
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# Environment variables of batch schedulers holding the number of allocated CPUs
+SCHEDULER_ENV = ('SLURM_CPUS_PER_TASK',  # Slurm, --cpus-per-task
+                 'SLURM_JOB_CPUS_PER_NODE',  # Slurm, e.g. '16' or '16(x2)'
+                 'PBS_NUM_PPN',  # Torque/PBS
+                 'NCPUS',  # PBS Pro
+                 'NSLOTS',  # Grid Engine
+                 'LSB_DJOB_NUMPROC')  # LSF
+
+
+# Number of CPUs this process may run on
+def affinity_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Paths of the cgroup of this process, keyed by controller ('' for cgroup v2)
+def _cgroup_paths(proc_file='/proc/self/cgroup'):
+    paths = {}
+    try:
+        with open(proc_file, 'r') as f:
+            for line in f:
+                _, controllers, path = line.rstrip('\n').split(':', 2)
+                for controller in controllers.split(','):
+                    paths[controller] = path
+    except (OSError, ValueError):
+        pass
+    return paths
+
+
+# Read a cgroup file, or None
+def _read_cgroup_file(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+# CPU quota of the cgroup (v2 cpu.max, v1 cpu.cfs_quota_us/cpu.cfs_period_us)
+def cgroup_cpu_limit():
+    """
+    Reads the CPU quota of the cgroup of this process and of its parent cgroups.
+
+    Returns:
+        float: The quota in CPUs (e.g. 2.5), or None if the CPU time is not limited.
+    """
+
+    limits = []
+    paths = _cgroup_paths()
+
+    # cgroup v2: "<quota> <period>" or "max <period>" in cpu.max of every level of the hierarchy
+    if '' in paths:
+        path = paths['']
+        while True:
+            value = _read_cgroup_file(os.path.join(CGROUP_ROOT, path.lstrip('/'), 'cpu.max'))
+            if value and not value.startswith('max'):
+                quota, period = value.split()
+                limits.append(int(quota) / int(period))
+            if path in ('', '/'):
+                break
+            path = os.path.dirname(path)
+
+    # cgroup v1: cpu.cfs_quota_us is -1 when the CPU time is not limited
+    if 'cpu' in paths:
+        for directory in ('cpu', 'cpu,cpuacct', 'cpuacct,cpu'):
+            base = os.path.join(CGROUP_ROOT, directory)
+            for path in (os.path.join(base, paths['cpu'].lstrip('/')), base):
+                quota = _read_cgroup_file(os.path.join(path, 'cpu.cfs_quota_us'))
+                period = _read_cgroup_file(os.path.join(path, 'cpu.cfs_period_us'))
+                if quota and period and int(quota) > 0:
+                    limits.append(int(quota) / int(period))
+                    break
+
+    return min(limits) if limits else None
+
+
+# Number of CPUs allocated by a batch scheduler
+def scheduler_cpus():
+    """
+    Reads the CPU allocation of Slurm, PBS, Grid Engine or LSF from the environment.
+
+    Returns:
+        int: The number of allocated CPUs on this node, or None outside a batch job.
+    """
+
+    for name in SCHEDULER_ENV:
+        value = os.environ.get(name)
+        if not value:
+            continue
+        try:
+            # Slurm lists the CPUs of every node, e.g. '16(x2),8': the first entry is this node's
+            return int(value.split(',')[0].split('(')[0])
+        except ValueError:
+            continue
+
+    return None
+
+
+# All CPU limits of this process
+def cpu_limits():
+    """
+    Collects the CPU limits of this process.
+
+    Returns:
+        dict: 'affinity', 'cgroup', 'scheduler' and 'assigned' (the share given by batch_driver.py through
+            MODELLER_SCRIPTS_NUM_CPUS); limits that do not apply are None.
+    """
+
+    assigned = os.environ.get(NUM_CPUS_ENV)
+    return {'affinity': affinity_cpus(),
+            'cgroup': cgroup_cpu_limit(),
+            'scheduler': scheduler_cpus(),
+            'assigned': int(assigned) if assigned and int(assigned) > 0 else None}
+
+
+# CPUs this process can actually use
+def available_cpus():
+    """Returns the smallest of the CPU limits (a fractional cgroup quota is rounded down), at least 1."""
+    limits = [x for x in cpu_limits().values() if x is not None]
+    return max(int(math.floor(min(limits))), 1)
+
+
+# Share of the available CPUs used by one stage
+def cpu_budget(fraction=1.0):
+    """
+    Computes the number of CPUs of a stage from the CPUs this process can use.
+
+    Args:
+        fraction (float, optional): Share of the available CPUs. Defaults to 1.0.
+
+    Returns:
+        int: The number of CPUs, at least 1.
+    """
+
+    return max(int(available_cpus() * fraction), 1)
+
+
+if __name__ == "__main__":
+    for source, limit in cpu_limits().items():
+        print("%-9s %s" % (source, limit if limit is not None else '-'))
+    print("available %d" % available_cpus())
@@ -0,0 +1,1225 @@
+# Model-generation engine shared by the AutoModel/LoopModel modeling modes
+import os
+import heapq
+import pickle
+import time
+import shutil
+import pandas as pd
+import modeller
+from modeller import *
+from modeller.automodel import *
+from modeller.scripts import complete_pdb
+from content_cache import CACHE_DIR, ArtifactCache, alignment_atom_files, content_key, file_digest
+from score_store import ScoreStore, first_chain_selection, structure_key
+from results_store import ResultsStore, new_run_id, parse_model_name, results_store_available
+from run_journal import RunJournal, input_hash
+from worker_pool import shared_job
+
+# Score used to rank the models (lower is better)
+DOPE_KEY = 'DOPE score'
+
+# Output filenames of every modeling mode, keyed by (template mode, loop refinement)
+OUTPUT_FILES = {
+    ('single', False): {'outputs': 'output_models_single.pickle',
+                        'summary': 'summary_single_model.csv',
+                        'loop_summary': None,
+                        'top': 'top_single_models.csv',
+                        'convergence': 'convergence_single_model.csv',
+                        'mtop': 'mtop_single.pickle',
+                        'best': 'best_single_model.pdb',
+                        'title': 'Top single model'},
+    ('mult', False): {'outputs': 'output_models_mult.pickle',
+                      'summary': 'summary_mult_model.csv',
+                      'loop_summary': None,
+                      'top': 'top_mult_models.csv',
+                      'convergence': 'convergence_mult_model.csv',
+                      'mtop': 'mtop_mult.pickle',
+                      'best': 'best_mult_model.pdb',
+                      'title': 'Top multi-template model'},
+    ('single', True): {'outputs': 'output_loop_single.pickle',
+                       'summary': 'summary_single_model.csv',
+                       'loop_summary': 'summary_loop_single_model.csv',
+                       'top': 'top_single_models.csv',
+                       'convergence': 'convergence_single_model.csv',
+                       'mtop': 'mtop_single.pickle',
+                       'best': 'best_single_model.pdb',
+                       'title': 'Top single model'},
+    ('mult', True): {'outputs': 'output_loop_multiple.pickle',
+                     'summary': 'summary_mult_model.csv',
+                     'loop_summary': 'summary_loop_mult_model.csv',
+                     'top': 'top_mult_models.csv',
+                     'convergence': 'convergence_mult_model.csv',
+                     'mtop': 'mtop_multiple.pickle',
+                     'best': 'best_mult_model.pdb',
+                     'title': 'Top multiple model'},
+}
+
+
+# Reuse the restraints of the first batch in the following batches and in later runs
+class _RestraintReuseMixin:
+    """
+    Skips the derivation of the homology and stereochemical restraints (the .rsr file of the target
+    sequence) when an earlier batch of the same run has already written them, or when the restraint
+    cache holds them for the same alignment, templates and settings. The topology and the initial
+    model are still built as usual; only the restraint generation is replaced by reading the file.
+    """
+
+    reuse_restraints = False
+    restraint_cache = None  # ArtifactCache shared between runs
+    restraint_key = None
+    _restraints_restored = False
+
+    # Bring back the restraints file of an earlier batch or run
+    def _restore_restraints(self):
+        if self.reuse_restraints and os.path.isfile(self.csrfile):
+            return True
+
+        if self.restraint_cache is not None and self.restraint_cache.restore(self.restraint_key, [self.csrfile]):
+            print('Restraints restored from the cache (%s)' % self.restraint_key[:12])
+            return True
+
+        return False
+
+    def homcsr(self, exit_stage):
+        self._restraints_restored = False
+        super().homcsr(exit_stage)
+
+        # exit_stage 1 stops right after the restraints, 2 before them
+        if self.restraint_cache is not None and exit_stage < 2 and not self._restraints_restored:
+            self.restraint_cache.store(self.restraint_key, [self.csrfile])
+
+    def mkhomcsr(self, selected_atoms, aln):
+        if self._restore_restraints():
+            self._restraints_restored = True
+            self.restraints.clear()
+            self.restraints.append(file=self.csrfile)
+            return
+
+        super().mkhomcsr(selected_atoms, aln)
+
+    def special_restraints(self, aln):
+        # The restored file already holds the special restraints
+        if not self._restraints_restored:
+            super().special_restraints(aln)
+
+
+# Start the optimization of given model indices from existing coordinates
+class _StartModelMixin:
+    """
+    Reads the initial coordinates of a model index from an existing file (e.g. the randomized start
+    coordinates recorded by the fast screening tier) instead of the initial model. Set rand_method to
+    None to keep these coordinates unperturbed. With record_start_models, the coordinates every model
+    starts its optimization from (the initial model after rand_method) are written to
+    start_model_filename(sequence, index).
+    """
+
+    start_models = None  # model index -> PDB file with the starting coordinates
+    record_start_models = False
+    _current_model = None
+
+    def single_model(self, atmsel, num, parallel=False):
+        self._current_model = num
+        if not self.record_start_models or not self.rand_method:
+            return super().single_model(atmsel, num, parallel)
+
+        rand_method = self.rand_method
+
+        def randomize_and_record(selection):
+            rand_method(selection)
+            self.write(file=start_model_filename(self.sequence, num))
+
+        self.rand_method = randomize_and_record
+        try:
+            return super().single_model(atmsel, num, parallel)
+        finally:
+            self.rand_method = rand_method
+
+    def read_initial_model(self):
+        if self.start_models and self._current_model in self.start_models:
+            self.read(file=self.start_models[self._current_model])
+        else:
+            super().read_initial_model()
+
+
+# Optimize only the atoms around the ligands
+class _PocketMixin:
+    """
+    Restricts the optimization to the residues within pocket_radius angstroms of the HETATM ligands
+    (the ligands themselves stay at their template position); all other atoms keep the coordinates
+    of the initial model.
+    """
+
+    pocket_radius = None
+
+    def select_atoms(self):
+        if self.pocket_radius is None:
+            return super().select_atoms()
+
+        ligands = [r for r in self.residues if r.hetatm]
+        if not ligands:
+            raise ModellerError('Pocket modeling needs HETATM ligands in the model (include_ligand=True).')
+
+        ligand = Selection(*ligands)
+        return ligand.select_sphere(self.pocket_radius).by_residue() - ligand
+
+
+class PocketRandomizer:
+    """Randomizes the selected atoms by a small deviation (a picklable rand_method for parallel jobs)."""
+
+    def __init__(self, deviation):
+        self.deviation = deviation
+
+    def __call__(self, atmsel):
+        atmsel.randomize_xyz(deviation=self.deviation)
+
+
+class StreamingAutoModel(_PocketMixin, _StartModelMixin, _RestraintReuseMixin, AutoModel):
+    """AutoModel that can reuse restraints written by a previous batch."""
+
+
+class StreamingLoopModel(_StartModelMixin, _RestraintReuseMixin, LoopModel):
+    """LoopModel that can reuse restraints written by a previous batch."""
+
+
+class SegmentLoopModel(LoopModel):
+    """
+    LoopModel that refines the loops of an existing model (inimodel). With segments, only these
+    residue ranges are refined instead of the automatically selected loops. With core_index, the loop
+    models are named after their core model (loop_model_filename), as LoopModel names the loop models
+    of the core models it builds itself.
+    """
+
+    segments = None  # (first, last) residue positions in the model, 0-based and inclusive
+    core_index = None  # model index of inimodel
+
+    def get_loop_model_filename(self, root, id1, id2, file_ext):
+        if self.core_index is not None:
+            id2 = self.core_index
+        return super().get_loop_model_filename(root, id1, id2, file_ext)
+
+    def select_loop_atoms(self):
+        if not self.segments:
+            return super().select_loop_atoms()
+
+        return Selection(*[self.residue_range(self.residues[first], self.residues[last])
+                           for first, last in self.segments])
+
+
+# Compute the per-residue DOPE profile of a model
+def dope_profile(env, pdb_file, smoothing_window=15):
+    """
+    Computes the normalized, smoothed per-residue DOPE profile of a model file. Missing atoms are
+    rebuilt with complete_pdb first, as for the whole-model scores (see score_model_file).
+
+    Args:
+        env (Environ): MODELLER environment with the topology and parameter libraries (see scoring_environ).
+        pdb_file (str): Model PDB filename.
+        smoothing_window (int, optional): Window of the profile smoothing. Defaults to 15.
+
+    Returns:
+        list: One DOPE value per residue, in model order (higher is worse).
+    """
+
+    profile_file = os.path.splitext(pdb_file)[0] + '.dope_profile'
+    mdl = complete_pdb(env, pdb_file)
+    Selection(mdl).assess_dope(output='ENERGY_PROFILE NO_REPORT', file=profile_file,
+                               normalize_profile=True, smoothing_window=smoothing_window)
+
+    profile = [0.0] * len(mdl.residues)
+    with open(profile_file, 'r') as f:
+        for line in f:
+            columns = line.split()
+            if line.startswith('#') or len(columns) < 2:
+                continue
+            profile[int(columns[0]) - 1] = float(columns[-1])
+
+    return profile
+
+
+# Find the residue ranges of a DOPE profile above a threshold
+def high_energy_segments(profile, threshold, min_length=3, max_length=12, merge_gap=2):
+    """
+    Finds contiguous runs of residues whose profile value exceeds the threshold. Runs separated by
+    at most merge_gap residues are merged, short runs are widened to min_length residues and long
+    runs are cut into pieces of at most max_length residues (the loop length LoopModel handles well).
+
+    Args:
+        profile (list): Per-residue values (e.g. from dope_profile).
+        threshold (float): Residues with a higher value are refined.
+        min_length (int, optional): Minimum segment length. Defaults to 3.
+        max_length (int, optional): Maximum segment length. Defaults to 12.
+        merge_gap (int, optional): Largest gap between merged runs. Defaults to 2.
+
+    Returns:
+        list: (first, last) residue positions, 0-based and inclusive.
+    """
+
+    runs = []
+    for i, value in enumerate(profile):
+        if value <= threshold:
+            continue
+        if runs and i - runs[-1][1] <= merge_gap + 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+
+    segments = []
+    for first, last in runs:
+        if last - first + 1 < min_length:
+            first = max(0, first - (min_length - (last - first + 1)) // 2)
+            last = min(len(profile) - 1, first + min_length - 1)
+
+        for start in range(first, last + 1, max_length):
+            segments.append((start, min(start + max_length - 1, last)))
+
+    return segments
+
+
+# Optimization settings of the model building, by name
+REFINEMENT_PRESETS = {
+    'slow': {'md_level': refine.slow,  # Set a slow MD optimization level
+             'library_schedule': autosched.slow,  # Set a slow optimization schedule
+             'max_var_iterations': 300,  # Increase maximum variable iterations
+             'repeat_optimization': 3},  # Repeat optimization 3 times
+    'fast': {'md_level': refine.very_fast,  # Short MD annealing, used to screen many models
+             'library_schedule': autosched.fast,
+             'max_var_iterations': 300,
+             'repeat_optimization': 1},
+}
+
+
+# Apply the optimization settings used by every modeling mode
+def configure_refinement(a, preset='slow'):
+    """
+    Sets the MD refinement level and the optimization schedule of an AutoModel/LoopModel object.
+
+    Args:
+        a (AutoModel): The model object to configure.
+        preset (str, optional): Name of the settings in REFINEMENT_PRESETS. Defaults to 'slow'.
+    """
+
+    for name, value in REFINEMENT_PRESETS[preset].items():
+        setattr(a, name, value)
+
+    a.max_molpdf = 1e6  # Set a maximum objective function value
+
+
+# Template codes as a tuple, whether one code or several were given
+def known_codes(knowns):
+    return (knowns,) if isinstance(knowns, str) else tuple(knowns)
+
+
+# Split a list of model indices into contiguous (first, last) batches
+def split_index_batches(indices, batch_size):
+    """
+    Splits model indices into contiguous ranges of at most batch_size models.
+
+    Args:
+        indices (list): Model indices to build.
+        batch_size (int): Maximum number of models per batch.
+
+    Returns:
+        list: (first, last) tuples of inclusive index ranges.
+    """
+
+    batches = []
+    for index in sorted(set(indices)):
+        if batches and index == batches[-1][1] + 1 and index - batches[-1][0] < batch_size:
+            batches[-1] = (batches[-1][0], index)
+        else:
+            batches.append((index, index))
+
+    return batches
+
+
+# Default number of core models per batch
+def default_batch_size(num_models, num_cpus, convergence=None):
+    """
+    Returns the number of core models built per batch when none is given: one model per CPU. With adaptive
+    sampling a batch holds at most a quarter of the run and at most `patience` models, so the convergence
+    criterion is checked several times even when there are as many CPUs as models.
+
+    Args:
+        num_models (int): Number of core models of the run.
+        num_cpus (int): Number of CPUs of the run.
+        convergence (ConvergenceMonitor, optional): Adaptive sampling criterion of the run.
+
+    Returns:
+        int: The batch size.
+    """
+
+    batch_size = max(num_cpus, 1)
+    if convergence is not None:
+        batch_size = min(batch_size, convergence.patience, max(-(-num_models // 4), 1))
+
+    return max(batch_size, 1)
+
+
+# Filenames MODELLER gives to core models and loop models
+def model_filename(sequence, index):
+    return '%s.B9999%04d.pdb' % (sequence, index)
+
+
+def loop_model_filename(sequence, loop_index, index):
+    return '%s.BL%04d%04d.pdb' % (sequence, loop_index, index)
+
+
+# Randomized coordinates a core model started its optimization from (see _StartModelMixin)
+def start_model_filename(sequence, index):
+    return '%s.start_%04d.pdb' % (sequence, index)
+
+
+# Check that a model PDB file was written completely
+def is_complete_pdb(pdb_file):
+    """
+    Returns True if the PDB file exists and ends with an END record, i.e. it was not truncated
+    by a crashed or killed run.
+    """
+
+    if not os.path.isfile(pdb_file) or os.path.getsize(pdb_file) == 0:
+        return False
+
+    with open(pdb_file, 'rb') as f:
+        f.seek(max(os.path.getsize(pdb_file) - 256, 0))
+        lines = [line.strip() for line in f.read().splitlines() if line.strip()]
+
+    return bool(lines) and lines[-1].startswith(b'END')
+
+
+# Create the MODELLER environment used to score existing model files
+def scoring_environ():
+    """
+    Returns an environment with the heavy-atom topology and the CHARMM parameters, the setup
+    autodockfr/00-summary_dope.py scores its models with, so that complete_pdb can rebuild
+    missing atoms before a model is assessed.
+    """
+
+    env = Environ()
+    env.libs.topology.read(file='$(LIB)/top_heav.lib')
+    env.libs.parameters.read(file='$(LIB)/par.lib')
+    return env
+
+
+# Re-score a model PDB file that has no recorded output
+def score_model_file(env, pdb_file):
+    """
+    Computes the MODELLER output dictionary of an existing model file: the objective function is read
+    from the REMARK records, DOPE and GA341 scores are recomputed on the whole model.
+
+    Args:
+        env (Environ): MODELLER environment with the topology and parameter libraries (see scoring_environ).
+        pdb_file (str): Model PDB filename.
+
+    Returns:
+        dict: Output dictionary with the same keys as a.outputs entries. 'GA341 score' is a list starting
+            with the GA341 score, as in a.outputs, or None if it cannot be computed.
+    """
+
+    output = {'name': pdb_file, 'failure': None, 'molpdf': None}
+
+    with open(pdb_file, 'r', encoding="utf8", errors='ignore') as f:
+        for line in f:
+            if 'MODELLER OBJECTIVE FUNCTION:' in line:
+                output['molpdf'] = float(line.split(':')[-1])
+                break
+
+    mdl = complete_pdb(env, pdb_file)
+    output['DOPE score'] = Selection(mdl).assess_dope()
+    try:
+        output['GA341 score'] = list(mdl.assess_ga341())
+    except ModellerError:
+        output['GA341 score'] = None
+
+    return output
+
+
+# DOPE score of the first chain of a model file, as autodockfr/00-summary_dope.py computes it
+def first_chain_dope(env, pdb_file):
+    mdl = complete_pdb(env, pdb_file)
+    return Selection(mdl.chains[0]).assess_dope()
+
+
+class TopModelRanking:
+    """
+    Bounded ranking of the best models seen so far. Models are pushed one at a time as they
+    finish, and only the top_k lowest scores are kept in a heap.
+    """
+
+    def __init__(self, top_k=10, key=DOPE_KEY):
+        self.top_k = top_k
+        self.key = key
+        self.num_seen = 0
+        self.num_failed = 0
+        self._heap = []  # (-score, order, output): the worst kept model sits at the top of the heap
+        self._order = 0
+
+    def push(self, output):
+        """
+        Adds one MODELLER output dictionary to the ranking.
+
+        Args:
+            output (dict): Output of a single model (an entry of a.outputs or a.loop.outputs).
+
+        Returns:
+            bool: True if the model entered the current top-k.
+        """
+
+        self.num_seen += 1
+        if output.get('failure') is not None or output.get(self.key) is None:
+            self.num_failed += 1
+            return False
+
+        self._order += 1
+        entry = (-output[self.key], self._order, output)
+        if len(self._heap) < self.top_k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+
+        return False
+
+    def ranked(self):
+        """Returns the kept models sorted from the best to the worst score."""
+        return [output for _, _, output in sorted(self._heap, key=lambda e: (-e[0], e[1]))]
+
+    def best(self):
+        """Returns the best model seen so far, or None if no model succeeded yet."""
+        ranked = self.ranked()
+        return ranked[0] if ranked else None
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class ConvergenceMonitor:
+    """
+    Adaptive sampling criterion. Tracks the mean of the best-k DOPE scores and the running mean and
+    standard deviation of all DOPE scores, and reports convergence once `patience` models in a row
+    have not improved the top-k mean by more than `tolerance`. Only core models are counted: the loop
+    models of a core model are refinements of it, not independent samples.
+
+    Args:
+        top_k (int, optional): Number of best models tracked. Defaults to 5.
+        patience (int, optional): Number of models without top-k improvement before stopping. Defaults to 20.
+        min_models (int, optional): Never stop before this many models were built. Defaults to 20.
+        tolerance (float, optional): Minimum decrease of the top-k mean DOPE score counted as an improvement.
+            Defaults to 0.0.
+    """
+
+    def __init__(self, top_k=5, patience=20, min_models=20, tolerance=0.0):
+        self.top_k = top_k
+        self.patience = patience
+        self.min_models = min_models
+        self.tolerance = tolerance
+
+        self.ranking = TopModelRanking(top_k)
+        self.since_improvement = 0
+        self.history = []  # One row per update() call
+
+        # Running statistics of all successful DOPE scores (Welford's algorithm)
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def top_k_mean(self):
+        """Returns the mean DOPE score of the current top-k models, or None if fewer than top_k models exist."""
+        if len(self.ranking) < self.top_k:
+            return None
+        return sum(x[DOPE_KEY] for x in self.ranking.ranked()) / self.top_k
+
+    def _add_score(self, score):
+        self._count += 1
+        delta = score - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (score - self._mean)
+
+    def update(self, outputs):
+        """
+        Adds finished models to the criterion.
+
+        Args:
+            outputs (list): MODELLER output dictionaries of the finished models.
+
+        Returns:
+            bool: True if the sampling has converged.
+        """
+
+        for output in outputs:
+            before = self.top_k_mean()
+            self.ranking.push(output)
+            after = self.top_k_mean()
+
+            if output.get('failure') is None and output.get(DOPE_KEY) is not None:
+                self._add_score(output[DOPE_KEY])
+
+            if before is None or (after is not None and before - after > self.tolerance):
+                self.since_improvement = 0
+            else:
+                self.since_improvement += 1
+
+        best = self.ranking.best()
+        std = (self._m2 / (self._count - 1)) ** 0.5 if self._count > 1 else 0.0
+        self.history.append({'num_models': self.ranking.num_seen,
+                             'best_dope': best[DOPE_KEY] if best else None,
+                             'top_k_mean_dope': self.top_k_mean(),
+                             'mean_dope': self._mean if self._count else None,
+                             'std_dope': std,
+                             'models_since_improvement': self.since_improvement})
+
+        return self.converged()
+
+    def converged(self):
+        """Returns True once at least min_models were built and the top-k did not improve for patience models."""
+        return self.ranking.num_seen >= self.min_models and self.since_improvement >= self.patience
+
+
+class ModelEngine:
+    """
+    Builds homology models with AutoModel or LoopModel in batches of model indices. After each
+    batch the finished models are pushed into a bounded top-k ranking, and the summary files, the
+    top model and best model PDB are flushed to disk, so a long run can be inspected while it is
+    in progress and stopped early (Ctrl+C, or by creating the stop file) without losing the models
+    that are already built.
+
+    Args:
+        alignment_file (str): Alignment input filename.
+        knowns (str or tuple): Code(s) of the templates in the alignment file.
+        sequence (str): Code of target in the alignment file.
+        start_index (int): Index of the first model to generate.
+        end_index (int): Index of the last model to generate.
+        include_ligand (bool): Whether to include HETATM records.
+        num_cpus (int): Number of CPUs to use for parallel processing.
+        template_mode (str, optional): 'single' or 'mult', selects the output filenames. Defaults to 'single'.
+        loop_range (tuple, optional): (first, last) loop model indices. Enables LoopModel when given.
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        batch_size (int, optional): Number of core models per batch. Defaults to default_batch_size().
+        stop_file (str, optional): Stop after the current batch once this file exists. Defaults to 'stop_modeling'.
+        convergence (ConvergenceMonitor, optional): Adaptive sampling criterion. When given, no further batch
+            is started once the DOPE ranking has converged.
+        resume (bool, optional): Keep the completed models of a previous run and build only the missing
+            model indices. Defaults to False.
+        refinement (str, optional): Optimization settings, a key of REFINEMENT_PRESETS. Defaults to 'slow'.
+        loop_top_k (int, optional): With loop_range, build the core models with AutoModel and refine the loops
+            of the loop_top_k best core models only, once all core models are built. Defaults to None
+            (LoopModel refines every core model).
+        loop_dope_threshold (float, optional): With loop_top_k, refine only the residue segments whose normalized
+            DOPE profile exceeds this value instead of the automatically selected loops. Defaults to None.
+        pocket_radius (float, optional): Optimize only the residues within this distance (angstroms) of the
+            ligands, starting from start_models. Defaults to None (the whole model is optimized).
+        pocket_deviation (float, optional): Randomization (angstroms) of the pocket atoms. Defaults to 1.0.
+    """
+
+    def __init__(self, alignment_file, knowns, sequence, start_index, end_index, include_ligand, num_cpus,
+                 template_mode='single', loop_range=None, top_k=10, batch_size=None, stop_file='stop_modeling',
+                 convergence=None, resume=False, refinement='slow', loop_top_k=None, loop_dope_threshold=None,
+                 pocket_radius=None, pocket_deviation=1.0):
+        self.alignment_file = alignment_file
+        self.knowns = knowns
+        self.sequence = sequence
+        self.model_indices = list(range(start_index, end_index + 1))
+        self.include_ligand = include_ligand
+        self.num_cpus = num_cpus
+        self.loop_range = loop_range
+        self.batch_size = batch_size or default_batch_size(len(self.model_indices), num_cpus, convergence)
+        self.stop_file = stop_file
+        self.convergence = convergence
+        self.resume = resume
+        self.refinement = refinement
+        self.loop_top_k = loop_top_k
+        self.loop_dope_threshold = loop_dope_threshold
+        self.pocket_radius = pocket_radius
+        self.pocket_deviation = pocket_deviation
+        self.template_mode = template_mode
+        self.files = dict(OUTPUT_FILES[(template_mode, loop_range is not None)])
+
+        self.atom_files_directory = ['.', '../atom_files/']  # Input atom file directories
+        self.rand_seed = None  # MODELLER random seed, None keeps the default seed
+        self.restraint_cache = ArtifactCache(os.path.join(CACHE_DIR, 'restraints'))  # None disables the cache
+        self.score_store = ScoreStore()  # Scores shared with the docking steps, None disables the store
+        self.run_id = new_run_id()
+        # One row per model across all runs (needs pyarrow), None disables the store
+        self.results_store = ResultsStore() if results_store_available() else None
+        self.journal = RunJournal()  # Inputs and state of every model, None disables the journal
+        self.start_models = {}  # model index -> PDB file the optimization starts from
+        self.record_start_models = False  # write the start coordinates of every model (see _StartModelMixin)
+
+        self.outputs = []  # All core model outputs
+        self.loop_outputs = []  # All loop model outputs
+        self.ranking = TopModelRanking(top_k)
+        self._restraints_ready = False
+        self._journal_inputs = None
+        self._scoring_env = None
+        self._recorded = None
+
+    @property
+    def core_loops(self):
+        """True if LoopModel refines the loops of every core model while it is built."""
+        return self.loop_range is not None and not self.loop_top_k
+
+    @property
+    def best_model(self):
+        """The best model built so far (MODELLER output dictionary), or None."""
+        return self.ranking.best()
+
+    # Create the MODELLER environment shared by all batches
+    def make_environ(self):
+        if self.rand_seed is None:
+            env = Environ()  # Create a new Modeller environment
+        else:
+            env = Environ(rand_seed=self.rand_seed)
+        env.io.atom_files_directory = self.atom_files_directory  # Set input atom file directories
+
+        if self.include_ligand:
+            env.io.hetatm = True  # Read HETATM records from template PDBs
+
+        return env
+
+    # Environment used to re-score existing model files, created on first use
+    def scoring_env(self):
+        if self._scoring_env is None:
+            self._scoring_env = scoring_environ()
+        return self._scoring_env
+
+    # Cache key of the restraints of this run
+    def restraint_key(self, env):
+        """
+        Hashes everything the restraints depend on: the alignment file, the template coordinate files,
+        the template codes (always as a tuple), the HETATM setting, the model class and the MODELLER
+        version.
+        """
+
+        atom_files = alignment_atom_files(self.alignment_file, self.atom_files_directory)
+        model_class = 'LoopModel' if self.core_loops else 'AutoModel'
+
+        return content_key('restraints', model_class, modeller.info.version, file_digest(self.alignment_file),
+                           [file_digest(x) for x in atom_files], known_codes(self.knowns), self.sequence,
+                           env.io.hetatm)
+
+    # Inputs and parameters of the models of this run, as recorded in the run journal
+    def journal_inputs(self):
+        """
+        Hashes what the models of this run depend on (the alignment file, the template coordinate files,
+        the start models and the MODELLER version) and collects the modeling parameters. The random seed
+        is left out, so the models of the shards stay valid when they are merged.
+
+        Returns:
+            tuple: (input hash, parameters dict).
+        """
+
+        if self._journal_inputs is None:
+            atom_files = alignment_atom_files(self.alignment_file, self.atom_files_directory)
+            start_files = [self.start_models[x] for x in sorted(self.start_models)]
+            parameters = {'knowns': list(known_codes(self.knowns)), 'sequence': self.sequence,
+                          'include_ligand': self.include_ligand, 'refinement': self.refinement,
+                          'loop_range': self.loop_range, 'loop_top_k': self.loop_top_k,
+                          'loop_dope_threshold': self.loop_dope_threshold,
+                          'pocket_radius': self.pocket_radius, 'pocket_deviation': self.pocket_deviation}
+            self._journal_inputs = (input_hash([self.alignment_file] + atom_files + start_files,
+                                               modeller.info.version), parameters)
+
+        return self._journal_inputs
+
+    # Create the AutoModel/LoopModel object of one batch
+    def make_model(self, env, first, last):
+        if not self.core_loops:
+            a = StreamingAutoModel(env,
+                                   alnfile=self.alignment_file,
+                                   knowns=self.knowns,
+                                   sequence=self.sequence,
+                                   assess_methods=(assess.DOPE, assess.GA341))
+        else:
+            a = StreamingLoopModel(env,
+                                   alnfile=self.alignment_file,
+                                   knowns=self.knowns,
+                                   sequence=self.sequence,
+                                   assess_methods=(assess.DOPE, assess.GA341),
+                                   loop_assess_methods=(assess.DOPE, assess.GA341))
+
+            a.loop.starting_model, a.loop.ending_model = self.loop_range
+
+        a.starting_model = first
+        a.ending_model = last
+
+        configure_refinement(a, self.refinement)
+        a.record_start_models = self.record_start_models
+        if self.start_models:
+            a.start_models = self.start_models
+            a.rand_method = None  # Refine the given coordinates without randomizing them
+
+        if self.pocket_radius is not None:
+            a.pocket_radius = self.pocket_radius
+            a.rand_method = PocketRandomizer(self.pocket_deviation)  # Perturb the pocket atoms only
+
+        a.reuse_restraints = self._restraints_ready
+        if self.restraint_cache is not None:
+            a.restraint_cache = self.restraint_cache
+            a.restraint_key = self.restraint_key(env)
+
+        return a
+
+    # Derive the restraints once, ahead of the processes that build the models
+    def prepare_restraints(self):
+        """
+        Writes the restraints of this run (the first stage of a.make()) and stores them in the restraint
+        cache, so that the shard processes started afterwards restore them instead of all deriving them
+        at the same time. Does nothing without a restraint cache.
+        """
+
+        if self.restraint_cache is None or not self.model_indices:
+            return
+
+        env = self.make_environ()
+        first = self.model_indices[0]
+        self.make_model(env, first, first).make(exit_stage=1)
+
+    # Collect the models of a previous, interrupted run
+    def resume_completed(self):
+        """
+        Finds the models of this run that were already built completely, adds them to the ranking using
+        the scores recorded in the output pickle or the score store (or re-scores them if no record
+        exists), and removes their indices from the models still to build. With loop refinement, a core
+        model counts as completed only if all of its loop models exist as well. Models the run journal
+        records with other inputs or parameters (e.g. a changed alignment) are built again.
+
+        Returns:
+            list: Indices of the completed models.
+        """
+
+        self.recorded_outputs()
+
+        completed, stale = [], 0
+        outputs, loop_outputs = [], []
+        for index in self.model_indices:
+            core_file = model_filename(self.sequence, index)
+            loop_files = self.loop_files(index) if self.core_loops else []
+
+            if not all(is_complete_pdb(x) for x in [core_file] + loop_files):
+                continue
+
+            if self.is_stale([core_file] + loop_files):
+                stale += 1
+                continue
+
+            completed.append(index)
+            outputs.append(self.existing_output(core_file))
+            loop_outputs.extend(self.existing_output(x) for x in loop_files)
+
+        if stale:
+            print("%d existing models were built from other inputs or parameters and are built again" % stale)
+
+        self.add_outputs(outputs, loop_outputs)
+        self.model_indices = [x for x in self.model_indices if x not in completed]
+
+        return completed
+
+    # Loop model filenames of a core model
+    def loop_files(self, index):
+        return [loop_model_filename(self.sequence, i, index) for i in range(self.loop_range[0], self.loop_range[1] + 1)]
+
+    # Check the run journal for model files built from other inputs or parameters
+    def is_stale(self, files):
+        if self.journal is None:
+            return False
+
+        journal_inputs = self.journal_inputs()
+        return any(self.journal.is_stale('model', os.path.abspath(x), *journal_inputs) for x in files)
+
+    # Outputs of the previous run from its output pickle, read before the first flush of this run overwrites it
+    def recorded_outputs(self):
+        if self._recorded is None:
+            self._recorded = {}
+            if os.path.isfile(self.files['outputs']):
+                with open(self.files['outputs'], "rb") as f:
+                    self._recorded = {x['name']: x for x in pickle.load(f)}
+
+        return self._recorded
+
+    # Output dictionary of an existing model file
+    def existing_output(self, pdb_file):
+        """
+        Returns the output of a model file built by a previous run: the one recorded in the output pickle,
+        else the one in the score store, else the file is re-scored.
+        """
+
+        return (self.recorded_outputs().get(pdb_file) or self.stored_output(pdb_file)
+                or score_model_file(self.scoring_env(), pdb_file))
+
+    # Refine the loops of the best core models
+    def refine_loops(self, env, job):
+        """
+        Runs loop refinement (LoopModel with the core model as inimodel) on the loop_top_k best core models.
+        With loop_dope_threshold, only the segments of high per-residue DOPE energy are refined, and core
+        models without such segments are skipped. The loop models are named after their core model, as in
+        a run with core loops. With resume, core models whose loop models were all built completely by a
+        previous run are not refined again.
+
+        Args:
+            env (Environ): MODELLER environment.
+            job (Job): MODELLER parallel job.
+        """
+
+        core_models = sorted((x for x in self.outputs if x['failure'] is None), key=lambda x: x[DOPE_KEY])
+        for output in core_models[:self.loop_top_k]:
+            if self.stop_requested():
+                print("Stop file '%s' found, skipping the remaining loop refinements" % self.stop_file)
+                break
+
+            core_index = parse_model_name(output['name'])[1]
+            loop_files = self.loop_files(core_index)
+            if self.resume and all(is_complete_pdb(x) for x in loop_files) and not self.is_stale(loop_files):
+                loop_outputs = [self.existing_output(x) for x in loop_files]
+                self.add_outputs([], loop_outputs)
+                print("Loops of %s already refined, %d loop models resumed" % (output['name'], len(loop_outputs)))
+                continue
+
+            segments = None
+            if self.loop_dope_threshold is not None:
+                segments = high_energy_segments(dope_profile(self.scoring_env(), output['name']),
+                                                self.loop_dope_threshold)
+                if not segments:
+                    print("%s: no segment above the DOPE threshold, loop refinement skipped" % output['name'])
+                    continue
+
+            # Name the loop models after their core model, e.g. hkkp.BL00010003.pdb for hkkp.B99990003.pdb
+            a = SegmentLoopModel(env,
+                                 inimodel=output['name'],
+                                 sequence=self.sequence,
+                                 loop_assess_methods=(assess.DOPE, assess.GA341))
+            a.core_index = core_index
+            a.segments = segments
+            a.loop.starting_model, a.loop.ending_model = self.loop_range
+            a.use_parallel_job(job)  # Enable parallel processing
+            start = time.perf_counter()
+            a.make()
+
+            self.add_outputs([], a.loop.outputs)
+            self.record_results(a.loop.outputs, time.perf_counter() - start)
+            self.flush()
+            print("Loops of %s refined (%s)" % (output['name'], segments if segments else 'automatic loop selection'))
+
+    # Output dictionary of a model file from the score store
+    def stored_output(self, pdb_file):
+        if self.score_store is None:
+            return None
+
+        scores = self.score_store.get(structure_key(pdb_file)[0])
+        if scores is None or scores['dope'] is None:
+            return None
+
+        # GA341 in the shape of a.outputs: a list starting with the score
+        ga341 = [scores['ga341']] if scores['ga341'] is not None else None
+        return {'name': pdb_file, 'failure': None, 'molpdf': scores['molpdf'], 'DOPE score': scores['dope'],
+                'GA341 score': ga341}
+
+    def record_results(self, outputs, batch_wall_time=None):
+        """
+        Appends newly built models to the results store and records them in the run journal.
+
+        Args:
+            outputs (list): Core and/or loop model outputs.
+            batch_wall_time (float, optional): Wall time of the batch that built them.
+        """
+
+        if self.results_store is not None:
+            self.results_store.append_outputs(outputs, self.run_id, self.template_mode, self.knowns, self.sequence,
+                                              self.refinement, batch_wall_time)
+
+        if self.journal is not None:
+            inputs, parameters = self.journal_inputs()
+            for output in outputs:
+                done = output['failure'] is None and os.path.isfile(output['name'])
+                self.journal.record('model', os.path.abspath(output['name']), 'done' if done else 'failed', inputs,
+                                    parameters, [output['name']] if done else (), wall_time=batch_wall_time)
+
+    def stop_requested(self):
+        """Returns True if the user asked to stop the run by creating the stop file."""
+        return bool(self.stop_file) and os.path.exists(self.stop_file)
+
+    def add_outputs(self, outputs, loop_outputs=()):
+        """
+        Adds finished models to the run and updates the ranking.
+
+        Args:
+            outputs (list): Core model outputs (a.outputs).
+            loop_outputs (list, optional): Loop model outputs (a.loop.outputs).
+        """
+
+        for output in outputs:
+            self.outputs.append(output)
+            self.ranking.push(output)
+
+        for output in loop_outputs:
+            self.loop_outputs.append(output)
+            self.ranking.push(output)
+
+        # Only the core models count as samples of the adaptive sampling
+        if self.convergence is not None and outputs:
+            self.convergence.update(list(outputs))
+
+        if self.score_store is not None:
+            self.score_store.record_outputs(list(outputs) + list(loop_outputs))
+            self.record_first_chain_scores(list(outputs) + list(loop_outputs))
+
+    # Record the stage-00 scores of new models, so that the docking step does not score them again
+    def record_first_chain_scores(self, outputs):
+        """
+        Stores the first-chain DOPE score after complete_pdb of every successful model the score store
+        does not know yet, under the selection 00-summary_dope.py looks up for the protein part of the
+        model (the structure key ignores HETATM records, so the model and its protein part share it).
+
+        Args:
+            outputs (list): Core and/or loop model outputs.
+        """
+
+        rows = []
+        for output in outputs:
+            if output.get('failure') is not None or not os.path.isfile(output['name']):
+                continue
+
+            key, chains = structure_key(output['name'])
+            selection = first_chain_selection(chains)
+            if self.score_store.get(key, selection) is None:
+                rows.append((key, selection, first_chain_dope(self.scoring_env(), output['name']), None, None,
+                             output['name']))
+
+        if rows:
+            self.score_store.put_many(rows)
+
+    # Write the summary of all models built so far
+    def flush(self):
+        """Writes the output pickle, summary CSV files, top-k table, top model pickle and best model PDB."""
+
+        # Save all modeller outputs to pickle format
+        with open(self.files['outputs'], "wb") as f:
+            pickle.dump(self.outputs + self.loop_outputs, f)
+
+        # Write the summary of model evaluating score
+        pd.DataFrame(self.outputs).to_csv(self.files['summary'], sep=",", header=True, index=True,
+                                          index_label='model')
+        if self.files['loop_summary']:
+            pd.DataFrame(self.loop_outputs).to_csv(self.files['loop_summary'], sep=",", header=True, index=True,
+                                                   index_label='model')
+
+        # Write the current top-k ranking
+        pd.DataFrame(self.ranking.ranked()).to_csv(self.files['top'], sep=",", header=True, index=True,
+                                                   index_label='rank')
+
+        # Write the convergence history of the adaptive sampling
+        if self.convergence is not None:
+            pd.DataFrame(self.convergence.history).to_csv(self.files['convergence'], sep=",", header=True,
+                                                          index=False)
+
+        mtop = self.best_model
+        if mtop is None:
+            return
+
+        # Save the top model to pickle format
+        with open(self.files['mtop'], "wb") as f:
+            pickle.dump(mtop, f)
+
+        # Rename the best model's pdb file
+        shutil.copy(mtop['name'], self.files['best'])
+
+    def run(self, job=None):
+        """
+        Builds all models batch by batch and writes the final summary.
+
+        Args:
+            job (Job, optional): MODELLER parallel job. The shared job with num_cpus workers of the
+                worker pool is used if omitted.
+
+        Returns:
+            dict: The top model, or None if no model was built successfully.
+        """
+
+        # Step 1: Parallel Configuration Setup
+        if job is None:
+            job = shared_job(self.num_cpus)
+
+        # Step 2: Modeller Environment Setup
+        env = self.make_environ()
+
+        if self.resume:
+            completed = self.resume_completed()
+            print("Resuming: %d completed models found, %d models left to build"
+                  % (len(completed), len(self.model_indices)))
+            self.flush()
+
+        # Step 3: Model Generation, one batch of model indices at a time
+        try:
+            for first, last in split_index_batches(self.model_indices, self.batch_size):
+                if self.stop_requested():
+                    print("Stop file '%s' found, skipping models %d-%d" % (self.stop_file, first, last))
+                    break
+
+                a = self.make_model(env, first, last)
+                a.use_parallel_job(job)  # Enable parallel processing
+                start = time.perf_counter()
+                a.make()  # Build the models of this batch
+                batch_wall_time = time.perf_counter() - start
+                self._restraints_ready = True
+
+                # Step 4: Rank the finished models, record them and flush partial summaries
+                loop_outputs = a.loop.outputs if self.core_loops else ()
+                self.add_outputs(a.outputs, loop_outputs)
+                self.record_results(list(a.outputs) + list(loop_outputs), batch_wall_time)
+                self.flush()
+
+                mtop = self.best_model
+                if mtop is not None:
+                    print("Models %d-%d done, current best: %s (DOPE score %.3f)"
+                          % (first, last, mtop['name'], mtop[DOPE_KEY]))
+
+                if self.convergence is not None and self.convergence.converged():
+                    print("DOPE ranking converged: no top-%d improvement over the last %d models"
+                          % (self.convergence.top_k, self.convergence.since_improvement))
+                    break
+
+            # Step 5: Loop refinement of the best core models
+            if self.loop_range is not None and self.loop_top_k and not self.stop_requested():
+                self.refine_loops(env, job)
+
+        except KeyboardInterrupt:
+            print('Model generation interrupted, summarizing the models built so far')
+
+        # Step 6: Final summary
+        self.flush()
+
+        mtop = self.best_model
+        if mtop is None:
+            print('No model was built successfully.')
+        else:
+            print("%s: %s (DOPE score %.3f)" % (self.files['title'], mtop['name'], mtop[DOPE_KEY]))
+
+        return mtop
+
+
+# Output filenames of an intermediate run, kept apart from the final summary files
+def prefixed_output_files(files, prefix, title):
+    prefixed = {x: (prefix + y if y else y) for x, y in files.items()}
+    prefixed['title'] = title
+    return prefixed
+
+
+def run_tiered(alignment_file, knowns, sequence, start_index, end_index, include_ligand, num_cpus, refine_top,
+               template_mode='single', loop_range=None, top_k=10, batch_size=None, convergence=None, resume=False,
+               loop_top_k=None, loop_dope_threshold=None):
+    """
+    Two-tier modeling: screens the whole model index range with the fast optimization settings, then
+    rebuilds the refine_top best screened models (by DOPE score) with the slow settings. Every rebuilt
+    model starts from the same coordinates as its screened model, i.e. the initial model after the
+    randomization of that model index, recorded by the screening tier, and runs the full optimization
+    schedule from there. The refined models get the indices following end_index and are the only models
+    of the final summary files and best model; loop refinement (loop_range) is applied to them only. The
+    screening summary is written to the usual filenames with a 'screen_' prefix.
+
+    Args:
+        alignment_file (str): Alignment input filename.
+        knowns (str or tuple): Code(s) of the templates in the alignment file.
+        sequence (str): Code of target in the alignment file.
+        start_index (int): Index of the first screened model.
+        end_index (int): Index of the last screened model.
+        include_ligand (bool): Whether to include HETATM records.
+        num_cpus (int): Number of CPUs to use for parallel processing.
+        refine_top (int): Number of screened models refined with the slow settings.
+        template_mode (str, optional): 'single' or 'mult', selects the output filenames. Defaults to 'single'.
+        loop_range (tuple, optional): (first, last) loop model indices of the refined models.
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        batch_size (int, optional): Number of models per batch. Defaults to num_cpus.
+        convergence (ConvergenceMonitor, optional): Adaptive sampling criterion of the screening tier.
+        resume (bool, optional): Keep completed models of an interrupted run. Defaults to False.
+        loop_top_k (int, optional): Refine the loops of this many refined models only (see ModelEngine).
+        loop_dope_threshold (float, optional): DOPE profile threshold of the refined loop segments (see ModelEngine).
+
+    Returns:
+        dict: The top refined model, or None if no model was built successfully.
+    """
+
+    job = shared_job(num_cpus)
+
+    # Tier 1: Screen with the fast settings, without loop refinement, recording the start coordinates
+    screen = ModelEngine(alignment_file, knowns, sequence, start_index, end_index, include_ligand, num_cpus,
+                         template_mode=template_mode, top_k=max(top_k, refine_top), batch_size=batch_size,
+                         convergence=convergence, resume=resume, refinement='fast')
+    screen.files = prefixed_output_files(screen.files, 'screen_', 'Top screened model')
+    screen.record_start_models = True
+    screen.run(job)
+
+    selected = screen.ranking.ranked()[:refine_top]
+    if not selected:
+        return None
+
+    # Tier 2: Rebuild the best screened models from their start coordinates with the slow settings
+    first = end_index + 1
+    start_models = {}
+    for i, output in enumerate(selected):
+        start_file = start_model_filename(sequence, parse_model_name(output['name'])[1])
+        if not os.path.isfile(start_file):
+            # e.g. a model resumed from a run that did not record its start coordinates
+            print("%s: start coordinates not found, refining the screened model instead" % output['name'])
+            start_file = output['name']
+        start_models[first + i] = start_file
+
+    engine = ModelEngine(alignment_file, knowns, sequence, first, first + len(selected) - 1, include_ligand, num_cpus,
+                         template_mode=template_mode, loop_range=loop_range, top_k=top_k, batch_size=batch_size,
+                         resume=resume, refinement='slow', loop_top_k=loop_top_k,
+                         loop_dope_threshold=loop_dope_threshold)
+    engine.start_models = start_models
+    engine.run_id = screen.run_id  # both tiers are one run in the results store
+    print("Refining the %d best screened models: %s" % (len(selected), ', '.join(x['name'] for x in selected)))
+
+    return engine.run(job)
+
+
+def run_pocket_ensemble(alignment_file, knowns, sequence, start_index, end_index, num_cpus, pocket_radius=8.0,
+                        pocket_deviation=1.0, template_mode='single', top_k=10, batch_size=None, resume=False):
+    """
+    Pocket-focused ensemble for docking receptors: builds one full model (index start_index) with HETATM
+    ligands, then generates the other ensemble members by re-optimizing only the residues within
+    pocket_radius of the ligands, starting from the full model with the pocket atoms perturbed by
+    pocket_deviation. The rest of the protein keeps the coordinates of the full model, so each member
+    costs a fraction of a full model. The full model's summary is written with a 'base_' prefix; the
+    usual summary files and best model cover the whole ensemble.
+
+    Args:
+        alignment_file (str): Alignment input filename (with ligand positions, see process_pir_file).
+        knowns (str or tuple): Code(s) of the templates in the alignment file.
+        sequence (str): Code of target in the alignment file.
+        start_index (int): Index of the full model.
+        end_index (int): Index of the last ensemble member.
+        num_cpus (int): Number of CPUs to use for parallel processing.
+        pocket_radius (float, optional): Distance (angstroms) from the ligands of the optimized residues.
+            Defaults to 8.0.
+        pocket_deviation (float, optional): Randomization (angstroms) of the pocket atoms. Defaults to 1.0.
+        template_mode (str, optional): 'single' or 'mult', selects the output filenames. Defaults to 'single'.
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        batch_size (int, optional): Number of models per batch. Defaults to num_cpus.
+        resume (bool, optional): Keep completed models of an interrupted run. Defaults to False.
+
+    Returns:
+        dict: The top ensemble member, or None if the full model could not be built.
+    """
+
+    job = shared_job(num_cpus)
+
+    # Step 1: One full model with the ligands
+    base = ModelEngine(alignment_file, knowns, sequence, start_index, start_index, True, num_cpus,
+                       template_mode=template_mode, resume=resume)
+    base.files = prefixed_output_files(base.files, 'base_', 'Full model')
+    base_model = base.run(job)
+    if base_model is None:
+        return None
+
+    # Step 2: Ensemble members re-optimized around the ligands only
+    engine = ModelEngine(alignment_file, knowns, sequence, start_index + 1, end_index, True, num_cpus,
+                         template_mode=template_mode, top_k=top_k, batch_size=batch_size, resume=resume,
+                         pocket_radius=pocket_radius, pocket_deviation=pocket_deviation)
+    engine.start_models = {x: base_model['name'] for x in engine.model_indices}
+    engine.run_id = base.run_id  # the full model and its ensemble are one run in the results store
+    engine.add_outputs(base.outputs)
+    print("Pocket ensemble: models %d-%d re-optimized within %.1f A of the ligands of %s"
+          % (start_index + 1, end_index, pocket_radius, base_model['name']))
+
+    return engine.run(job)
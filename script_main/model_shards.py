@@ -0,0 +1,350 @@
+# Sharded model generation: independent MODELLER processes per model index range
+import os
+import sys
+import json
+import pickle
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from model_engine import DOPE_KEY, ConvergenceMonitor, ModelEngine
+from content_cache import CACHE_DIR, ArtifactCache
+from worker_pool import shared_job
+
+# Result file written by every shard process inside its working directory
+SHARD_RESULT = 'shard_result.pickle'
+
+
+# Split the model index range into contiguous chunks
+def split_shards(start_index, end_index, num_shards):
+    """
+    Splits [start_index, end_index] into at most num_shards contiguous chunks of similar size.
+
+    Args:
+        start_index (int): Index of the first model.
+        end_index (int): Index of the last model.
+        num_shards (int): Desired number of shards.
+
+    Returns:
+        list: (first, last) tuples of inclusive index ranges.
+    """
+
+    num_models = end_index - start_index + 1
+    num_shards = max(1, min(num_shards, num_models))
+    size, extra = divmod(num_models, num_shards)
+
+    shards = []
+    first = start_index
+    for i in range(num_shards):
+        last = first + size - 1 + (1 if i < extra else 0)
+        shards.append((first, last))
+        first = last + 1
+
+    return shards
+
+
+# Random seed of a shard, so that shards do not repeat each other's models
+def shard_rand_seed(shard_index):
+    # MODELLER accepts seeds between -50000 and -2
+    return -2 - (8121 + 97 * shard_index) % 49998
+
+
+# Settings of a convergence criterion, as written to the shard configuration
+def convergence_settings(convergence):
+    if convergence is None:
+        return None
+    return {'top_k': convergence.top_k, 'patience': convergence.patience, 'min_models': convergence.min_models,
+            'tolerance': convergence.tolerance}
+
+
+# Build the models of one shard (runs inside the shard process)
+def run_shard(config_file, resume=False):
+    """
+    Builds the models described by a shard configuration file in the shard's working directory and
+    writes the outputs to shard_result.pickle. With adaptive sampling, every shard stops once its own
+    models have converged.
+
+    Args:
+        config_file (str): Path to the shard configuration (JSON).
+        resume (bool, optional): Keep the completed models of an earlier attempt (set when a failed
+            shard is started again), even if the run itself does not resume. Defaults to False.
+    """
+
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+
+    os.chdir(config['work_dir'])
+
+    loop_range = tuple(config['loop_range']) if config['loop_range'] else None
+    convergence = ConvergenceMonitor(**config['convergence']) if config['convergence'] else None
+    engine = ModelEngine(config['alignment_file'], tuple(config['knowns']), config['sequence'],
+                         config['start_index'], config['end_index'], config['include_ligand'], config['num_cpus'],
+                         template_mode=config['template_mode'], loop_range=loop_range, top_k=config['top_k'],
+                         batch_size=config['batch_size'], convergence=convergence,
+                         resume=config['resume'] or resume)
+    engine.atom_files_directory = config['atom_files_directory']
+    engine.rand_seed = config['rand_seed']
+    engine.restraint_cache = ArtifactCache(config['restraint_cache'])
+    engine.results_store = None  # the merge records the models under their final paths
+    engine.run()
+
+    with open(SHARD_RESULT, "wb") as f:
+        pickle.dump({'outputs': engine.outputs, 'loop_outputs': engine.loop_outputs}, f)
+
+
+# Launch one shard process, retrying it on failure
+def _launch_shard(config_file, work_dir, max_retries):
+    for attempt in range(max_retries + 1):
+        # Retries keep the models the failed attempt has completed
+        command = [sys.executable, os.path.abspath(__file__), config_file] + (['--resume'] if attempt else [])
+        with open(os.path.join(work_dir, 'shard.log'), 'a') as log:
+            result = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+        if result.returncode == 0:
+            return True
+        print("Shard '%s' failed (attempt %d, exit code %d)" % (work_dir, attempt + 1, result.returncode))
+
+    return False
+
+
+# Create the working directory and configuration of every shard
+def prepare_shards(alignment_file, knowns, sequence, start_index, end_index, include_ligand, num_shards,
+                   cpus_per_shard, template_mode='single', loop_range=None, top_k=10, shard_dir='shards',
+                   batch_size=None, convergence=None, resume=False, loop_top_k=None):
+    """
+    Splits the model index range into shards and writes a working directory with a copy of the alignment
+    and a shard.json configuration for each of them. With loop_top_k, the shards build the core models
+    only: the loops of the best core models over all shards are refined when the shards are merged.
+    Before that, the restraints are derived once and stored in the restraint cache,
+    which every shard restores them from.
+
+    Returns:
+        list: Working directories of the shards.
+    """
+
+    main_dir = os.getcwd()
+    knowns = [knowns] if isinstance(knowns, str) else list(knowns)
+    shard_loop_range = None if loop_top_k else loop_range
+
+    # Derive the restraints in this process, so that the shards do not all derive them at once
+    ModelEngine(alignment_file, tuple(knowns), sequence, start_index, end_index, include_ligand, cpus_per_shard,
+                template_mode=template_mode, loop_range=shard_loop_range).prepare_restraints()
+
+    work_dirs = []
+    for i, (first, last) in enumerate(split_shards(start_index, end_index, num_shards)):
+        work_dir = os.path.join(main_dir, shard_dir, '%s_%02d' % (template_mode, i + 1))
+        os.makedirs(work_dir, exist_ok=True)
+        shutil.copy(alignment_file, work_dir)
+
+        config = {'work_dir': work_dir,
+                  'alignment_file': os.path.basename(alignment_file),
+                  'knowns': knowns,
+                  'sequence': sequence,
+                  'start_index': first,
+                  'end_index': last,
+                  'include_ligand': include_ligand,
+                  'num_cpus': cpus_per_shard,
+                  'template_mode': template_mode,
+                  'loop_range': list(shard_loop_range) if shard_loop_range else None,
+                  'top_k': top_k,
+                  'batch_size': batch_size,
+                  'convergence': convergence_settings(convergence),
+                  'resume': resume,
+                  'atom_files_directory': [main_dir, os.path.join(main_dir, '../atom_files/')],
+                  'rand_seed': shard_rand_seed(i),
+                  'restraint_cache': os.path.join(main_dir, CACHE_DIR, 'restraints')}
+
+        with open(os.path.join(work_dir, 'shard.json'), 'w') as f:
+            json.dump(config, f, indent=2)
+
+        work_dirs.append(work_dir)
+
+    return work_dirs
+
+
+# Run shard processes, at most max_workers at a time
+def launch_shards(work_dirs, max_workers, max_retries=1):
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(work_dirs)))) as executor:
+        succeeded = list(executor.map(lambda d: _launch_shard(os.path.join(d, 'shard.json'), d, max_retries),
+                                      work_dirs))
+
+    for work_dir, ok in zip(work_dirs, succeeded):
+        if not ok:
+            print("Shard '%s' failed, rerun it to build its missing models" % work_dir)
+
+
+# Merge the outputs of the shards into the summary files of the current directory
+def merge_shards(work_dirs, alignment_file, knowns, sequence, start_index, end_index, include_ligand, num_cpus,
+                 template_mode='single', loop_range=None, top_k=10, resume=False, loop_top_k=None,
+                 loop_dope_threshold=None):
+    """
+    Copies the models of the shards into the current directory and writes the usual summary files,
+    top model pickle and best model PDB of all shards together. With loop_top_k, the loops of the
+    loop_top_k best core models over all shards are refined here.
+
+    Returns:
+        dict: The top model over all shards, or None if no model was built successfully.
+    """
+
+    main_dir = os.getcwd()
+    knowns = knowns if isinstance(knowns, str) else tuple(knowns)
+    engine = ModelEngine(alignment_file, knowns, sequence, start_index, end_index, include_ligand, num_cpus,
+                         template_mode=template_mode, loop_range=loop_range, top_k=top_k, resume=resume,
+                         loop_top_k=loop_top_k, loop_dope_threshold=loop_dope_threshold)
+
+    for work_dir in work_dirs:
+        result_file = os.path.join(work_dir, SHARD_RESULT)
+        if not os.path.isfile(result_file):
+            continue
+
+        with open(result_file, "rb") as f:
+            result = pickle.load(f)
+
+        # Copy the model files next to the other outputs
+        for output in result['outputs'] + result['loop_outputs']:
+            if os.path.isfile(os.path.join(work_dir, output['name'])):
+                shutil.copy(os.path.join(work_dir, output['name']), main_dir)
+
+        engine.add_outputs(result['outputs'], result['loop_outputs'])
+        engine.record_results(result['outputs'] + result['loop_outputs'])
+
+    # Loop refinement of the best core models of all shards
+    if loop_range is not None and loop_top_k and not engine.stop_requested():
+        engine.refine_loops(engine.make_environ(), shared_job(num_cpus))
+
+    engine.flush()
+
+    mtop = engine.best_model
+    if mtop is None:
+        print('No model was built successfully.')
+    else:
+        print("%s: %s (DOPE score %.3f)" % (engine.files['title'], mtop['name'], mtop[DOPE_KEY]))
+
+    return mtop
+
+
+def run_sharded(alignment_file, knowns, sequence, start_index, end_index, include_ligand, num_cpus, num_shards,
+                template_mode='single', loop_range=None, top_k=10, batch_size=None, convergence=None, resume=False,
+                loop_top_k=None, loop_dope_threshold=None, max_retries=1, shard_dir='shards'):
+    """
+    Splits the model index range into shards and builds every shard as an independent AutoModel/LoopModel
+    process with its own working directory, parallel job and random seed. The outputs of all shards are
+    merged into the usual summary files, top model pickle and best model PDB in the current directory.
+
+    Args:
+        alignment_file (str): Alignment input filename.
+        knowns (str or tuple): Code(s) of the templates in the alignment file.
+        sequence (str): Code of target in the alignment file.
+        start_index (int): Index of the first model to generate.
+        end_index (int): Index of the last model to generate.
+        include_ligand (bool): Whether to include HETATM records.
+        num_cpus (int): Total number of CPUs shared by the shards.
+        num_shards (int): Number of independent processes.
+        template_mode (str, optional): 'single' or 'mult', selects the output filenames. Defaults to 'single'.
+        loop_range (tuple, optional): (first, last) loop model indices. Enables LoopModel when given.
+        top_k (int, optional): Number of best models kept in the ranking. Defaults to 10.
+        batch_size (int, optional): Number of core models per batch within a shard.
+        convergence (ConvergenceMonitor, optional): Adaptive sampling criterion; each shard applies a copy of it
+            to its own models.
+        resume (bool, optional): Keep the completed models of an interrupted run of the shards. Defaults to False.
+        loop_top_k (int, optional): Refine the loops of the loop_top_k best core models of all shards only.
+        loop_dope_threshold (float, optional): DOPE profile threshold of the refined loop segments (see ModelEngine).
+        max_retries (int, optional): Number of times a failed shard is started again. Defaults to 1.
+        shard_dir (str, optional): Directory holding the shard working directories. Defaults to 'shards'.
+
+    Returns:
+        dict: The top model over all shards, or None if no model was built successfully.
+    """
+
+    num_shards = len(split_shards(start_index, end_index, num_shards))
+    cpus_per_shard = max(num_cpus // num_shards, 1)
+
+    # Step 1: Prepare the restraints, working directory and configuration of every shard
+    work_dirs = prepare_shards(alignment_file, knowns, sequence, start_index, end_index, include_ligand, num_shards,
+                               cpus_per_shard, template_mode, loop_range, top_k, shard_dir, batch_size, convergence,
+                               resume, loop_top_k)
+
+    # Step 2: Run the shards as independent processes
+    print("Building models %d-%d in %d shards of %d CPUs" % (start_index, end_index, num_shards, cpus_per_shard))
+    launch_shards(work_dirs, num_shards, max_retries)
+
+    # Step 3: Merge the outputs and rankings of all shards
+    return merge_shards(work_dirs, alignment_file, knowns, sequence, start_index, end_index, include_ligand,
+                        num_cpus, template_mode, loop_range, top_k, resume, loop_top_k, loop_dope_threshold)
+
+
+def run_concurrent(branches, num_cpus, cpu_split=None, num_slots=4, max_retries=1, shard_dir='shards'):
+    """
+    Builds the models of several modeling branches (e.g. single-template and multi-template) at the same
+    time, each branch in its own shard directories, so that the serial phases of one branch (restraints,
+    collection of the results) overlap with the parallel model building of the other.
+
+    With a cpu_split, every branch gets a fixed share of the CPUs for all of its shards. Without it, the
+    CPUs are divided into num_slots slots and every branch is cut into num_slots shards that are started
+    from one queue, alternating between the branches: a branch that finishes early leaves its slots to the
+    shards of the other branch (work stealing at shard granularity).
+
+    The branches are merged one after the other in the given order once all shards have finished, so the
+    summary files and best model PDB of every branch are the same as with sequential runs.
+
+    Args:
+        branches (list): One dict per branch with the arguments of run_sharded: alignment_file, knowns,
+            sequence, start_index, end_index, include_ligand, template_mode, loop_range, top_k, batch_size,
+            convergence, resume, loop_top_k, loop_dope_threshold, and num_shards (fixed split only, defaults
+            to 1).
+        num_cpus (int): Total number of CPUs shared by the branches.
+        cpu_split (list, optional): Fraction of num_cpus given to each branch. Defaults to work stealing.
+        num_slots (int, optional): Number of shard processes running at once with work stealing. Defaults to 4.
+        max_retries (int, optional): Number of times a failed shard is started again. Defaults to 1.
+        shard_dir (str, optional): Directory holding the shard working directories. Defaults to 'shards'.
+
+    Returns:
+        list: The top model of every branch (None for a branch without successful model).
+    """
+
+    def prepare(branch, num_shards, cpus_per_shard):
+        return prepare_shards(branch['alignment_file'], branch['knowns'], branch['sequence'], branch['start_index'],
+                              branch['end_index'], branch['include_ligand'], num_shards, cpus_per_shard,
+                              branch['template_mode'], branch.get('loop_range'), branch.get('top_k', 10), shard_dir,
+                              branch.get('batch_size'), branch.get('convergence'), branch.get('resume', False),
+                              branch.get('loop_top_k'))
+
+    # Step 1: Prepare the shards of every branch
+    if cpu_split is not None:
+        branch_dirs = []
+        for branch, fraction in zip(branches, cpu_split):
+            branch_cpus = max(int(num_cpus * fraction), 1)
+            num_shards = branch.get('num_shards', 1)
+            branch_dirs.append(prepare(branch, num_shards, max(branch_cpus // num_shards, 1)))
+            print("%s models: %d CPUs" % (branch['template_mode'], branch_cpus))
+
+        queue = [x for dirs in branch_dirs for x in dirs]
+        max_workers = len(queue)
+
+    else:
+        cpus_per_slot = max(num_cpus // num_slots, 1)
+        branch_dirs = [prepare(branch, num_slots, cpus_per_slot) for branch in branches]
+        print("Sharing %d slots of %d CPUs between %d branches" % (num_slots, cpus_per_slot, len(branches)))
+
+        # Alternate between the branches, so each starts with its share of the slots
+        queue = []
+        for i in range(max(len(x) for x in branch_dirs)):
+            queue.extend(dirs[i] for dirs in branch_dirs if i < len(dirs))
+        max_workers = num_slots
+
+    # Step 2: Run the shards of all branches
+    launch_shards(queue, max_workers, max_retries)
+
+    # Step 3: Merge every branch
+    results = []
+    for branch, work_dirs in zip(branches, branch_dirs):
+        results.append(merge_shards(work_dirs, branch['alignment_file'], branch['knowns'], branch['sequence'],
+                                    branch['start_index'], branch['end_index'], branch['include_ligand'], num_cpus,
+                                    branch['template_mode'], branch.get('loop_range'), branch.get('top_k', 10),
+                                    branch.get('resume', False), branch.get('loop_top_k'),
+                                    branch.get('loop_dope_threshold')))
+
+    return results
+
+
+if __name__ == "__main__":
+    run_shard(sys.argv[1], '--resume' in sys.argv[2:])
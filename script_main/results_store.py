@@ -0,0 +1,222 @@
+# Columnar store of the modeling results (Parquet, one row per model)
+import os
+import sys
+import time
+import argparse
+
+from content_cache import CACHE_DIR
+
+# pyarrow is optional: without it the engine only writes the pickle and CSV summaries
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Default store location, relative to the working directory of execute_modeller.py
+RESULTS_DIR = os.path.join(CACHE_DIR, 'results')
+
+# Environment variable pointing shard processes and stage scripts to the store of the run
+RESULTS_DIR_ENV = 'MODELLER_SCRIPTS_RESULTS_DIR'
+
+# Version of the row layout, stored with every row
+SCHEMA_VERSION = 1
+
+# Columns of the store
+COLUMNS = [('schema_version', 'int32'),
+           ('run_id', 'string'),
+           ('mode', 'string'),  # template mode: 'single' or 'mult'
+           ('model_type', 'string'),  # 'core' or 'loop'
+           ('refinement', 'string'),  # optimization preset
+           ('template_set', 'string'),  # template codes joined by '+'
+           ('sequence', 'string'),
+           ('model_index', 'int32'),
+           ('loop_index', 'int32'),
+           ('file_path', 'string'),
+           ('molpdf', 'float64'),
+           ('dope', 'float64'),
+           ('ga341', 'float64'),
+           ('failure', 'string'),
+           ('batch_wall_time', 'float64'),  # wall time of the batch that built the model
+           ('recorded_at', 'float64')]
+
+
+def results_store_available():
+    """Returns True if pyarrow is installed."""
+    return pa is not None
+
+
+# Identifier of one modeling run
+def new_run_id():
+    return '%s-%s' % (time.strftime('%Y%m%dT%H%M%S'), os.urandom(3).hex())
+
+
+# Model type and indices from a MODELLER model filename
+def parse_model_name(name):
+    """
+    Parses 'seq.B9999NNNN.pdb' (core model NNNN) and 'seq.BLLLLLNNNN.pdb' (loop model LLLL of core model NNNN).
+
+    Returns:
+        tuple: (model type, model index, loop index or None).
+    """
+
+    code = os.path.basename(name).split('.')[-2]
+    if code.startswith('BL'):
+        return 'loop', int(code[-4:]), int(code[2:6])
+
+    return 'core', int(code[-4:]), None
+
+
+class ResultsStore:
+    """
+    Append-only Parquet dataset with one row per model. Every append writes a new part file (written
+    under a hidden name and renamed, so readers never see a partial file); queries read only the
+    requested columns and filter rows with pyarrow, across all runs in the store.
+
+    Args:
+        root (str, optional): Dataset directory. Defaults to $MODELLER_SCRIPTS_RESULTS_DIR, or
+            '.modeller_cache/results'.
+    """
+
+    def __init__(self, root=None):
+        if pa is None:
+            raise ImportError('The results store needs pyarrow (pip install pyarrow).')
+
+        self.root = root or os.environ.get(RESULTS_DIR_ENV) or RESULTS_DIR
+        self.schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in COLUMNS])
+        self._parts = 0
+
+    def append(self, rows):
+        """
+        Appends rows (dicts keyed by column name; missing columns are stored as null).
+
+        Args:
+            rows (list): Rows to append.
+        """
+
+        if not rows:
+            return
+
+        os.makedirs(self.root, exist_ok=True)
+        table = pa.Table.from_pylist([{name: row.get(name) for name, _ in COLUMNS} for row in rows],
+                                     schema=self.schema)
+
+        self._parts += 1
+        name = 'part-%s-%d-%05d.parquet' % (rows[0].get('run_id', 'run'), os.getpid(), self._parts)
+        tmp_file = os.path.join(self.root, '.' + name)
+        pq.write_table(table, tmp_file)
+        os.replace(tmp_file, os.path.join(self.root, name))
+
+    def append_outputs(self, outputs, run_id, mode, knowns, sequence, refinement, batch_wall_time=None):
+        """
+        Appends MODELLER model outputs (a.outputs / a.loop.outputs entries).
+
+        Args:
+            outputs (list): Output dictionaries.
+            run_id (str): Run identifier.
+            mode (str): Template mode ('single' or 'mult').
+            knowns (str or tuple): Template code(s).
+            sequence (str): Target code.
+            refinement (str): Optimization preset.
+            batch_wall_time (float, optional): Wall time of the batch that built the models.
+        """
+
+        template_set = knowns if isinstance(knowns, str) else '+'.join(knowns)
+        now = time.time()
+
+        rows = []
+        for output in outputs:
+            model_type, model_index, loop_index = parse_model_name(output['name'])
+            ga341 = output.get('GA341 score')
+            if isinstance(ga341, (list, tuple)):
+                ga341 = ga341[0]  # the GA341 score, followed by its components
+
+            rows.append({'schema_version': SCHEMA_VERSION, 'run_id': run_id, 'mode': mode,
+                         'model_type': model_type, 'refinement': refinement, 'template_set': template_set,
+                         'sequence': sequence, 'model_index': model_index, 'loop_index': loop_index,
+                         'file_path': os.path.abspath(output['name']), 'molpdf': output.get('molpdf'),
+                         'dope': output.get('DOPE score'), 'ga341': ga341,
+                         'failure': None if output.get('failure') is None else str(output['failure']),
+                         'batch_wall_time': batch_wall_time, 'recorded_at': now})
+
+        self.append(rows)
+
+    def query(self, columns=None, sort_by=None, limit=None, **filters):
+        """
+        Reads rows of all runs.
+
+        Args:
+            columns (list, optional): Columns to read. Defaults to all columns.
+            sort_by (str, optional): Column to sort by (ascending).
+            limit (int, optional): Maximum number of rows returned.
+            **filters: Column values; a list or tuple matches any of its values, e.g.
+                query(mode='single', failure=None, run_id=['a', 'b']).
+
+        Returns:
+            pyarrow.Table: The matching rows.
+        """
+
+        if not os.path.isdir(self.root):
+            return self.schema.empty_table()
+
+        expression = None
+        for name, value in filters.items():
+            if value is None:
+                condition = ds.field(name).is_null()
+            elif isinstance(value, (list, tuple)):
+                condition = ds.field(name).isin(list(value))
+            else:
+                condition = ds.field(name) == value
+            expression = condition if expression is None else expression & condition
+
+        table = ds.dataset(self.root, format='parquet', schema=self.schema).to_table(columns=columns,
+                                                                                    filter=expression)
+        if sort_by is not None:
+            table = table.sort_by(sort_by)
+        if limit is not None:
+            table = table.slice(0, limit)
+
+        return table
+
+    def compact(self):
+        """Merges all part files into one. Run it while no modeling run is writing to the store."""
+
+        parts = [os.path.join(self.root, x) for x in os.listdir(self.root) if x.endswith('.parquet')]
+        if len(parts) < 2:
+            return
+
+        table = ds.dataset(parts, format='parquet', schema=self.schema).to_table()
+        self._parts += 1
+        name = 'part-compacted-%d-%05d.parquet' % (os.getpid(), self._parts)
+        tmp_file = os.path.join(self.root, '.' + name)
+        pq.write_table(table, tmp_file)
+        os.replace(tmp_file, os.path.join(self.root, name))
+
+        for part in parts:
+            os.remove(part)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query the modeling results store')
+    parser.add_argument('--dir', help='store directory (default: .modeller_cache/results)')
+    parser.add_argument('--run-id', help='only this run')
+    parser.add_argument('--mode', choices=('single', 'mult'), help='only this template mode')
+    parser.add_argument('--top', type=int, default=10, help='number of best models shown (by DOPE score)')
+    parser.add_argument('--compact', action='store_true', help='merge the part files of the store')
+    args = parser.parse_args()
+
+    store = ResultsStore(args.dir)
+    if args.compact:
+        store.compact()
+        sys.exit(0)
+
+    query_filters = {'failure': None}
+    if args.run_id:
+        query_filters['run_id'] = args.run_id
+    if args.mode:
+        query_filters['mode'] = args.mode
+
+    for row in store.query(columns=['run_id', 'mode', 'model_type', 'file_path', 'dope', 'ga341'], sort_by='dope',
+                           limit=args.top, **query_filters).to_pylist():
+        print("%(run_id)s\t%(mode)s\t%(model_type)s\t%(dope).3f\t%(file_path)s" % row)
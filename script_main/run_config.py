@@ -0,0 +1,150 @@
+# Run options for unattended (batch) runs of the modeling and docking pipeline
+import os
+import sys
+import json
+import argparse
+
+# Existing-output policies of every stage. 'ask' prompts the user and is the default of interactive runs.
+POLICIES = {
+    'alignment': ('ask', 'overwrite', 'skip'),  # existing ligand alignment files
+    'modeling': ('overwrite', 'skip', 'resume'),  # existing models of Step 4
+    'reorganize': ('ask', 'overwrite', 'skip'),  # existing files in the autodockfr input folders
+}
+
+# Default policies of batch runs
+BATCH_DEFAULTS = {'alignment': 'overwrite', 'modeling': 'overwrite', 'reorganize': 'overwrite'}
+
+# Environment variables carrying the options to the stage scripts started as subprocesses
+BATCH_ENV = 'MODELLER_SCRIPTS_BATCH'
+POLICY_ENV = 'MODELLER_SCRIPTS_POLICY_{}'
+NUM_CPUS_ENV = 'MODELLER_SCRIPTS_NUM_CPUS'  # CPU share of the docking scripts
+
+# Steps of execute_modeller.py that can be run separately
+RUN_STAGES = ('all', 'align', 'model', 'dock')
+
+# Directory of this module, added to PYTHONPATH of the stage scripts
+SCRIPT_MAIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Parse the command line of execute_modeller.py
+def parse_run_options(argv=None):
+    """
+    Parses the command-line options of an unattended run.
+
+    Args:
+        argv (list, optional): Arguments to parse. Defaults to sys.argv[1:].
+
+    Returns:
+        argparse.Namespace: batch (bool), config (str or None), stage (str), policies (dict of stage -> policy),
+        settings (dict of setting overrides from the config file).
+    """
+
+    parser = argparse.ArgumentParser(description='Homology modeling with MODELLER and docking with AutodockFR')
+    parser.add_argument('--batch', action='store_true',
+                        help='run without any interactive prompt')
+    parser.add_argument('--config',
+                        help='JSON file with "settings" (overrides of the Step 1 variables), "batch" and "policies"')
+    parser.add_argument('--overwrite', choices=('ask', 'overwrite', 'skip'),
+                        help='policy for existing alignment and docking input files')
+    parser.add_argument('--modeling', choices=POLICIES['modeling'],
+                        help='policy for existing models: rebuild, skip the modeling step, or resume')
+    parser.add_argument('--resume', action='store_const', dest='modeling', const='resume',
+                        help='same as --modeling resume')
+    parser.add_argument('--stage', choices=RUN_STAGES, default='all',
+                        help='run only the alignment (Step 3), modeling (Step 4) or docking (Step 5) step')
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.config:
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+
+    batch = args.batch or bool(config.get('batch', False))
+    policies = dict(BATCH_DEFAULTS) if batch else {'alignment': 'ask', 'modeling': 'overwrite', 'reorganize': 'ask'}
+    policies.update(config.get('policies', {}))
+    if args.overwrite:
+        policies['alignment'] = policies['reorganize'] = args.overwrite
+    if args.modeling:
+        policies['modeling'] = args.modeling
+
+    for stage, policy in policies.items():
+        if stage not in POLICIES or policy not in POLICIES[stage]:
+            parser.error(f"Invalid policy '{policy}' for stage '{stage}'.")
+        if batch and policy == 'ask':
+            parser.error(f"Policy 'ask' of stage '{stage}' is not allowed in batch mode.")
+
+    return argparse.Namespace(batch=batch, config=args.config, stage=args.stage, policies=policies,
+                              settings=config.get('settings', {}))
+
+
+# Override module-level settings with the values of the config file
+def apply_settings(settings, namespace):
+    """
+    Overrides existing variables of a namespace (e.g. the globals() of execute_modeller.py).
+    Unknown names are rejected so that typos do not go unnoticed.
+
+    Args:
+        settings (dict): Setting name -> value.
+        namespace (dict): Namespace to update.
+    """
+
+    unknown = [x for x in settings if x not in namespace]
+    if unknown:
+        raise KeyError(f"Unknown settings in the config file: {', '.join(unknown)}")
+
+    for name, value in settings.items():
+        # JSON has no tuples: template lists are given as lists of [code, chain] pairs
+        if isinstance(value, list) and value and all(isinstance(x, list) for x in value):
+            value = [tuple(x) for x in value]
+        namespace[name] = value
+
+
+# Make the options visible to this process and to the stage scripts it starts
+def export_run_options(options):
+    os.environ[BATCH_ENV] = '1' if options.batch else '0'
+    for stage, policy in options.policies.items():
+        os.environ[POLICY_ENV.format(stage.upper())] = policy
+
+
+def is_batch_mode():
+    """Returns True if the run must not prompt the user."""
+    return os.environ.get(BATCH_ENV) == '1'
+
+
+def stage_policy(stage):
+    """Returns the existing-output policy of a stage."""
+    default = BATCH_DEFAULTS[stage] if is_batch_mode() else POLICIES[stage][0]
+    return os.environ.get(POLICY_ENV.format(stage.upper()), default)
+
+
+# Decide whether existing output files are replaced
+def confirm_overwrite(prompt, stage):
+    """
+    Applies the policy of a stage to existing output files, prompting only in interactive runs.
+
+    Args:
+        prompt (str): Question shown in interactive runs (answered with y/n).
+        stage (str): Pipeline stage ('alignment' or 'reorganize').
+
+    Returns:
+        bool: True if the existing files are replaced.
+    """
+
+    policy = stage_policy(stage)
+    if policy == 'overwrite':
+        return True
+    if policy == 'skip' or is_batch_mode():
+        return False
+
+    return input(prompt).lower() == 'y'
+
+
+# Environment of the stage scripts started as subprocesses
+def stage_environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(x for x in (SCRIPT_MAIN_DIR, env.get('PYTHONPATH')) if x)
+    return env
+
+
+if __name__ == "__main__":
+    print(parse_run_options(sys.argv[1:]))
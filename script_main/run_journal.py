@@ -0,0 +1,257 @@
+# Journal of the jobs of every pipeline stage, for resuming an interrupted run
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+
+from content_cache import CACHE_DIR, content_key, file_digest
+
+# Default journal location, relative to the working directory of execute_modeller.py
+JOURNAL_DB = os.path.join(CACHE_DIR, 'journal.sqlite')
+
+# Environment variable pointing the stage scripts to the journal of the run
+JOURNAL_DB_ENV = 'MODELLER_SCRIPTS_JOURNAL'
+
+# Job states
+STATES = ('running', 'done', 'failed')
+
+
+# File digests of this process, keyed by (path, modification time, size): large inputs such as the AGFR
+# maps are read by many jobs
+_digests = {}
+
+
+# Digest of an input file, or None if it does not exist
+def _input_digest(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _digests:
+        _digests[key] = file_digest(path)
+    return _digests[key]
+
+
+# Hash the input files and settings of a job
+def input_hash(files, *parts):
+    """
+    Hashes the content of the input files of a job. A missing file hashes differently from any existing
+    file, so a job whose input is recreated later does not count as complete.
+
+    Args:
+        files (list): Input filenames.
+        parts: Further strings or numbers the job depends on.
+
+    Returns:
+        str: The hex digest.
+    """
+
+    return content_key('inputs', [_input_digest(x) for x in files], *parts)
+
+
+# Hash the parameters of a job
+def parameters_key(parameters):
+    return content_key('parameters', json.dumps(parameters, sort_keys=True, default=str))
+
+
+class RunJournal:
+    """
+    SQLite table with one row per (stage, job): its state, the hash of its input files, its parameters,
+    output files, exit code, attempts and timings. Stages record a job when it starts and when it ends;
+    a rerun skips the jobs that are done with the same inputs and parameters and whose outputs still
+    exist.
+
+    Stages: 'model', 'repair', 'pdbqt' (receptor preparation), 'map' (AGFR), 'dock' (ADFR) and
+    'convert' (Open Babel).
+
+    Args:
+        path (str, optional): Database filename. Defaults to $MODELLER_SCRIPTS_JOURNAL, or
+            '.modeller_cache/journal.sqlite'.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(JOURNAL_DB_ENV) or JOURNAL_DB
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # Several processes (shards, docking stages) and the threads of the tool scheduler write to it
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                                'stage TEXT NOT NULL, job TEXT NOT NULL, state TEXT NOT NULL, '
+                                'input_hash TEXT, parameters TEXT, parameters_key TEXT, outputs TEXT, '
+                                'exit_code INTEGER, attempts INTEGER, started REAL, finished REAL, '
+                                'wall_time REAL, cpu_time REAL, host TEXT, pid INTEGER, '
+                                'PRIMARY KEY (stage, job))')
+        self.connection.commit()
+
+    def get(self, stage, job):
+        """
+        Returns the record of a job.
+
+        Args:
+            stage (str): Stage name.
+            job (str): Job name, unique within the stage.
+
+        Returns:
+            dict: The columns of the record ('parameters' and 'outputs' decoded), or None.
+        """
+
+        with self._lock:
+            cursor = self.connection.execute('SELECT * FROM jobs WHERE stage = ? AND job = ?', (stage, job))
+            row = cursor.fetchone()
+            names = [x[0] for x in cursor.description]
+
+        return None if row is None else self._decode(dict(zip(names, row)))
+
+    def is_complete(self, stage, job, inputs, parameters=None, outputs=None):
+        """
+        Checks whether a job is done and still valid.
+
+        Args:
+            stage (str): Stage name.
+            job (str): Job name.
+            inputs (str): Input hash of the job now (see input_hash).
+            parameters (dict, optional): Parameters of the job now.
+            outputs (list, optional): Files that must exist. Defaults to the recorded outputs.
+
+        Returns:
+            bool: True if the job is done with the same inputs and parameters and all its outputs exist.
+        """
+
+        record = self.get(stage, job)
+        if record is None or record['state'] != 'done':
+            return False
+        if record['input_hash'] != inputs or record['parameters_key'] != parameters_key(parameters):
+            return False
+
+        return all(os.path.isfile(x) for x in (record['outputs'] if outputs is None else outputs))
+
+    def is_stale(self, stage, job, inputs, parameters=None):
+        """Returns True if a job was recorded with other inputs or parameters than the given ones."""
+        record = self.get(stage, job)
+        return record is not None and (record['input_hash'] != inputs
+                                       or record['parameters_key'] != parameters_key(parameters))
+
+    def start(self, stage, job, inputs, parameters=None):
+        """
+        Records that a job has started. The attempts of a job count up until it is done once.
+
+        Args:
+            stage (str): Stage name.
+            job (str): Job name.
+            inputs (str): Input hash of the job (see input_hash).
+            parameters (dict, optional): Parameters of the job (JSON-serializable).
+        """
+
+        with self._lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO jobs (stage, job, state, input_hash, parameters, parameters_key, attempts, started, '
+                'host, pid) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?) '
+                'ON CONFLICT (stage, job) DO UPDATE SET state = excluded.state, input_hash = excluded.input_hash, '
+                'parameters = excluded.parameters, parameters_key = excluded.parameters_key, '
+                'attempts = CASE WHEN jobs.state = \'done\' THEN 1 ELSE jobs.attempts + 1 END, '
+                'started = excluded.started, finished = NULL, exit_code = NULL, host = excluded.host, '
+                'pid = excluded.pid',
+                (stage, job, 'running', inputs, json.dumps(parameters, sort_keys=True, default=str),
+                 parameters_key(parameters), time.time(), socket.gethostname(), os.getpid()))
+
+    def finish(self, stage, job, state, exit_code=None, outputs=(), wall_time=None, cpu_time=None):
+        """
+        Records the end of a job.
+
+        Args:
+            stage (str): Stage name.
+            job (str): Job name.
+            state (str): 'done' or 'failed'.
+            exit_code (int, optional): Exit code of the tool.
+            outputs (list, optional): Output files of the job.
+            wall_time (float, optional): Wall time (seconds) of all attempts.
+            cpu_time (float, optional): CPU time (seconds) of all attempts.
+        """
+
+        with self._lock, self.connection:
+            self.connection.execute('UPDATE jobs SET state = ?, exit_code = ?, outputs = ?, finished = ?, '
+                                    'wall_time = ?, cpu_time = ? WHERE stage = ? AND job = ?',
+                                    (state, exit_code, json.dumps([os.path.abspath(x) for x in outputs]),
+                                     time.time(), wall_time, cpu_time, stage, job))
+
+    def record(self, stage, job, state, inputs, parameters=None, outputs=(), exit_code=None, wall_time=None):
+        """Records a finished job in one step (for jobs that were not recorded when they started)."""
+        self.start(stage, job, inputs, parameters)
+        self.finish(stage, job, state, exit_code, outputs, wall_time)
+
+    def jobs(self, stage=None, state=None):
+        """
+        Lists the recorded jobs.
+
+        Args:
+            stage (str, optional): Only the jobs of this stage.
+            state (str, optional): Only the jobs in this state.
+
+        Returns:
+            list: Records sorted by stage and job name.
+        """
+
+        query, values = 'SELECT * FROM jobs WHERE 1 = 1', []
+        for column, value in (('stage', stage), ('state', state)):
+            if value is not None:
+                query += ' AND %s = ?' % column
+                values.append(value)
+
+        with self._lock:
+            cursor = self.connection.execute(query + ' ORDER BY stage, job', values)
+            names = [x[0] for x in cursor.description]
+            rows = cursor.fetchall()
+
+        return [self._decode(dict(zip(names, x))) for x in rows]
+
+    def forget(self, stage, job=None):
+        """Deletes the records of a stage (or of one of its jobs), so that they run again."""
+        with self._lock, self.connection:
+            if job is None:
+                self.connection.execute('DELETE FROM jobs WHERE stage = ?', (stage,))
+            else:
+                self.connection.execute('DELETE FROM jobs WHERE stage = ? AND job = ?', (stage, job))
+
+    @staticmethod
+    def _decode(record):
+        record['parameters'] = json.loads(record['parameters']) if record['parameters'] else None
+        record['outputs'] = json.loads(record['outputs']) if record['outputs'] else []
+        return record
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Show the jobs recorded in the run journal')
+    parser.add_argument('--db', default=None, help='journal database (default: $%s or %s)' % (JOURNAL_DB_ENV,
+                                                                                               JOURNAL_DB))
+    parser.add_argument('--stage', default=None, help='list the jobs of this stage')
+    parser.add_argument('--state', default=None, choices=STATES, help='list the jobs in this state')
+    parser.add_argument('--forget', default=None, metavar='STAGE', help='delete the records of a stage')
+    args = parser.parse_args()
+
+    journal = RunJournal(args.db)
+    if args.forget:
+        journal.forget(args.forget)
+        print("Records of stage '%s' deleted" % args.forget)
+    elif args.stage or args.state:
+        for record in journal.jobs(args.stage, args.state):
+            print("%-8s %-7s %8s  %s" % (record['stage'], record['state'],
+                                         '-' if record['wall_time'] is None else '%.1f' % record['wall_time'],
+                                         record['job']))
+    else:
+        counts = {}
+        for record in journal.jobs():
+            counts.setdefault(record['stage'], {}).setdefault(record['state'], 0)
+            counts[record['stage']][record['state']] += 1
+        for stage, states in sorted(counts.items()):
+            print("%-8s %s" % (stage, ', '.join('%d %s' % (n, x) for x, n in sorted(states.items()))))
+    journal.close()
@@ -0,0 +1,152 @@
+# Store of model scores keyed by structure content, shared by the modeling and docking steps
+import os
+import time
+import sqlite3
+import hashlib
+
+from content_cache import CACHE_DIR
+
+# Default store location, relative to the working directory of execute_modeller.py
+SCORE_DB = os.path.join(CACHE_DIR, 'scores.sqlite')
+
+# Environment variable pointing the stage scripts to the store of the run
+SCORE_DB_ENV = 'MODELLER_SCRIPTS_SCORE_DB'
+
+# Method of the stage-00 scores: DOPE of the first chain after rebuilding the missing atoms with complete_pdb
+COMPLETE_PDB = 'complete_pdb'
+
+
+# Hash the protein coordinates of a PDB file
+def structure_key(pdb_file):
+    """
+    Hashes the ATOM records of the first model of a PDB file: atom and residue names, chain, residue
+    number and coordinates (columns 13-54). Atom serial numbers, HETATM records and all other records
+    are ignored, so a model and the protein part split from it get the same key.
+
+    Args:
+        pdb_file (str): PDB filename.
+
+    Returns:
+        tuple: (hex digest, list of chain IDs in file order).
+    """
+
+    digest = hashlib.sha256()
+    chains = []
+    with open(pdb_file, 'r', encoding="utf8", errors='ignore') as f:
+        for line in f:
+            if line.startswith('ENDMDL'):
+                break
+            if not line.startswith('ATOM  '):
+                continue
+
+            digest.update(line[12:54].encode('utf8'))
+            if line[21] not in chains:
+                chains.append(line[21])
+
+    return digest.hexdigest(), chains
+
+
+# Selection the score of a structure refers to
+def score_selection(chains, chain=None, method=None):
+    """
+    Returns 'all' for scores of the whole structure, or 'chain X' for a chain of a multi-chain structure.
+    Scores computed another way than MODELLER computes them during modeling (e.g. after rebuilding the
+    missing atoms with complete_pdb) are kept apart under a method prefix, e.g. 'complete_pdb:all'.
+    """
+
+    selection = 'all' if chain is None or len(chains) <= 1 else 'chain %s' % chain
+    return selection if method is None else '%s:%s' % (method, selection)
+
+
+# Selection of the first-chain DOPE score after complete_pdb (the score of 00-summary_dope.py)
+def first_chain_selection(chains):
+    return score_selection(chains, chains[0] if chains else None, method=COMPLETE_PDB)
+
+
+class ScoreStore:
+    """
+    SQLite table of DOPE, GA341 and molpdf scores keyed by (structure key, selection). The modeling
+    engine records the scores MODELLER computes for every model under 'all', and the first-chain DOPE
+    score after complete_pdb under the selection 00-summary_dope.py looks up (see first_chain_selection);
+    later steps look up the scores computed the way they compute them instead of recomputing them.
+
+    Args:
+        path (str, optional): Database filename. Defaults to $MODELLER_SCRIPTS_SCORE_DB, or
+            '.modeller_cache/scores.sqlite'.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(SCORE_DB_ENV) or SCORE_DB
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # Several processes (shards, docking steps) may write at the same time
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS scores ('
+                                'structure_key TEXT NOT NULL, selection TEXT NOT NULL, '
+                                'dope REAL, ga341 REAL, molpdf REAL, source TEXT, created REAL, '
+                                'PRIMARY KEY (structure_key, selection))')
+        self.connection.commit()
+
+    def get(self, key, selection='all'):
+        """
+        Returns the recorded scores of a structure.
+
+        Args:
+            key (str): Structure key (see structure_key).
+            selection (str, optional): Selection of the scores (see score_selection). Defaults to 'all'.
+
+        Returns:
+            dict: 'dope', 'ga341', 'molpdf' and 'source', or None if the structure was not scored.
+        """
+
+        row = self.connection.execute('SELECT dope, ga341, molpdf, source FROM scores '
+                                      'WHERE structure_key = ? AND selection = ?', (key, selection)).fetchone()
+        if row is None:
+            return None
+
+        return {'dope': row[0], 'ga341': row[1], 'molpdf': row[2], 'source': row[3]}
+
+    def put_many(self, rows):
+        """
+        Records scores, replacing earlier scores of the same structures.
+
+        Args:
+            rows (list): (key, selection, dope, ga341, molpdf, source) tuples.
+        """
+
+        now = time.time()
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        [tuple(x) + (now,) for x in rows])
+
+    def put(self, key, selection='all', dope=None, ga341=None, molpdf=None, source=None):
+        """Records the scores of one structure."""
+        self.put_many([(key, selection, dope, ga341, molpdf, source)])
+
+    def record_outputs(self, outputs):
+        """
+        Records the scores of MODELLER model outputs (a.outputs / a.loop.outputs entries) whose
+        model files exist in the working directory.
+
+        Args:
+            outputs (list): Output dictionaries.
+        """
+
+        rows = []
+        for output in outputs:
+            if output.get('failure') is not None or not os.path.isfile(output['name']):
+                continue
+
+            ga341 = output.get('GA341 score')
+            if isinstance(ga341, (list, tuple)):
+                ga341 = ga341[0]  # the GA341 score, followed by its components
+
+            key, _ = structure_key(output['name'])
+            rows.append((key, 'all', output.get('DOPE score'), ga341, output.get('molpdf'), output['name']))
+
+        if rows:
+            self.put_many(rows)
+
+    def close(self):
+        self.connection.close()
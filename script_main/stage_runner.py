@@ -0,0 +1,177 @@
+# Run the pipeline stage scripts inside the current Python process, with import and wall time reports
+import os
+import sys
+import time
+import runpy
+import builtins
+import subprocess
+
+from run_config import stage_environment
+
+# Docking stage scripts of the autodockfr folder, in order
+DOCKING_STAGES = ('00-summary_dope.py',
+                  '01-foldx_repair.py',
+                  '02-prepare_ligand_parallel.py',
+                  '03-reorganize_directory.py',
+                  '04-generate_affinity_map.py',
+                  '05-autodockfr.py',
+                  '06-summary_docking_results.py',
+                  '07-select_top_conformations.py',
+                  '08-convert_output_mol_mol2.py')
+
+# Stages replaced by docking_pipeline.py in streaming docking
+STREAMED_STAGES = ('01-foldx_repair.py', '02-prepare_ligand_parallel.py', '04-generate_affinity_map.py',
+                   '05-autodockfr.py')
+
+
+# Docking stage scripts of a run
+def docking_stages(streaming=True):
+    """
+    Lists the autodockfr scripts of Step 5.
+
+    Args:
+        streaming (bool, optional): Replace the per-tool scripts 01, 02, 04 and 05 by docking_pipeline.py
+            (run after 03, which organizes its inputs). Defaults to True.
+
+    Returns:
+        list: Script filenames, in order.
+    """
+
+    if not streaming:
+        return list(DOCKING_STAGES)
+
+    stages = [x for x in DOCKING_STAGES if x not in STREAMED_STAGES]
+    stages.insert(stages.index('03-reorganize_directory.py') + 1, 'docking_pipeline.py')
+    return stages
+
+
+class ImportTimer:
+    """
+    Measures the time spent in import statements while it is active (nested imports are counted once,
+    in the outermost import) and the modules imported for the first time.
+    """
+
+    def __init__(self):
+        self.import_time = 0.0
+        self.new_modules = []
+        self._depth = 0
+        self._import = None
+        self._modules = None
+
+    def _timed_import(self, *args, **kwargs):
+        if self._depth:
+            return self._import(*args, **kwargs)
+
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            return self._import(*args, **kwargs)
+        finally:
+            self.import_time += time.perf_counter() - start
+            self._depth -= 1
+
+    def __enter__(self):
+        self._modules = set(sys.modules)
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self._import
+        # Third-party and pipeline packages; the standard library is not listed
+        stdlib = getattr(sys, 'stdlib_module_names', ())
+        self.new_modules = sorted({x.split('.')[0] for x in set(sys.modules) - self._modules
+                                   if not x.startswith('_') and x.split('.')[0] not in stdlib})
+        return False
+
+
+# Run one stage script in this process
+def run_stage(script, directory='.', args=()):
+    """
+    Runs a stage script as __main__ inside the current process, in its own directory (added to sys.path
+    so that it finds its helper modules). Modules already imported by earlier stages, such as MODELLER,
+    are not imported again. The functions of the script live in a temporary __main__ module that worker
+    processes cannot import, so scripts using multiprocessing must fork their workers.
+
+    Args:
+        script (str): Script filename, relative to directory.
+        directory (str, optional): Working directory of the script. Defaults to '.'.
+        args (list, optional): Command-line arguments of the script.
+
+    Returns:
+        dict: 'stage', 'status' ('done' or 'failed'), 'wall_time', 'import_time' and 'new_modules'
+            (top-level non-standard-library packages imported for the first time).
+    """
+
+    cwd = os.getcwd()
+    argv = sys.argv
+    path = list(sys.path)
+    result = {'stage': script, 'status': 'done'}
+
+    start = time.perf_counter()
+    os.chdir(directory)
+    sys.argv = [script] + list(args)
+    sys.path.insert(0, os.getcwd())
+    timer = ImportTimer()
+    try:
+        with timer:
+            runpy.run_path(script, run_name='__main__')
+    except SystemExit as error:
+        if error.code not in (None, 0):
+            result['status'] = 'failed'
+    except Exception as error:
+        print("Stage %s failed: %r" % (script, error))
+        result['status'] = 'failed'
+    finally:
+        os.chdir(cwd)
+        sys.argv = argv
+        sys.path[:] = path
+
+    result['wall_time'] = time.perf_counter() - start
+    result['import_time'] = timer.import_time
+    result['new_modules'] = timer.new_modules
+    return result
+
+
+# Run one stage script as a separate Python process (previous behavior)
+def run_stage_process(script, directory='.', args=()):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, script] + list(args), cwd=directory, env=stage_environment())
+    return {'stage': script, 'status': 'done' if process.returncode == 0 else 'failed',
+            'wall_time': time.perf_counter() - start, 'import_time': None, 'new_modules': []}
+
+
+def run_stages(scripts, directory='.', in_process=True):
+    """
+    Runs stage scripts one after the other and prints their wall and import times. A failed stage
+    does not stop the following ones.
+
+    Args:
+        scripts (list): Script filenames, relative to directory.
+        directory (str, optional): Working directory of the scripts. Defaults to '.'.
+        in_process (bool, optional): Run the scripts inside this process. Defaults to True; False starts
+            one Python interpreter per script.
+
+    Returns:
+        list: The result of every stage (see run_stage).
+    """
+
+    results = []
+    for script in scripts:
+        print("*** Stage %s ***" % script)
+        if in_process:
+            results.append(run_stage(script, directory))
+        else:
+            results.append(run_stage_process(script, directory))
+
+    print_stage_report(results)
+    return results
+
+
+# Print the wall and import time of every stage
+def print_stage_report(results):
+    print("%-32s %-7s %9s %9s  %s" % ('Stage', 'Status', 'Wall (s)', 'Imports', 'New modules'))
+    for result in results:
+        import_time = '-' if result['import_time'] is None else '%.2f' % result['import_time']
+        print("%-32s %-7s %9.2f %9s  %s" % (result['stage'], result['status'], result['wall_time'], import_time,
+                                             ', '.join(result['new_modules'][:8])))
@@ -0,0 +1,193 @@
+# Persistent index of the template PDB files in a directory
+import os
+import json
+
+from content_cache import CACHE_DIR, file_digest, find_atom_file
+from template_search import THREE_TO_ONE
+
+# Default index location, relative to the working directory
+INDEX_FILE = os.path.join(CACHE_DIR, 'template_index.json')
+
+# HETATM residues that are not counted as ligands
+IGNORED_HETATM = {'HOH', 'WAT', 'DOD'}
+
+
+# Read chains, residue ranges, sequences and ligands of a PDB file
+def read_pdb_metadata(pdb_file):
+    """
+    Reads the metadata of the first model of a PDB file using the fixed PDB columns
+    (record 1-6, atom name 13-16, residue name 18-20, chain 22, residue number and insertion code 23-27).
+
+    Args:
+        pdb_file (str): PDB filename.
+
+    Returns:
+        dict: {'chains': {chain: {'first': residue id, 'last': residue id, 'sequence': str}},
+               'chain_order': [chain, ...], 'ligands': [[residue name, chain, residue id], ...]}
+    """
+
+    chains = {}
+    chain_order = []
+    ligands = []
+    last_residue = None
+
+    with open(pdb_file, 'r', encoding="utf8", errors='ignore') as f:
+        for line in f:
+            record = line[0:6]
+            if record.startswith('ENDMDL'):
+                break
+            if record not in ('ATOM  ', 'HETATM'):
+                continue
+
+            res_name = line[17:20].strip()
+            chain = line[21:22]
+            res_id = line[22:27].strip()
+            if (chain, res_id, res_name) == last_residue:
+                continue
+            last_residue = (chain, res_id, res_name)
+
+            if record == 'HETATM' and res_name not in THREE_TO_ONE:
+                if res_name not in IGNORED_HETATM:
+                    ligands.append([res_name, chain, res_id])
+                continue
+
+            if chain not in chains:
+                chains[chain] = {'first': res_id, 'last': res_id, 'sequence': ''}
+                chain_order.append(chain)
+            chains[chain]['last'] = res_id
+            chains[chain]['sequence'] += THREE_TO_ONE.get(res_name, 'X')
+
+    return {'chains': chains, 'chain_order': chain_order, 'ligands': ligands}
+
+
+class TemplateIndex:
+    """
+    On-disk index of template PDB metadata. Entries are keyed by file path and validated by
+    modification time and size; a file whose timestamp changed is re-hashed and only re-parsed when
+    its content changed too. Directories with hundreds of templates are enumerated without opening
+    the PDB files again.
+
+    Args:
+        index_file (str, optional): Index filename. Defaults to '.modeller_cache/template_index.json'.
+    """
+
+    def __init__(self, index_file=INDEX_FILE):
+        self.index_file = index_file
+        self.entries = {}
+        self._dirty = False
+
+        if os.path.isfile(index_file):
+            with open(index_file, 'r') as f:
+                self.entries = json.load(f)
+
+    def get(self, pdb_file):
+        """
+        Returns the metadata of a PDB file, reading the file only if it is new or has changed.
+
+        Args:
+            pdb_file (str): PDB filename.
+
+        Returns:
+            dict: Metadata as returned by read_pdb_metadata, plus 'mtime', 'size' and 'sha256'.
+        """
+
+        key = os.path.abspath(pdb_file)
+        stat = os.stat(pdb_file)
+        entry = self.entries.get(key)
+
+        if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return entry
+
+        digest = file_digest(pdb_file)
+        if entry is None or entry['sha256'] != digest:
+            entry = read_pdb_metadata(pdb_file)
+            entry['sha256'] = digest
+
+        entry['mtime'] = stat.st_mtime
+        entry['size'] = stat.st_size
+        self.entries[key] = entry
+        self._dirty = True
+
+        return entry
+
+    def scan(self, directory='.'):
+        """
+        Indexes every .pdb file in a directory and saves the index.
+
+        Args:
+            directory (str, optional): Directory to scan. Defaults to the working directory.
+
+        Returns:
+            dict: PDB filename -> metadata.
+        """
+
+        pdb_files = sorted(x for x in os.listdir(directory) if x.endswith('.pdb'))
+        metadata = {x: self.get(os.path.join(directory, x)) for x in pdb_files}
+        self.save()
+
+        return metadata
+
+    def save(self):
+        """Writes the index if it has changed."""
+
+        if not self._dirty:
+            return
+
+        os.makedirs(os.path.dirname(self.index_file) or '.', exist_ok=True)
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_file, self.index_file)
+        self._dirty = False
+
+    def detect_templates(self, directory='.'):
+        """
+        Lists the templates of a directory as (code, chain) tuples, using the first protein chain
+        of every PDB file.
+
+        Args:
+            directory (str, optional): Directory to scan. Defaults to the working directory.
+
+        Returns:
+            list: (code, chain) tuples.
+        """
+
+        templates = []
+        for pdb_file, entry in self.scan(directory).items():
+            if entry['chain_order']:
+                templates.append((pdb_file.split('.')[0], entry['chain_order'][0]))
+
+        return templates
+
+    def chain_sequence(self, pdb_file, chain):
+        """Returns the one-letter sequence of a chain."""
+        return self.get(pdb_file)['chains'].get(chain, {}).get('sequence', '')
+
+    def count_ligands(self, pdb_file, chain):
+        """Returns the number of HETATM ligand residues (waters excluded) of a chain."""
+        return sum(1 for _, ligand_chain, _ in self.get(pdb_file)['ligands'] if ligand_chain == chain)
+
+    def ligand_counts(self, templates, atom_files_directory):
+        """
+        Counts the ligands of every template chain, looking up the template files like MODELLER does.
+
+        Args:
+            templates (list): (code, chain) tuples.
+            atom_files_directory (list): Directories searched for atom files.
+
+        Returns:
+            dict: Alignment code (code + chain) -> number of ligands, or None if a template file was not
+                found and the counts are unknown.
+        """
+
+        counts = {}
+        for (code, chain) in templates:
+            pdb_file = find_atom_file(code, atom_files_directory)
+            if pdb_file is None:
+                print('Ligands of template {}{} unknown: no atom file found in {}'.format(
+                    code, chain, ' or '.join(atom_files_directory)))
+                return None
+
+            counts[code + chain] = self.count_ligands(pdb_file, chain)
+
+        return counts
@@ -0,0 +1,363 @@
+# Template search over a PIR sequence database (e.g. pdball.pir)
+import os
+import json
+import numpy as np
+from modeller import *
+
+# Amino-acid alphabet of the k-mer index, every other residue is encoded as UNKNOWN
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+UNKNOWN = len(AMINO_ACIDS)
+KMER_SIZE = 3
+
+# Residue letter -> code lookup table
+_ENCODE = np.full(256, UNKNOWN, dtype=np.uint8)
+for _i, _aa in enumerate(AMINO_ACIDS):
+    _ENCODE[ord(_aa)] = _i
+    _ENCODE[ord(_aa.lower())] = _i
+
+
+# Encode a sequence string as residue codes
+def encode_sequence(sequence):
+    return _ENCODE[np.frombuffer(sequence.encode('ascii', errors='replace'), dtype=np.uint8)]
+
+
+# Compute the k-mer ids of encoded residues
+def kmer_ids(codes, k=KMER_SIZE):
+    """
+    Computes the k-mer id of every window of k residues.
+
+    Args:
+        codes (numpy.ndarray): Encoded residues.
+        k (int, optional): K-mer length. Defaults to 3.
+
+    Returns:
+        numpy.ndarray: K-mer ids (int64), -1 for windows that contain an unknown residue.
+    """
+
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    ids = np.zeros(n, dtype=np.int64)
+    unknown = np.zeros(n, dtype=bool)
+    for i in range(k):
+        window = codes[i:i + n]
+        ids = ids * UNKNOWN + window
+        unknown |= window == UNKNOWN
+
+    ids[unknown] = -1
+    return ids
+
+
+# Read the entries of a PIR file
+def read_pir_entries(pir_file):
+    """
+    Reads a PIR file and yields one entry at a time.
+
+    Args:
+        pir_file (str): PIR filename.
+
+    Yields:
+        tuple: (code, pdb_id, chain, sequence, byte offset of the entry in the file).
+    """
+
+    with open(pir_file, 'rb') as f:
+        code = header = None
+        offset = 0
+        sequence = []
+        position = 0
+        for raw in f:
+            line = raw.decode('utf8', errors='ignore').strip()
+            if line.startswith('>P1;'):
+                code, header, sequence, offset = line[4:], None, [], position
+            elif code is not None and header is None:
+                header = line.split(':')
+            elif code is not None:
+                sequence.append(line)
+                if line.endswith('*'):
+                    pdb_id = header[1].strip() if len(header) > 1 and header[1].strip() else code[:4]
+                    chain = header[3].strip() if len(header) > 3 and header[3].strip() else code[4:5]
+                    yield code, pdb_id, chain, ''.join(sequence).rstrip('*'), offset
+                    code = None
+            position += len(raw)
+
+
+class SequenceDatabase:
+    """
+    Compact on-disk form of a PIR sequence database with a k-mer index. The database is converted
+    once (`build`) into NumPy files next to the PIR file and then opened memory-mapped, so later
+    searches never parse the PIR text again.
+
+    Files written for database 'pdball.pir':
+        pdball.pir.meta.json  codes, PDB ids, chains and PIR byte offsets of the entries
+        pdball.pir.kptr.npy   start of every k-mer's posting list in kseq (CSR pointer)
+        pdball.pir.kseq.npy   ids of the sequences containing each k-mer
+        pdball.pir.nkmer.npy  number of distinct k-mers of every sequence
+
+    Args:
+        pir_file (str): PIR sequence database filename.
+    """
+
+    def __init__(self, pir_file, k=KMER_SIZE):
+        self.pir_file = pir_file
+        self.k = k
+        self.meta = None
+        self.kptr = self.kseq = self.nkmer = None
+
+    def _path(self, suffix):
+        return self.pir_file + suffix
+
+    def is_current(self):
+        """Returns True if the converted files exist and are newer than the PIR file."""
+        paths = [self._path(x) for x in ('.meta.json', '.kptr.npy', '.kseq.npy', '.nkmer.npy')]
+        return (all(os.path.isfile(x) for x in paths)
+                and min(os.path.getmtime(x) for x in paths) >= os.path.getmtime(self.pir_file))
+
+    def build(self, chunk_size=20000):
+        """
+        Converts the PIR file into the compact form. Sequences are processed in chunks, so memory use is
+        bounded by the size of the final index.
+
+        Args:
+            chunk_size (int, optional): Number of sequences per chunk. Defaults to 20000.
+        """
+
+        meta = {'k': self.k, 'codes': [], 'pdb_ids': [], 'chains': [], 'offsets': [], 'lengths': []}
+        pairs = []  # unique (k-mer, sequence id) pairs of every chunk
+        nkmer = []
+        chunk = []
+
+        def index_chunk(chunk, first_id):
+            kmer_list, seq_list = [], []
+            for i, sequence in enumerate(chunk):
+                ids = np.unique(kmer_ids(encode_sequence(sequence), self.k))
+                ids = ids[ids >= 0]
+                nkmer.append(len(ids))
+                kmer_list.append(ids)
+                seq_list.append(np.full(len(ids), first_id + i, dtype=np.int64))
+            if kmer_list:
+                pairs.append(np.concatenate(kmer_list) << 32 | np.concatenate(seq_list))
+
+        for code, pdb_id, chain, sequence, offset in read_pir_entries(self.pir_file):
+            meta['codes'].append(code)
+            meta['pdb_ids'].append(pdb_id)
+            meta['chains'].append(chain)
+            meta['offsets'].append(offset)
+            meta['lengths'].append(len(sequence))
+            chunk.append(sequence)
+            if len(chunk) == chunk_size:
+                index_chunk(chunk, len(meta['codes']) - len(chunk))
+                chunk = []
+        index_chunk(chunk, len(meta['codes']) - len(chunk))
+
+        # Sort the pairs by k-mer to get a CSR index: kseq[kptr[kmer]:kptr[kmer + 1]]
+        pairs = np.sort(np.concatenate(pairs)) if pairs else np.empty(0, dtype=np.int64)
+        kmers = pairs >> 32
+        kseq = (pairs & 0xFFFFFFFF).astype(np.int32)
+        kptr = np.zeros(UNKNOWN ** self.k + 1, dtype=np.int64)
+        np.cumsum(np.bincount(kmers, minlength=UNKNOWN ** self.k), out=kptr[1:])
+
+        np.save(self._path('.kptr.npy'), kptr)
+        np.save(self._path('.kseq.npy'), kseq)
+        np.save(self._path('.nkmer.npy'), np.array(nkmer, dtype=np.int32))
+        with open(self._path('.meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        print("Sequence database '%s' indexed: %d sequences" % (self.pir_file, len(meta['codes'])))
+
+    def open(self):
+        """Opens the converted database, building it first if it is missing or out of date."""
+
+        if not self.is_current():
+            self.build()
+
+        with open(self._path('.meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.kptr = np.load(self._path('.kptr.npy'), mmap_mode='r')
+        self.kseq = np.load(self._path('.kseq.npy'), mmap_mode='r')
+        self.nkmer = np.load(self._path('.nkmer.npy'), mmap_mode='r')
+
+        return self
+
+    def prefilter(self, sequence, min_shared=0.1, max_candidates=500):
+        """
+        Ranks the database sequences by the fraction of the query's k-mers they contain.
+
+        Args:
+            sequence (str): Query sequence.
+            min_shared (float, optional): Minimum fraction of shared query k-mers. Defaults to 0.1.
+            max_candidates (int, optional): Maximum number of candidates returned. Defaults to 500.
+
+        Returns:
+            list: (sequence id, shared fraction) tuples, best first.
+        """
+
+        query = np.unique(kmer_ids(encode_sequence(sequence), self.k))
+        query = query[query >= 0]
+        if len(query) == 0:
+            return []
+
+        postings = [self.kseq[self.kptr[x]:self.kptr[x + 1]] for x in query]
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.meta['codes'])) / len(query)
+
+        candidates = np.flatnonzero(shared >= min_shared)
+        if len(candidates) > max_candidates:
+            candidates = candidates[np.argpartition(-shared[candidates], max_candidates)[:max_candidates]]
+        candidates = candidates[np.argsort(-shared[candidates], kind='stable')]
+
+        return [(int(x), float(shared[x])) for x in candidates]
+
+    def write_entries(self, seq_ids, output_file):
+        """Copies the PIR entries of the given sequence ids into a new PIR file."""
+
+        with open(self.pir_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
+            for seq_id in seq_ids:
+                f_in.seek(self.meta['offsets'][seq_id])
+                f_out.write(f_in.readline())
+                for line in f_in:
+                    if line.startswith(b'>P1;'):
+                        break
+                    f_out.write(line)
+
+
+# Read the sequence of one entry of a PIR alignment file
+def read_target_sequence(alignment_file, align_code):
+    for code, _, _, sequence, _ in read_pir_entries(alignment_file):
+        if code == align_code:
+            return sequence.replace('-', '').replace('/', '')
+    raise ValueError(f"Sequence '{align_code}' not found in '{alignment_file}'.")
+
+
+# Search the sequence database for templates of the target
+def search_templates(target_seq_file, target_seq_code, seq_database, max_hits=10, max_evalue=0.01,
+                     min_shared=0.1, max_candidates=500):
+    """
+    Searches templates for the target in a PIR sequence database. The database is converted once
+    into a memory-mapped k-mer index; the k-mer prefilter selects candidate chains, and only those
+    are searched with MODELLER's profile.build.
+
+    Args:
+        target_seq_file (str): Target sequence in PIR format.
+        target_seq_code (str): Code of the target in the PIR file.
+        seq_database (str): PIR sequence database (e.g. 'pdball.pir').
+        max_hits (int, optional): Maximum number of templates returned. Defaults to 10.
+        max_evalue (float, optional): E-value cutoff of the profile search. Defaults to 0.01.
+        min_shared (float, optional): Minimum fraction of target k-mers shared by a candidate. Defaults to 0.1.
+        max_candidates (int, optional): Maximum number of candidates passed to the profile search. Defaults to 500.
+
+    Returns:
+        list: Ranked (pdb_id, chain) tuples.
+    """
+
+    # Step 1: k-mer prefilter over the whole database
+    db = SequenceDatabase(seq_database).open()
+    sequence = read_target_sequence(target_seq_file, target_seq_code)
+    candidates = db.prefilter(sequence, min_shared, max_candidates)
+    print("Template search: %d of %d database sequences passed the k-mer filter"
+          % (len(candidates), len(db.meta['codes'])))
+    if not candidates:
+        return []
+
+    candidates_file = target_seq_code + '_candidates.pir'
+    db.write_entries([seq_id for seq_id, _ in candidates], candidates_file)
+
+    # Step 2: Profile search of the target against the candidates only
+    env = Environ()
+    sdb = SequenceDB(env)
+    sdb.read(seq_database_file=candidates_file, seq_database_format='PIR',
+             chains_list='ALL', minmax_db_seq_len=(30, 4000), clean_sequences=True)
+
+    aln = Alignment(env)
+    aln.append(file=target_seq_file, alignment_format='PIR', align_codes=target_seq_code)
+    prf = aln.to_profile()
+    prf.build(sdb, matrix_offset=-450, rr_file='${LIB}/blosum62.sim.mat',
+              gap_penalties_1d=(-500, -50), n_prof_iterations=1,
+              check_profile=False, max_aln_evalue=max_evalue)
+
+    profile_file = target_seq_code + '_search.prf'
+    prf.write(file=profile_file, profile_format='TEXT')
+
+    # Step 3: Rank the hits by e-value, then sequence identity
+    codes = {code: i for i, code in enumerate(db.meta['codes'])}
+    hits = []
+    with open(profile_file, 'r') as f:
+        for line in f:
+            columns = line.split()
+            if line.startswith('#') or len(columns) < 12 or columns[1] not in codes or columns[2] != 'X':
+                continue
+            try:
+                identity, evalue = float(columns[10]), float(columns[11])
+            except ValueError:
+                continue
+            seq_id = codes[columns[1]]
+            hits.append((evalue, -identity, db.meta['pdb_ids'][seq_id], db.meta['chains'][seq_id]))
+
+    ranked = []
+    for _, _, pdb_id, chain in sorted(hits):
+        if (pdb_id, chain) not in ranked:
+            ranked.append((pdb_id, chain))
+
+    return ranked[:max_hits]
+
+
+# Three-letter to one-letter residue codes
+THREE_TO_ONE = {'ALA': 'A', 'CYS': 'C', 'ASP': 'D', 'GLU': 'E', 'PHE': 'F', 'GLY': 'G', 'HIS': 'H', 'ILE': 'I',
+                'LYS': 'K', 'LEU': 'L', 'MET': 'M', 'ASN': 'N', 'PRO': 'P', 'GLN': 'Q', 'ARG': 'R', 'SER': 'S',
+                'THR': 'T', 'VAL': 'V', 'TRP': 'W', 'TYR': 'Y', 'MSE': 'M', 'HSD': 'H', 'HSE': 'H', 'HID': 'H',
+                'HIE': 'H', 'CYX': 'C'}
+
+
+# Keep a diverse, non-redundant subset of the templates
+def select_diverse_templates(target_sequence, template_sequences, max_templates=8, max_identity=0.95,
+                             min_coverage=0.0):
+    """
+    Selects a non-redundant template subset. Every sequence is represented by its k-mer presence vector;
+    pairwise identity between templates and coverage of the target are estimated from shared k-mers with
+    a single matrix product. Templates are taken greedily by target coverage and skipped when they are
+    too similar to a template already selected.
+
+    Args:
+        target_sequence (str): Target sequence.
+        template_sequences (dict): (pdb_id, chain) -> template sequence.
+        max_templates (int, optional): Maximum number of templates kept. Defaults to 8.
+        max_identity (float, optional): Templates sharing more than this fraction of k-mers with a selected
+            template are redundant. Defaults to 0.95.
+        min_coverage (float, optional): Minimum fraction of the target k-mers a template must cover. Defaults to 0.0.
+
+    Returns:
+        list: The selected (pdb_id, chain) tuples, best covering first.
+    """
+
+    keys = list(template_sequences)
+    if not keys:
+        return []
+
+    # k-mer presence matrix: one row per template
+    num_kmers = UNKNOWN ** KMER_SIZE
+    presence = np.zeros((len(keys), num_kmers), dtype=np.float32)
+    for i, key in enumerate(keys):
+        ids = kmer_ids(encode_sequence(template_sequences[key]))
+        presence[i, ids[ids >= 0]] = 1.0
+
+    target = np.zeros(num_kmers, dtype=np.float32)
+    ids = kmer_ids(encode_sequence(target_sequence))
+    target[ids[ids >= 0]] = 1.0
+
+    counts = np.maximum(presence.sum(axis=1), 1.0)
+    shared = presence @ presence.T
+    identity = shared / np.minimum(counts[:, None], counts[None, :])
+    coverage = presence @ target / max(target.sum(), 1.0)
+
+    selected = []
+    for i in np.argsort(-coverage, kind='stable'):
+        if coverage[i] < min_coverage:
+            continue
+        if selected and identity[i, selected].max() > max_identity:
+            print("Template %s%s skipped: redundant (%.2f k-mer identity)"
+                  % (keys[i][0], keys[i][1], identity[i, selected].max()))
+            continue
+        selected.append(int(i))
+        if len(selected) == max_templates:
+            break
+
+    return [keys[i] for i in selected]
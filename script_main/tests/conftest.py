@@ -0,0 +1,76 @@
+# Test setup: script_main on the import path, and stand-ins for MODELLER and pandas when they are not installed
+import os
+import sys
+import types
+
+SCRIPT_MAIN = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPT_MAIN not in sys.path:
+    sys.path.insert(0, SCRIPT_MAIN)
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    module.__all__ = [x for x in attributes if not x.startswith('_')]
+    sys.modules[name] = module
+    return module
+
+
+class _Stub:
+    """Accepts any constructor arguments and attribute assignments."""
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+class _Libs:
+    def __init__(self):
+        self.topology = types.SimpleNamespace(read=lambda file: None)
+        self.parameters = types.SimpleNamespace(read=lambda file: None)
+
+
+class _Environ(_Stub):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.libs = _Libs()
+        self.io = types.SimpleNamespace(atom_files_directory=[], hetatm=False)
+
+
+class _LoopModel(_Stub):
+    def get_loop_model_filename(self, root, id1, id2, file_ext):
+        return '%s.BL%04d%04d%s' % (root, id1, id2, file_ext)
+
+
+class _ModellerError(Exception):
+    pass
+
+
+def _install_modeller():
+    schedule = types.SimpleNamespace(slow='slow', fast='fast', very_fast='very_fast')
+    modeller = _module('modeller', Environ=_Environ, Selection=_Stub, Model=_Stub, Alignment=_Stub,
+                       ModellerError=_ModellerError, info=types.SimpleNamespace(version='test'))
+    modeller.automodel = _module('modeller.automodel', AutoModel=_Stub, LoopModel=_LoopModel,
+                                 assess=types.SimpleNamespace(DOPE='DOPE', GA341='GA341'),
+                                 refine=schedule, autosched=schedule)
+    modeller.parallel = _module('modeller.parallel', Job=list, LocalWorker=_Stub, Task=_Stub)
+    modeller.scripts = _module('modeller.scripts', complete_pdb=lambda env, file: _Stub(file))
+
+
+def _install_pandas():
+    class DataFrame(_Stub):
+        def to_csv(self, *args, **kwargs):
+            pass
+
+    _module('pandas', DataFrame=DataFrame, __version__='0')
+
+
+try:
+    import modeller  # noqa: F401
+except ImportError:
+    _install_modeller()
+
+try:
+    import pandas  # noqa: F401
+except ImportError:
+    _install_pandas()
@@ -0,0 +1,52 @@
+import json
+import os
+
+from batch_driver import load_manifest, run_batch
+
+# Stand-in for execute_modeller.py: records its stage and CPU share, fails the model step of target 'bad'
+SCRIPT = '''
+import json, os, sys
+stage = sys.argv[sys.argv.index('--stage') + 1]
+with open(sys.argv[sys.argv.index('--config') + 1]) as f:
+    config = json.load(f)
+with open('stages.txt', 'a') as f:
+    f.write('%s %s %s\\n' % (stage, config['settings']['num_cpus'], os.environ['MODELLER_SCRIPTS_NUM_CPUS']))
+sys.exit(1 if stage == 'model' and os.path.basename(os.getcwd()) == 'bad' else 0)
+'''
+
+
+def write_manifest(tmp_path, manifest):
+    (tmp_path / 'fake_modeller.py').write_text(SCRIPT)
+    for target in manifest['targets']:
+        (tmp_path / target['name']).mkdir()
+    path = tmp_path / 'manifest.json'
+    path.write_text(json.dumps(manifest))
+    return str(path)
+
+
+def test_load_manifest_defaults(tmp_path):
+    path = write_manifest(tmp_path, {'cpu_budget': 8, 'script': 'fake_modeller.py',
+                                     'targets': [{'name': 'a'}, {'name': 'b', 'work_dir': 'a', 'stages': ['dock']}]})
+    manifest = load_manifest(path)
+    assert manifest['dock_cpus'] == 8 and manifest['min_model_cpus'] == 1
+    assert manifest['script'] == str(tmp_path / 'fake_modeller.py')
+    assert manifest['targets'][0]['stages'] == ['align', 'model', 'dock']
+    assert manifest['targets'][0]['num_cpus'] == 8
+    assert manifest['targets'][1]['work_dir'] == str(tmp_path / 'a')
+
+
+def test_run_batch_orders_stages_and_skips_after_failures(tmp_path):
+    path = write_manifest(tmp_path, {'cpu_budget': 4, 'dock_cpus': 2, 'script': 'fake_modeller.py',
+                                     'targets': [{'name': 'good', 'num_cpus': 3}, {'name': 'bad', 'num_cpus': 3}]})
+    summary = run_batch(path, poll_interval=0.05)
+
+    status = {(x['target'], x['stage']): x['status'] for x in summary}
+    assert status == {('good', 'align'): 'done', ('good', 'model'): 'done', ('good', 'dock'): 'done',
+                      ('bad', 'align'): 'done', ('bad', 'model'): 'failed', ('bad', 'dock'): 'skipped'}
+
+    # Steps of a target run in order, each with its CPU share in the config and the environment
+    stages = (tmp_path / 'good' / 'stages.txt').read_text().split('\n')[:-1]
+    assert [x.split()[0] for x in stages] == ['align', 'model', 'dock']
+    assert all(x.split()[1] == x.split()[2] for x in stages)
+    assert stages[0].split()[1] == '1'
+    assert os.path.isfile(str(tmp_path / 'batch_summary.json'))
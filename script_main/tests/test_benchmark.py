@@ -0,0 +1,68 @@
+import json
+import os
+
+import benchmark
+from benchmark import compare_reports, describe, load_benchmark, run_benchmark
+
+
+def test_describe():
+    assert describe([]) == {'count': 0}
+    assert describe([None]) == {'count': 0}
+    stats = describe([-3.0, None, -1.0, -2.0])
+    assert stats == {'count': 3, 'min': -3.0, 'mean': -2.0, 'median': -2.0, 'std': 1.0, 'max': -1.0}
+    assert describe([5.0])['std'] == 0.0
+
+
+def write_config(tmp_path, **settings):
+    (tmp_path / 'target.ali').write_text('>P1;target\n')
+    config = dict({'alignment_file': 'target.ali', 'knowns': 'tmpl', 'sequence': 'target'}, **settings)
+    (tmp_path / 'bench.json').write_text(json.dumps(config))
+    return str(tmp_path / 'bench.json')
+
+
+def test_load_benchmark_resolves_paths_and_defaults(tmp_path, monkeypatch):
+    monkeypatch.setattr(benchmark, 'available_cpus', lambda: 6)
+    config = load_benchmark(write_config(tmp_path))
+    assert config['alignment_file'] == str(tmp_path / 'target.ali')
+    assert config['atom_files_directory'] == [os.path.join(str(tmp_path), '.')]
+    assert (config['num_models'], config['repeats'], config['num_cpus'], config['presets']) == \
+        (8, 1, [1, 6], ['fast', 'slow'])
+
+
+def test_run_benchmark_collects_every_case(tmp_path, monkeypatch):
+    def measure(run_dir):
+        with open(os.path.join(run_dir, 'run.json')) as f:
+            run = json.load(f)
+        if run['num_cpus'] == 1:
+            with open(os.path.join(run_dir, benchmark.RUN_RESULT), 'w') as f:
+                json.dump({'dope': [-10.0, -20.0], 'ga341': [1.0, 0.8], 'failures': 1}, f)
+        return {'returncode': 0, 'wall_time': 2.0, 'cpu_time_user': 1.0, 'cpu_time_system': 0.5, 'peak_rss_mb': 50}
+
+    monkeypatch.setattr(benchmark, '_measure_case', measure)
+    config_file = write_config(tmp_path, num_cpus=[1, 2], repeats=2,
+                               presets=['fast', {'name': 'medium', 'md_level': 'fast', 'library_schedule': 'normal',
+                                                 'max_var_iterations': 300, 'repeat_optimization': 2}])
+    report = run_benchmark(config_file, str(tmp_path / 'runs'))
+
+    assert [(x['preset'], x['num_cpus'], x['repeat']) for x in report['runs']][:4] == \
+        [('fast', 1, 0), ('fast', 1, 1), ('fast', 2, 0), ('fast', 2, 1)]
+    assert len(report['runs']) == 8
+    first = report['runs'][0]
+    assert first['dope']['mean'] == -15.0 and first['failures'] == 1
+    assert 'dope' not in report['runs'][2]
+    assert os.path.isfile(tmp_path / 'runs' / 'medium_2cpu_r1' / 'target.ali')
+
+
+def run(preset, num_cpus, wall_time, dope, returncode=0):
+    return {'preset': preset, 'num_cpus': num_cpus, 'returncode': returncode, 'wall_time': wall_time,
+            'dope': {'count': 1, 'mean': dope}}
+
+
+def test_compare_reports_flags_slower_and_worse_runs():
+    baseline = {'runs': [run('fast', 1, 10.0, -100.0), run('fast', 1, 12.0, -100.0), run('slow', 1, 50.0, -200.0)]}
+    report = {'runs': [run('fast', 1, 12.0, -100.0), run('slow', 1, 50.0, -170.0), run('slow', 4, 1.0, 0.0),
+                       run('fast', 1, 99.0, 0.0, returncode=1)]}
+
+    assert compare_reports(report, baseline) == ["slow, 1 CPUs: mean DOPE -200.0 -> -170.0"]
+    assert compare_reports(report, baseline, tolerance=0.0) == ["fast, 1 CPUs: wall time 11.0 s -> 12.0 s",
+                                                               "slow, 1 CPUs: mean DOPE -200.0 -> -170.0"]
@@ -0,0 +1,81 @@
+import os
+import time
+
+from content_cache import (ArtifactCache, alignment_atom_files, content_key, directory_state, file_digest,
+                           find_atom_file, produced_files)
+
+
+def test_content_key_separates_parts():
+    assert content_key('ab', 'c') != content_key('a', 'bc')
+    assert content_key('a', ('b', 'c')) != content_key('a', 'b', 'c')
+    assert content_key('a', 1, True) == content_key('a', 1, True)
+    assert content_key('x', 'tmpl') != content_key('x', ('tmpl',))
+
+
+def test_file_digest_follows_the_content(tmp_path):
+    (tmp_path / 'a.pdb').write_text('ATOM\n')
+    (tmp_path / 'b.pdb').write_text('ATOM\n')
+    assert file_digest(str(tmp_path / 'a.pdb')) == file_digest(str(tmp_path / 'b.pdb'), chunk_size=2)
+    (tmp_path / 'b.pdb').write_text('HETATM\n')
+    assert file_digest(str(tmp_path / 'a.pdb')) != file_digest(str(tmp_path / 'b.pdb'))
+
+
+def test_find_atom_files_of_an_alignment(tmp_path):
+    (tmp_path / 'atom_files').mkdir()
+    (tmp_path / '1abc.pdb').write_text('END\n')
+    (tmp_path / 'atom_files' / '2xyz.ent').write_text('END\n')
+    directories = [str(tmp_path), str(tmp_path / 'atom_files')]
+    assert find_atom_file('1abc', directories) == os.path.join(str(tmp_path), '1abc.pdb')
+    assert find_atom_file('3nop', directories) is None
+
+    alignment = tmp_path / 'target.ali'
+    alignment.write_text('>P1;1abc\nstructureX:1abc:1:A:10:A::::\nAAA*\n'
+                         '>P1;2xyz\nstructureX:2xyz:1:A:10:A::::\nAAA*\n'
+                         '>P1;3nop\nstructureX:3nop:1:A:10:A::::\nAAA*\n'
+                         '>P1;target\nsequence:target:::::::\nAAA*\n')
+    assert alignment_atom_files(str(alignment), directories) == [
+        os.path.join(str(tmp_path), '1abc.pdb'), os.path.join(str(tmp_path / 'atom_files'), '2xyz.ent')]
+
+
+def test_artifact_cache_store_and_restore(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    (tmp_path / 'target.rsr').write_text('restraints\n')
+    (tmp_path / 'target.ini').write_text('initial model\n')
+
+    assert not cache.restore('key', ['target.rsr'])
+    cache.store('key', ['target.rsr', 'target.ini'])
+    assert cache.contains('key', ['target.rsr', 'target.ini'])
+    assert not cache.contains('key', ['target.pap'])
+    assert os.listdir(str(tmp_path / 'cache')) == ['key']  # no temporary directory left behind
+
+    os.remove('target.rsr')
+    assert cache.restore('key', ['target.rsr'])
+    assert (tmp_path / 'target.rsr').read_text() == 'restraints\n'
+
+    # An existing entry is kept as it is
+    (tmp_path / 'target.rsr').write_text('other restraints\n')
+    cache.store('key', ['target.rsr'])
+    assert (tmp_path / 'cache' / 'key' / 'target.rsr').read_text() == 'restraints\n'
+
+
+def test_restore_entry_brings_back_every_output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'target.seq').write_text('input\n')
+    before = directory_state()
+    time.sleep(0.01)
+
+    for name in ('fm00495.ali', 'fm00495.tree', '1abcA_fit.pdb'):
+        (tmp_path / name).write_text(name)
+    outputs = produced_files(before)
+    assert outputs == ['1abcA_fit.pdb', 'fm00495.ali', 'fm00495.tree']
+
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    cache.store('salign', outputs)
+    for name in outputs:
+        os.remove(name)
+
+    assert cache.restore_entry('salign', ['fm00495.pap']) is None
+    assert cache.restore_entry('missing', []) is None
+    assert cache.restore_entry('salign', ['fm00495.ali']) == outputs
+    assert all(os.path.isfile(x) for x in outputs)
@@ -0,0 +1,37 @@
+from core_func import process_pir_file
+
+ALIGNMENT = ('>P1;1abcA\n'
+             'structureX:1abc:1:A:+5:A:::-1.00:-1.00\n'
+             'MKT-AY*\n'
+             '\n'
+             '>P1;2xyzB\n'
+             'structureX:2xyz:10:B:+6:B:::-1.00:-1.00\n'
+             'MKTQAY*\n'
+             '\n'
+             '>P1;target\n'
+             'sequence:target:::::::0.00: 0.00\n'
+             'MKTQAF*\n')
+
+
+def run(tmp_path, num_ligands):
+    (tmp_path / 'in.ali').write_text(ALIGNMENT)
+    output = tmp_path / 'out.ali'
+    process_pir_file(str(tmp_path / 'in.ali'), str(output), num_ligands)
+    return output.read_text().splitlines()
+
+
+def test_process_pir_file_same_ligands_everywhere(tmp_path):
+    lines = run(tmp_path, 2)
+    assert lines[1] == 'structureX:1abc:1:A:+7:A:::-1.00:-1.00'
+    assert lines[2] == 'MKT-AY..*'
+    assert lines[5] == 'structureX:2xyz:10:B:+8:B:::-1.00:-1.00'
+    assert lines[10] == 'MKTQAF..*'
+
+
+def test_process_pir_file_counts_per_template(tmp_path):
+    lines = run(tmp_path, {'1abcA': 2, '2xyzB': 1})
+    assert lines[1] == 'structureX:1abc:1:A:+7:A:::-1.00:-1.00'
+    assert lines[2] == 'MKT-AY..*'
+    assert lines[5] == 'structureX:2xyz:10:B:+7:B:::-1.00:-1.00'
+    assert lines[6] == 'MKTQAY.-*'  # padded to the width of the other entries
+    assert lines[10] == 'MKTQAF..*'  # the target gets every ligand
@@ -0,0 +1,81 @@
+import pytest
+
+import cpu_budget
+from cpu_budget import SCHEDULER_ENV, cgroup_cpu_limit, scheduler_cpus
+
+
+@pytest.fixture
+def no_scheduler(monkeypatch):
+    for name in SCHEDULER_ENV:
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_scheduler_cpus(no_scheduler, monkeypatch):
+    assert scheduler_cpus() is None
+
+    monkeypatch.setenv('NSLOTS', '6')
+    assert scheduler_cpus() == 6
+
+    # Slurm lists every node: the first entry is this node's
+    monkeypatch.setenv('SLURM_JOB_CPUS_PER_NODE', '16(x2),8')
+    assert scheduler_cpus() == 16
+
+    # --cpus-per-task wins over the node allocation; unparsable values are skipped
+    monkeypatch.setenv('SLURM_CPUS_PER_TASK', 'n/a')
+    assert scheduler_cpus() == 16
+    monkeypatch.setenv('SLURM_CPUS_PER_TASK', '4')
+    assert scheduler_cpus() == 4
+
+
+def test_cgroup_paths(tmp_path):
+    proc_file = tmp_path / 'cgroup'
+    proc_file.write_text('12:cpu,cpuacct:/slurm/job_1\n4:memory:/slurm/job_1\n0::/user.slice/session.scope\n')
+    paths = cpu_budget._cgroup_paths(str(proc_file))
+    assert paths['cpu'] == paths['cpuacct'] == '/slurm/job_1'
+    assert paths[''] == '/user.slice/session.scope'
+    assert cpu_budget._cgroup_paths(str(tmp_path / 'missing')) == {}
+
+
+def test_cgroup_v2_limit_is_the_tightest_level(tmp_path, monkeypatch):
+    monkeypatch.setattr(cpu_budget, 'CGROUP_ROOT', str(tmp_path))
+    monkeypatch.setattr(cpu_budget, '_cgroup_paths', lambda: {'': '/batch/job'})
+    (tmp_path / 'batch' / 'job').mkdir(parents=True)
+    (tmp_path / 'cpu.max').write_text('max 100000\n')
+    (tmp_path / 'batch' / 'cpu.max').write_text('400000 100000\n')
+    (tmp_path / 'batch' / 'job' / 'cpu.max').write_text('250000 100000\n')
+    assert cgroup_cpu_limit() == 2.5
+
+    (tmp_path / 'batch' / 'job' / 'cpu.max').write_text('max 100000\n')
+    assert cgroup_cpu_limit() == 4.0
+
+
+def test_cgroup_v1_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(cpu_budget, 'CGROUP_ROOT', str(tmp_path))
+    monkeypatch.setattr(cpu_budget, '_cgroup_paths', lambda: {'cpu': '/docker/abc'})
+    job = tmp_path / 'cpu,cpuacct' / 'docker' / 'abc'
+    job.mkdir(parents=True)
+    (job / 'cpu.cfs_quota_us').write_text('-1\n')
+    (job / 'cpu.cfs_period_us').write_text('100000\n')
+    assert cgroup_cpu_limit() is None
+
+    (job / 'cpu.cfs_quota_us').write_text('300000\n')
+    assert cgroup_cpu_limit() == 3.0
+
+
+def test_available_cpus_takes_the_smallest_limit(monkeypatch):
+    monkeypatch.setattr(cpu_budget, 'cpu_limits',
+                        lambda: {'affinity': 16, 'cgroup': 3.5, 'scheduler': None, 'assigned': 8})
+    assert cpu_budget.available_cpus() == 3
+    assert cpu_budget.cpu_budget(0.5) == 1
+
+    monkeypatch.setattr(cpu_budget, 'cpu_limits',
+                        lambda: {'affinity': 4, 'cgroup': 0.5, 'scheduler': None, 'assigned': None})
+    assert cpu_budget.available_cpus() == 1
+
+
+def test_assigned_cpus_come_from_the_batch_driver(no_scheduler, monkeypatch):
+    monkeypatch.setattr(cpu_budget, 'cgroup_cpu_limit', lambda: None)
+    monkeypatch.setenv(cpu_budget.NUM_CPUS_ENV, '2')
+    assert cpu_budget.cpu_limits()['assigned'] == 2
+    monkeypatch.setenv(cpu_budget.NUM_CPUS_ENV, '0')
+    assert cpu_budget.cpu_limits()['assigned'] is None
@@ -0,0 +1,421 @@
+import os
+import types
+import importlib.util
+
+import pytest
+
+import model_engine
+from model_engine import (DOPE_KEY, ConvergenceMonitor, ModelEngine, TopModelRanking, default_batch_size,
+                          split_index_batches)
+from results_store import parse_model_name
+
+
+def output(name, dope, failure=None):
+    return {'name': name, 'failure': failure, 'molpdf': 1.0, DOPE_KEY: dope, 'GA341 score': [1.0]}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_split_index_batches():
+    assert split_index_batches([1, 2, 3, 4, 5], 2) == [(1, 2), (3, 4), (5, 5)]
+    assert split_index_batches([5, 1, 2, 2, 7, 8], 10) == [(1, 2), (5, 5), (7, 8)]
+    assert split_index_batches([], 4) == []
+
+
+def test_top_model_ranking_keeps_best_k():
+    ranking = TopModelRanking(top_k=2)
+    assert ranking.push(output('a', -10.0))
+    assert ranking.push(output('b', -30.0))
+    assert ranking.push(output('c', -20.0))
+    assert not ranking.push(output('d', -5.0))
+    assert not ranking.push(output('e', None, failure='optimization failed'))
+
+    assert [x['name'] for x in ranking.ranked()] == ['b', 'c']
+    assert ranking.best()['name'] == 'b'
+    assert (ranking.num_seen, ranking.num_failed, len(ranking)) == (5, 1, 2)
+
+
+def test_top_model_ranking_keeps_first_of_equal_scores():
+    ranking = TopModelRanking(top_k=1)
+    ranking.push(output('a', -10.0))
+    ranking.push(output('b', -10.0))
+    assert ranking.best()['name'] == 'a'
+
+
+def test_convergence_monitor_stops_after_patience():
+    monitor = ConvergenceMonitor(top_k=2, patience=3, min_models=4)
+    assert not monitor.update([output('a', -10.0), output('b', -20.0)])
+    assert not monitor.update([output('c', -30.0)])  # improves the top-2 mean
+    assert not monitor.update([output('d', -1.0), output('e', -2.0)])
+    assert monitor.update([output('f', -3.0)])
+
+    assert monitor.since_improvement == 3
+    assert monitor.top_k_mean() == -25.0
+    assert len(monitor.history) == 4
+    assert monitor.history[-1]['num_models'] == 6
+    assert monitor.history[-1]['best_dope'] == -30.0
+
+
+def test_convergence_monitor_respects_min_models_and_tolerance():
+    monitor = ConvergenceMonitor(top_k=1, patience=1, min_models=10, tolerance=0.5)
+    monitor.update([output('a', -10.0), output('b', -10.1), output('c', -10.2)])
+    assert monitor.since_improvement == 2  # improvements below the tolerance do not count
+    assert not monitor.converged()
+
+
+def test_default_batch_size():
+    assert default_batch_size(100, 8) == 8
+    assert default_batch_size(100, 0) == 1
+    # With adaptive sampling a batch never covers the whole run
+    monitor = ConvergenceMonitor(patience=20)
+    assert default_batch_size(100, 128, monitor) == 20
+    assert default_batch_size(40, 128, monitor) == 10
+    assert default_batch_size(2, 128, monitor) == 1
+
+
+def test_engine_default_batch_size(workdir):
+    engine = ModelEngine('target.ali', 'tmpl', 'target', 1, 200, False, 256,
+                         convergence=ConvergenceMonitor(patience=30))
+    assert engine.batch_size == 30
+    assert ModelEngine('target.ali', 'tmpl', 'target', 1, 200, False, 256).batch_size == 256
+
+
+def test_convergence_counts_core_models_only(workdir):
+    monitor = ConvergenceMonitor(top_k=1, patience=2, min_models=1)
+    engine = ModelEngine('target.ali', 'tmpl', 'target', 1, 10, False, 1, loop_range=(1, 4), convergence=monitor)
+    engine.score_store = None
+
+    engine.add_outputs([output('core1', -10.0)],
+                       [output('loop%d' % i, -1.0) for i in range(4)])
+    assert monitor.ranking.num_seen == 1
+    assert not monitor.converged()
+    assert len(engine.loop_outputs) == 4
+
+    engine.add_outputs([], [output('loop5', -1.0)])
+    assert len(monitor.history) == 1
+
+
+class FakeModel:
+    def __init__(self, file, ga341=(0.9, 0.1, 0.2)):
+        self.file = file
+        self.ga341 = ga341
+        self.chains = ['A']
+
+    def assess_ga341(self):
+        if self.ga341 is None:
+            raise model_engine.ModellerError('no sequence identity')
+        return self.ga341
+
+
+class FakeSelection:
+    def __init__(self, mdl):
+        self.mdl = mdl
+
+    def assess_dope(self, **kwargs):
+        return -1234.5
+
+
+def write_model(path, molpdf=321.0, complete=True):
+    lines = ['REMARK   6 MODELLER OBJECTIVE FUNCTION:      %.4f' % molpdf,
+             'ATOM      1  N   MET A   1      11.104   6.134  -6.504  1.00  0.00           N']
+    path.write_text('\n'.join(lines + (['END'] if complete else [])) + '\n')
+
+
+def test_is_complete_pdb(workdir):
+    write_model(workdir / 'full.pdb')
+    write_model(workdir / 'truncated.pdb', complete=False)
+    assert model_engine.is_complete_pdb('full.pdb')
+    assert not model_engine.is_complete_pdb('truncated.pdb')
+    assert not model_engine.is_complete_pdb('missing.pdb')
+
+
+def test_score_model_file_uses_complete_pdb(workdir, monkeypatch):
+    scored = []
+    monkeypatch.setattr(model_engine, 'complete_pdb',
+                        lambda env, file: scored.append((env, file)) or FakeModel(file))
+    monkeypatch.setattr(model_engine, 'Selection', FakeSelection)
+    write_model(workdir / 'target.B99990001.pdb')
+
+    env = model_engine.scoring_environ()
+    result = model_engine.score_model_file(env, 'target.B99990001.pdb')
+    assert scored == [(env, 'target.B99990001.pdb')]
+    assert result == {'name': 'target.B99990001.pdb', 'failure': None, 'molpdf': 321.0, DOPE_KEY: -1234.5,
+                      'GA341 score': [0.9, 0.1, 0.2]}
+
+    monkeypatch.setattr(model_engine, 'complete_pdb', lambda env, file: FakeModel(file, ga341=None))
+    assert model_engine.score_model_file(env, 'target.B99990001.pdb')['GA341 score'] is None
+
+
+def test_resume_completed_skips_built_models(workdir, monkeypatch):
+    monkeypatch.setattr(model_engine, 'complete_pdb', lambda env, file: FakeModel(file))
+    monkeypatch.setattr(model_engine, 'Selection', FakeSelection)
+    write_model(workdir / 'target.B99990001.pdb')
+    write_model(workdir / 'target.B99990002.pdb', complete=False)
+
+    engine = ModelEngine('target.ali', 'tmpl', 'target', 1, 3, False, 1, resume=True)
+    engine.journal = None
+    assert engine.resume_completed() == [1]
+    assert engine.model_indices == [2, 3]
+    assert engine.best_model['name'] == 'target.B99990001.pdb'
+
+    # The stored score of the model is found without re-scoring it
+    stored = ModelEngine('target.ali', 'tmpl', 'target', 1, 3, False, 1)
+    stored.journal = None
+    monkeypatch.setattr(model_engine, 'complete_pdb', None)
+    assert stored.stored_output('target.B99990001.pdb')['GA341 score'] == [0.9]
+
+
+def test_prepare_restraints_stops_after_the_restraints(workdir, monkeypatch):
+    stages = []
+
+    class FakeAutoModel:
+        def make(self, exit_stage=0):
+            stages.append(exit_stage)
+
+    engine = ModelEngine('target.ali', 'tmpl', 'target', 3, 8, False, 1)
+    monkeypatch.setattr(engine, 'make_model', lambda env, first, last: stages.append((first, last)) or FakeAutoModel())
+    engine.prepare_restraints()
+    assert stages == [(3, 3), 1]
+
+    engine.restraint_cache = None
+    engine.prepare_restraints()
+    assert len(stages) == 2
+
+
+class FakeRestraints:
+    def __init__(self):
+        self.files = []
+
+    def clear(self):
+        self.files = []
+
+    def append(self, file):
+        self.files.append(file)
+
+
+class FakeHomology:
+    """Order of the calls of automodel.homcsr: topology and initial model, restraints, special restraints."""
+
+    csrfile = 'target.rsr'
+
+    def __init__(self):
+        self.calls = []
+        self.restraints = FakeRestraints()
+
+    def homcsr(self, exit_stage):
+        self.calls.append('initial model')
+        if exit_stage == 2:
+            return
+        self.mkhomcsr(None, None)
+        self.special_restraints(None)
+
+    def mkhomcsr(self, selected_atoms, aln):
+        self.calls.append('derive restraints')
+        with open(self.csrfile, 'w') as f:
+            f.write('R 3 1 1 1 2 2 1 3 4 1.5 0.1\n')
+
+    def special_restraints(self, aln):
+        self.calls.append('special restraints')
+
+
+class ReusingModel(model_engine._RestraintReuseMixin, FakeHomology):
+    pass
+
+
+def test_restraint_reuse_keeps_the_initial_model(workdir):
+    cache = model_engine.ArtifactCache(str(workdir / 'cache'))
+
+    first = ReusingModel()
+    first.restraint_cache, first.restraint_key = cache, 'k' * 64
+    first.homcsr(0)
+    assert first.calls == ['initial model', 'derive restraints', 'special restraints']
+    assert cache.contains('k' * 64, ['target.rsr'])
+
+    os.remove('target.rsr')
+    second = ReusingModel()
+    second.restraint_cache, second.restraint_key = cache, 'k' * 64
+    second.homcsr(0)
+    assert second.calls == ['initial model']
+    assert second.restraints.files == ['target.rsr']
+
+    third = ReusingModel()
+    third.reuse_restraints = True
+    third.homcsr(0)
+    assert third.calls == ['initial model']
+
+
+def test_restraint_key_normalizes_the_template_codes(workdir):
+    (workdir / 'target.ali').write_text('>P1;tmpl\nstructureX:tmpl:1:A:2:A::::\nAA*\n')
+    single = ModelEngine('target.ali', 'tmpl', 'target', 1, 2, False, 1)
+    shard = ModelEngine('target.ali', ('tmpl',), 'target', 1, 2, False, 1)
+    env = single.make_environ()
+    assert single.restraint_key(env) == shard.restraint_key(env)
+    assert single.journal_inputs() == shard.journal_inputs()
+
+
+class FakeOptimization:
+    """automodel.single_model: randomizes the initial model with rand_method, then optimizes it."""
+
+    sequence = 'target'
+    rand_method = None
+
+    def __init__(self):
+        self.calls = []
+
+    def single_model(self, atmsel, num, parallel=False):
+        if self.rand_method:
+            self.rand_method(atmsel)
+        self.calls.append('optimize %d' % num)
+
+    def write(self, file):
+        self.calls.append('write %s' % file)
+
+
+class RecordingModel(model_engine._StartModelMixin, FakeOptimization):
+    pass
+
+
+def test_start_models_are_recorded_after_the_randomization():
+    a = RecordingModel()
+    a.rand_method = lambda atmsel: a.calls.append('randomize')
+    a.record_start_models = True
+    a.single_model(None, 7)
+    assert a.calls == ['randomize', 'write target.start_0007.pdb', 'optimize 7']
+    assert a._current_model == 7
+
+    a.calls, a.record_start_models = [], False
+    a.single_model(None, 8)
+    assert a.calls == ['randomize', 'optimize 8']
+
+
+def test_run_tiered_refines_from_the_screened_start_coordinates(workdir, monkeypatch):
+    runs = []
+
+    def run(self, job=None):
+        runs.append(self)
+        if self.refinement == 'fast':
+            for i, dope in ((1, -10.0), (2, -30.0), (3, -20.0)):
+                self.ranking.push(output('target.B9999%04d.pdb' % i, dope))
+        return self.ranking.best()
+
+    monkeypatch.setattr(ModelEngine, 'run', run)
+    monkeypatch.setattr(model_engine, 'shared_job', lambda num_cpus: 'job')
+    (workdir / 'target.start_0002.pdb').write_text('END\n')
+
+    monitor = ConvergenceMonitor(patience=5)
+    model_engine.run_tiered('target.ali', 'tmpl', 'target', 1, 3, False, 1, 2, convergence=monitor)
+
+    screen, refine = runs
+    assert screen.refinement == 'fast' and screen.record_start_models
+    assert screen.convergence is monitor
+    assert refine.refinement == 'slow' and refine.model_indices == [4, 5]
+    # The best model restarts from its start coordinates; without them, from the screened model
+    assert refine.start_models == {4: 'target.start_0002.pdb', 5: 'target.B99990003.pdb'}
+    assert refine.run_id == screen.run_id
+
+
+def test_tiered_modeling_is_not_sharded():
+    from core_func import _build_models
+
+    with pytest.raises(ValueError):
+        _build_models('target.ali', 'tmpl', 'target', 1, 10, False, 2, 'single', None, 10, None, None, False, 2,
+                      refine_top=3)
+
+
+def test_high_energy_segments():
+    profile = [0.0, 0.5, 0.6, 0.0, 0.0, 0.0, 0.0, 0.7] + [0.0] * 4
+    assert model_engine.high_energy_segments(profile, 0.4) == [(1, 3), (6, 8)]
+    assert model_engine.high_energy_segments([1.0] * 30, 0.4) == [(0, 11), (12, 23), (24, 29)]
+    assert model_engine.high_energy_segments(profile, 1.0) == []
+
+
+def test_dope_profile_uses_complete_pdb(workdir, monkeypatch):
+    class ProfileSelection:
+        def __init__(self, mdl):
+            pass
+
+        def assess_dope(self, output, file, **kwargs):
+            with open(file, 'w') as f:
+                f.write('# residue profile\n1 -0.1 0.2\n3 -0.1 0.9\n')
+
+    completed = []
+    monkeypatch.setattr(model_engine, 'complete_pdb',
+                        lambda env, file: completed.append(file) or types.SimpleNamespace(residues=[1, 2, 3]))
+    monkeypatch.setattr(model_engine, 'Selection', ProfileSelection)
+
+    assert model_engine.dope_profile(None, 'target.B99990001.pdb') == [0.2, 0.0, 0.9]
+    assert completed == ['target.B99990001.pdb']
+
+
+def test_segment_loop_models_are_named_after_their_core_model():
+    a = model_engine.SegmentLoopModel()
+    assert a.get_loop_model_filename('target', 2, 1, '.pdb') == 'target.BL00020001.pdb'
+    a.core_index = 7
+    name = a.get_loop_model_filename('target', 2, 1, '.pdb')
+    assert name == model_engine.loop_model_filename('target', 2, 7) == 'target.BL00020007.pdb'
+    assert parse_model_name(name) == ('loop', 7, 2)
+
+
+def test_refine_loops_resumes_the_refined_core_models(workdir, monkeypatch):
+    built = []
+
+    class FakeSegmentLoopModel:
+        def __init__(self, env, inimodel, sequence, loop_assess_methods):
+            self.sequence, self.loop = sequence, types.SimpleNamespace()
+
+        def use_parallel_job(self, job):
+            pass
+
+        def make(self):
+            built.append(self.core_index)
+            self.loop.outputs = [output(model_engine.loop_model_filename(self.sequence, i, self.core_index), -5.0)
+                                 for i in range(1, 3)]
+
+    monkeypatch.setattr(model_engine, 'SegmentLoopModel', FakeSegmentLoopModel)
+    monkeypatch.setattr(ModelEngine, 'flush', lambda self: None)
+    for name in ('target.BL00010002.pdb', 'target.BL00020002.pdb', 'target.BL00010001.pdb'):
+        write_model(workdir / name)
+
+    engine = ModelEngine('target.ali', 'tmpl', 'target', 1, 3, False, 1, loop_range=(1, 2), loop_top_k=2,
+                         resume=True)
+    engine.journal = engine.score_store = engine.results_store = None
+    monkeypatch.setattr(engine, 'existing_output', lambda name: output(name, -7.0))
+    engine.add_outputs([output('target.B99990001.pdb', -10.0), output('target.B99990002.pdb', -20.0),
+                        output('target.B99990003.pdb', -1.0)])
+
+    engine.refine_loops(None, None)
+
+    # Core model 2 has all of its loop models, core model 1 only one of them
+    assert built == [1]
+    assert sorted(x['name'] for x in engine.loop_outputs) == ['target.BL00010001.pdb', 'target.BL00010002.pdb',
+                                                              'target.BL00020001.pdb', 'target.BL00020002.pdb']
+
+
+def test_recorded_models_are_not_rescored_by_stage_00(workdir, monkeypatch):
+    monkeypatch.setattr(model_engine, 'complete_pdb', lambda env, file: FakeModel(file))
+    monkeypatch.setattr(model_engine, 'Selection', FakeSelection)
+    monkeypatch.setenv('MODELLER_SCRIPTS_SCORE_DB', str(workdir / 'scores.sqlite'))
+    write_model(workdir / 'target.B99990001.pdb')
+
+    engine = ModelEngine('target.ali', 'tmpl', 'target', 1, 1, False, 1)
+    engine.journal = None
+    engine.add_outputs([output('target.B99990001.pdb', -10.0)])
+
+    # The protein part split from the model for docking (the REMARK and HETATM records are dropped)
+    atoms = [x for x in (workdir / 'target.B99990001.pdb').read_text().splitlines() if x.startswith('ATOM')]
+    (workdir / 'target_1_protein.pdb').write_text('\n'.join(atoms + ['END']) + '\n')
+
+    path = os.path.join(os.path.dirname(model_engine.__file__), '..', 'autodockfr', '00-summary_dope.py')
+    spec = importlib.util.spec_from_file_location('summary_dope', path)
+    stage = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(stage)
+    scored = []
+    monkeypatch.setattr(stage, 'calculate_dope_score', lambda pdb: scored.append(pdb) or (pdb[:-4], 0.0))
+    stage.main()
+
+    assert scored == []
+    assert (workdir / 'summary_dope_score.txt').read_text() == 'Filename\tDOPE Score\ntarget_1_protein\t-1234.5\n'
@@ -0,0 +1,88 @@
+import json
+import os
+
+import model_shards
+from model_engine import ConvergenceMonitor, ModelEngine
+from model_shards import convergence_settings, prepare_shards, shard_rand_seed, split_shards
+
+
+def test_split_shards_covers_the_range():
+    assert split_shards(1, 10, 3) == [(1, 4), (5, 7), (8, 10)]
+    assert split_shards(5, 6, 4) == [(5, 5), (6, 6)]
+    assert split_shards(1, 1, 0) == [(1, 1)]
+
+
+def test_shard_rand_seed_is_valid_and_distinct():
+    seeds = [shard_rand_seed(i) for i in range(100)]
+    assert all(-50000 <= x <= -2 for x in seeds)
+    assert len(set(seeds)) == len(seeds)
+
+
+def test_convergence_settings_round_trip():
+    assert convergence_settings(None) is None
+    monitor = ConvergenceMonitor(**convergence_settings(ConvergenceMonitor(3, 7, 11, 0.5)))
+    assert (monitor.top_k, monitor.patience, monitor.min_models, monitor.tolerance) == (3, 7, 11, 0.5)
+
+
+def test_prepare_shards_passes_the_run_settings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    prepared = []
+    monkeypatch.setattr(ModelEngine, 'prepare_restraints', lambda self: prepared.append((self.knowns, self.loop_range)))
+    (tmp_path / 'target.ali').write_text('>P1;target\n')
+
+    work_dirs = prepare_shards('target.ali', 'tmpl', 'target', 1, 10, False, 2, 4, loop_range=(1, 3), batch_size=2,
+                               convergence=ConvergenceMonitor(patience=5), resume=True, loop_top_k=2)
+
+    # The restraints are derived once, for the core models the shards build
+    assert prepared == [(('tmpl',), None)]
+    assert [os.path.basename(x) for x in work_dirs] == ['single_01', 'single_02']
+
+    with open(os.path.join(work_dirs[1], 'shard.json')) as f:
+        config = json.load(f)
+    assert (config['start_index'], config['end_index']) == (6, 10)
+    assert config['loop_range'] is None  # loops of the best core models are refined after the merge
+    assert config['batch_size'] == 2
+    assert config['convergence']['patience'] == 5
+    assert config['resume'] is True
+    assert os.path.isfile(os.path.join(work_dirs[0], 'target.ali'))
+
+
+def test_failed_shards_are_retried_with_resume(tmp_path, monkeypatch):
+    commands = []
+
+    class Result:
+        def __init__(self, returncode):
+            self.returncode = returncode
+
+    def run(command, **kwargs):
+        commands.append(command)
+        return Result(1 if len(commands) == 1 else 0)
+
+    monkeypatch.setattr(model_shards.subprocess, 'run', run)
+    assert model_shards._launch_shard('shard.json', str(tmp_path), max_retries=1)
+    assert commands[0][-1] == 'shard.json'
+    assert commands[1][-1] == '--resume'
+
+
+def test_run_concurrent_passes_the_branch_settings(monkeypatch):
+    from core_func import model_branch
+
+    prepared, merged = [], []
+    monkeypatch.setattr(model_shards, 'prepare_shards',
+                        lambda *args: prepared.append(args) or ['dir_%d' % len(prepared)])
+    monkeypatch.setattr(model_shards, 'launch_shards', lambda queue, max_workers, max_retries: None)
+    monkeypatch.setattr(model_shards, 'merge_shards', lambda *args: merged.append(args))
+
+    monitor = ConvergenceMonitor(patience=5)
+    branches = [model_branch('single.ali', 'tmpl', 'target', 1, 20, True, 'single', 1, 4, batch_size=3,
+                             convergence=monitor, resume=True, loop_top_k=2, loop_dope_threshold=0.1),
+                model_branch('mult.ali', ('t1', 't2'), 'target', 1, 20, True, 'mult')]
+    model_shards.run_concurrent(branches, 8, cpu_split=[0.5, 0.5])
+
+    # prepare_shards(..., shard_dir, batch_size, convergence, resume, loop_top_k)
+    assert prepared[0][-4:] == (3, monitor, True, 2)
+    assert prepared[1][-4:] == (None, None, False, None)
+    # merge_shards(..., top_k, resume, loop_top_k, loop_dope_threshold)
+    assert merged[0][0] == ['dir_1']
+    assert merged[0][-3:] == (True, 2, 0.1)
+    assert merged[1][-3:] == (False, None, None)
@@ -0,0 +1,120 @@
+import pickle
+
+import pytest
+
+import model_engine
+from model_engine import ModelEngine, PocketRandomizer, run_pocket_ensemble
+
+
+def output(name, dope):
+    return {'name': name, 'failure': None, 'molpdf': 1.0, 'DOPE score': dope, 'GA341 score': [1.0]}
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+class FakeAtoms:
+    def __init__(self):
+        self.deviation = None
+
+    def randomize_xyz(self, deviation):
+        self.deviation = deviation
+
+
+def test_pocket_randomizer_is_picklable():
+    randomizer = pickle.loads(pickle.dumps(PocketRandomizer(0.5)))
+    atoms = FakeAtoms()
+    randomizer(atoms)
+    assert atoms.deviation == 0.5
+
+
+class FakeSelection:
+    """Residue sets: select_sphere adds the residues listed as neighbours of the selected ones."""
+
+    def __init__(self, *residues):
+        self.residues = set(residues)
+
+    def select_sphere(self, radius):
+        return FakeSelection(*(self.residues | {x for r in self.residues for x in r.neighbours[radius]}))
+
+    def by_residue(self):
+        return self
+
+    def __sub__(self, other):
+        return FakeSelection(*(self.residues - other.residues))
+
+
+class FakeResidue:
+    def __init__(self, name, hetatm=False):
+        self.name, self.hetatm, self.neighbours = name, hetatm, {}
+
+
+class WholeModel:
+    def select_atoms(self):
+        return 'whole model'
+
+
+class PocketAutoModel(model_engine._PocketMixin, WholeModel):
+    def __init__(self, residues):
+        self.residues = residues
+
+
+def test_pocket_selection_excludes_the_ligands(monkeypatch):
+    monkeypatch.setattr(model_engine, 'Selection', FakeSelection)
+    near, far, ligand = FakeResidue('near'), FakeResidue('far'), FakeResidue('LIG', hetatm=True)
+    ligand.neighbours[8.0] = [near]
+
+    model = PocketAutoModel([near, far, ligand])
+    assert model.select_atoms() == 'whole model'
+    model.pocket_radius = 8.0
+    assert model.select_atoms().residues == {near}
+
+    with pytest.raises(model_engine.ModellerError):
+        no_ligand = PocketAutoModel([near, far])
+        no_ligand.pocket_radius = 8.0
+        no_ligand.select_atoms()
+
+
+def test_pocket_members_perturb_the_pocket_of_the_full_model(workdir):
+    engine = ModelEngine('target.ali', 'tmpl', 'target', 2, 4, True, 1, pocket_radius=6.0, pocket_deviation=0.5)
+    engine.restraint_cache = None
+    engine.start_models = {2: 'target.B99990001.pdb'}
+    a = engine.make_model(engine.make_environ(), 2, 4)
+
+    assert a.pocket_radius == 6.0
+    assert isinstance(a.rand_method, PocketRandomizer) and a.rand_method.deviation == 0.5
+    assert a.start_models == {2: 'target.B99990001.pdb'}
+
+
+def test_run_pocket_ensemble_starts_every_member_from_the_full_model(workdir, monkeypatch):
+    runs = []
+
+    def run(self, job=None):
+        runs.append(self)
+        if self.pocket_radius is None:
+            self.add_outputs([output('target.B99990001.pdb', -8.0)])
+        else:
+            self.add_outputs([output('target.B9999%04d.pdb' % i, -5.0 - i) for i in self.model_indices])
+        return self.best_model
+
+    monkeypatch.setattr(ModelEngine, 'run', run)
+    monkeypatch.setattr(model_engine, 'shared_job', lambda num_cpus: 'job')
+
+    best = run_pocket_ensemble('target.ali', 'tmpl', 'target', 1, 4, 1, pocket_radius=6.0)
+    base, members = runs
+    assert base.model_indices == [1] and base.include_ligand and base.pocket_radius is None
+    assert members.model_indices == [2, 3, 4] and members.include_ligand
+    assert members.start_models == {x: 'target.B99990001.pdb' for x in (2, 3, 4)}
+    assert members.run_id == base.run_id
+    # The full model is part of the ensemble ranking
+    assert [x['name'] for x in members.outputs][0] == 'target.B99990001.pdb'
+    assert best['name'] == 'target.B99990004.pdb'
+
+
+def test_failed_full_model_stops_the_ensemble(workdir, monkeypatch):
+    monkeypatch.setattr(ModelEngine, 'run', lambda self, job=None: None)
+    monkeypatch.setattr(model_engine, 'shared_job', lambda num_cpus: 'job')
+    assert run_pocket_ensemble('target.ali', 'tmpl', 'target', 1, 4, 1) is None
@@ -0,0 +1,51 @@
+import pytest
+
+import results_store
+from results_store import ResultsStore, parse_model_name, results_store_available
+
+
+def output(name, dope, failure=None):
+    return {'name': name, 'failure': failure, 'molpdf': 1.0, 'DOPE score': dope, 'GA341 score': [0.9, 0.1]}
+
+
+def test_parse_model_name():
+    assert parse_model_name('hkkp.B99990003.pdb') == ('core', 3, None)
+    assert parse_model_name('/runs/x/hkkp.BL00020003.pdb') == ('loop', 3, 2)
+    assert parse_model_name('hkkp.with.dots.BL00120105.pdb') == ('loop', 105, 12)
+
+
+@pytest.mark.skipif(results_store_available(), reason='pyarrow is installed')
+def test_store_needs_pyarrow():
+    with pytest.raises(ImportError):
+        ResultsStore()
+
+
+def test_store_round_trip(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.chdir(tmp_path)
+    store = ResultsStore(str(tmp_path / 'results'))
+    assert store.query().num_rows == 0
+
+    store.append_outputs([output('hkkp.B99990001.pdb', -10.0), output('hkkp.B99990002.pdb', None, 'failed')],
+                         'run1', 'single', '4biwA', 'hkkp', 'slow', batch_wall_time=3.0)
+    store.append_outputs([output('hkkp.BL00010002.pdb', -30.0)], 'run2', 'mult', ('t1', 't2'), 'hkkp', 'fast')
+    assert len(list((tmp_path / 'results').glob('part-*.parquet'))) == 2
+
+    rows = store.query(columns=['run_id', 'model_type', 'model_index', 'loop_index', 'template_set', 'dope'],
+                       failure=None, sort_by='dope').to_pylist()
+    assert rows == [{'run_id': 'run2', 'model_type': 'loop', 'model_index': 2, 'loop_index': 1,
+                     'template_set': 't1+t2', 'dope': -30.0},
+                    {'run_id': 'run1', 'model_type': 'core', 'model_index': 1, 'loop_index': None,
+                     'template_set': '4biwA', 'dope': -10.0}]
+    assert store.query(run_id=['run1'], limit=1).num_rows == 1
+    assert store.query(columns=['ga341'], run_id='run2').to_pylist() == [{'ga341': 0.9}]
+
+    store.compact()
+    assert len(list((tmp_path / 'results').glob('part-*.parquet'))) == 1
+    assert store.query().num_rows == 3
+
+
+def test_store_location_comes_from_the_environment(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setenv(results_store.RESULTS_DIR_ENV, str(tmp_path / 'shared'))
+    assert ResultsStore().root == str(tmp_path / 'shared')
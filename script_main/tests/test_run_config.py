@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+
+from run_config import (BATCH_ENV, POLICIES, POLICY_ENV, apply_settings, confirm_overwrite, export_run_options,
+                        parse_run_options, stage_environment, stage_policy)
+
+
+@pytest.fixture(autouse=True)
+def clean_environment():
+    # export_run_options() writes to os.environ directly
+    names = [BATCH_ENV] + [POLICY_ENV.format(x.upper()) for x in POLICIES]
+    saved = {x: os.environ.pop(x) for x in names if x in os.environ}
+    yield
+    for name in names:
+        os.environ.pop(name, None)
+    os.environ.update(saved)
+
+
+def test_interactive_defaults():
+    options = parse_run_options([])
+    assert not options.batch
+    assert options.policies == {'alignment': 'ask', 'modeling': 'overwrite', 'reorganize': 'ask'}
+    assert options.stage == 'all'
+
+
+def test_batch_options_and_config(tmp_path):
+    config = tmp_path / 'run.json'
+    config.write_text(json.dumps({'batch': True, 'policies': {'reorganize': 'skip'},
+                                  'settings': {'num_cpus': 4}}))
+
+    options = parse_run_options(['--config', str(config), '--resume', '--stage', 'model'])
+    assert options.batch
+    assert options.policies == {'alignment': 'overwrite', 'modeling': 'resume', 'reorganize': 'skip'}
+    assert options.settings == {'num_cpus': 4}
+    assert options.stage == 'model'
+
+    assert parse_run_options(['--batch', '--overwrite', 'skip']).policies['alignment'] == 'skip'
+
+
+def test_batch_mode_rejects_prompts():
+    with pytest.raises(SystemExit):
+        parse_run_options(['--batch', '--overwrite', 'ask'])
+
+
+def test_apply_settings_rejects_unknown_names():
+    namespace = {'num_cpus': 1, 'template_manual': []}
+    apply_settings({'num_cpus': 8, 'template_manual': [['1abc', 'A']]}, namespace)
+    assert namespace == {'num_cpus': 8, 'template_manual': [('1abc', 'A')]}
+
+    with pytest.raises(KeyError):
+        apply_settings({'num_cpu': 8}, namespace)
+
+
+def test_exported_policies_reach_the_stages(monkeypatch):
+    export_run_options(parse_run_options(['--batch', '--overwrite', 'skip']))
+    assert stage_policy('reorganize') == 'skip'
+    assert not confirm_overwrite('Replace? ', 'alignment')
+
+    monkeypatch.setenv(POLICY_ENV.format('ALIGNMENT'), 'overwrite')
+    assert confirm_overwrite('Replace? ', 'alignment')
+
+
+def test_interactive_prompt(monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda prompt: 'y')
+    assert confirm_overwrite('Replace? ', 'alignment')
+    monkeypatch.setattr('builtins.input', lambda prompt: 'n')
+    assert not confirm_overwrite('Replace? ', 'reorganize')
+
+
+def test_stage_environment_puts_script_main_on_the_path(monkeypatch):
+    monkeypatch.setenv('PYTHONPATH', '/opt/lib')
+    path = stage_environment()['PYTHONPATH'].split(os.pathsep)
+    assert path[1] == '/opt/lib'
+    assert os.path.isfile(os.path.join(path[0], 'run_config.py'))
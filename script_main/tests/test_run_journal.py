@@ -0,0 +1,85 @@
+import pytest
+
+from run_journal import RunJournal, input_hash, parameters_key
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = RunJournal(str(tmp_path / 'cache' / 'journal.sqlite'))
+    yield journal
+    journal.close()
+
+
+def test_input_hash_follows_the_file_content(tmp_path):
+    path = tmp_path / 'in.pdb'
+    missing = input_hash([str(path)])
+    path.write_text('ATOM\n')
+    first = input_hash([str(path)])
+    assert first != missing
+    assert input_hash([str(path)], 'x') != first
+
+    path.write_text('ATOM  changed\n')
+    assert input_hash([str(path)]) != first
+
+
+def test_parameters_key_ignores_the_key_order():
+    assert parameters_key({'a': 1, 'b': [2]}) == parameters_key({'b': [2], 'a': 1})
+    assert parameters_key({'a': 1}) != parameters_key({'a': 2})
+
+
+def test_done_jobs_are_complete_while_inputs_parameters_and_outputs_hold(journal, tmp_path):
+    (tmp_path / 'out.trg').write_text('maps')
+    journal.start('map', 'agfr_m1', 'hash1', {'tool': 'agfr'})
+    assert not journal.is_complete('map', 'agfr_m1', 'hash1', {'tool': 'agfr'})  # still running
+
+    journal.finish('map', 'agfr_m1', 'done', 0, ['out.trg'], wall_time=2.0, cpu_time=1.5)
+    record = journal.get('map', 'agfr_m1')
+    assert (record['state'], record['exit_code'], record['attempts']) == ('done', 0, 1)
+    assert record['outputs'] == [str(tmp_path / 'out.trg')]
+    assert record['parameters'] == {'tool': 'agfr'}
+
+    assert journal.is_complete('map', 'agfr_m1', 'hash1', {'tool': 'agfr'})
+    assert not journal.is_complete('map', 'agfr_m1', 'hash2', {'tool': 'agfr'})
+    assert not journal.is_complete('map', 'agfr_m1', 'hash1', {'tool': 'agfr', 'options': '-x'})
+    assert not journal.is_complete('map', 'agfr_m1', 'hash1', {'tool': 'agfr'}, ['missing.trg'])
+    assert journal.is_stale('map', 'agfr_m1', 'hash2', {'tool': 'agfr'})
+    assert not journal.is_stale('map', 'other', 'hash2')
+
+    (tmp_path / 'out.trg').unlink()
+    assert not journal.is_complete('map', 'agfr_m1', 'hash1', {'tool': 'agfr'})
+
+
+def test_attempts_count_up_until_the_job_is_done(journal):
+    journal.start('dock', 'adfr_m1-l1', 'h')
+    journal.finish('dock', 'adfr_m1-l1', 'failed', 1)
+    journal.start('dock', 'adfr_m1-l1', 'h')
+    assert journal.get('dock', 'adfr_m1-l1')['attempts'] == 2
+
+    journal.finish('dock', 'adfr_m1-l1', 'done', 0)
+    journal.start('dock', 'adfr_m1-l1', 'h')
+    assert journal.get('dock', 'adfr_m1-l1')['attempts'] == 1
+
+
+def test_jobs_and_forget(journal):
+    journal.record('model', 'b.pdb', 'done', 'h')
+    journal.record('model', 'a.pdb', 'failed', 'h')
+    journal.record('dock', 'adfr_a-l', 'done', 'h')
+
+    assert [x['job'] for x in journal.jobs()] == ['adfr_a-l', 'a.pdb', 'b.pdb']
+    assert [x['job'] for x in journal.jobs('model', 'done')] == ['b.pdb']
+
+    journal.forget('model', 'a.pdb')
+    assert journal.get('model', 'a.pdb') is None
+    journal.forget('model')
+    assert [x['stage'] for x in journal.jobs()] == ['dock']
+
+
+def test_journal_is_shared_through_the_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv('MODELLER_SCRIPTS_JOURNAL', str(tmp_path / 'shared.sqlite'))
+    first = RunJournal()
+    first.record('repair', 'repair_m1', 'done', 'h')
+    second = RunJournal()
+    assert second.get('repair', 'repair_m1')['state'] == 'done'
+    first.close()
+    second.close()
@@ -0,0 +1,47 @@
+from score_store import ScoreStore, score_selection, structure_key
+
+ATOM = 'ATOM  %5d  CA  ALA %s%4d      %6.3f   1.000   1.000  1.00  0.00           C\n'
+
+
+def write_structure(path, chains='A', serial_offset=0, hetatm=False):
+    lines = [ATOM % (i + serial_offset, chain, i, float(i)) for i, chain in enumerate(chains, 1)]
+    if hetatm:
+        lines.append('HETATM  999  C1  LIG B 900       0.000   0.000   0.000  1.00  0.00           C\n')
+    path.write_text(''.join(lines) + 'END\n')
+
+
+def test_structure_key_ignores_serials_and_hetatm(tmp_path):
+    write_structure(tmp_path / 'model.pdb', 'AAB')
+    write_structure(tmp_path / 'protein.pdb', 'AAB', serial_offset=100, hetatm=True)
+    write_structure(tmp_path / 'other.pdb', 'AAA')
+
+    key, chains = structure_key(str(tmp_path / 'model.pdb'))
+    assert chains == ['A', 'B']
+    assert structure_key(str(tmp_path / 'protein.pdb'))[0] == key
+    assert structure_key(str(tmp_path / 'other.pdb'))[0] != key
+
+
+def test_score_selection():
+    assert score_selection(['A']) == 'all'
+    assert score_selection(['A'], 'A') == 'all'
+    assert score_selection(['A', 'B'], 'A') == 'chain A'
+    assert score_selection(['A', 'B'], 'B', method='complete_pdb') == 'complete_pdb:chain B'
+    assert score_selection(['A'], 'A', method='complete_pdb') == 'complete_pdb:all'
+
+
+def test_score_store_records_model_outputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_structure(tmp_path / 'target.B99990001.pdb')
+    store = ScoreStore(str(tmp_path / 'db' / 'scores.sqlite'))
+    store.record_outputs([{'name': 'target.B99990001.pdb', 'failure': None, 'molpdf': 12.5, 'DOPE score': -100.0,
+                           'GA341 score': [0.9, 0.1]},
+                          {'name': 'target.B99990002.pdb', 'failure': 'optimization failed'}])
+
+    key = structure_key('target.B99990001.pdb')[0]
+    assert store.get(key) == {'dope': -100.0, 'ga341': 0.9, 'molpdf': 12.5, 'source': 'target.B99990001.pdb'}
+    assert store.get(key, 'complete_pdb:all') is None
+
+    store.put(key, 'complete_pdb:all', dope=-90.0)
+    assert store.get(key, 'complete_pdb:all')['dope'] == -90.0
+    assert store.get(key)['dope'] == -100.0
+    store.close()
@@ -0,0 +1,52 @@
+import os
+import sys
+
+from stage_runner import DOCKING_STAGES, docking_stages, run_stage, run_stages
+
+POOL_SCRIPT = '''import multiprocessing
+import sys
+
+
+def square(x):
+    return x * x
+
+
+def main():
+    with multiprocessing.get_context('fork').Pool(processes=2) as pool:
+        values = pool.map(square, range(5))
+    with open('squares.txt', 'w') as f:
+        f.write(' '.join(map(str, values)))
+    sys.exit(0 if values == [0, 1, 4, 9, 16] else 1)
+
+
+if __name__ == "__main__":
+    main()
+'''
+
+
+def test_docking_stages():
+    assert docking_stages(streaming=False) == list(DOCKING_STAGES)
+    assert docking_stages() == ['00-summary_dope.py', '03-reorganize_directory.py', 'docking_pipeline.py',
+                                '06-summary_docking_results.py', '07-select_top_conformations.py',
+                                '08-convert_output_mol_mol2.py']
+
+
+def test_in_process_stage_forks_its_pool_workers(tmp_path):
+    (tmp_path / 'pool_stage.py').write_text(POOL_SCRIPT)
+    cwd, argv = os.getcwd(), list(sys.argv)
+
+    result = run_stage('pool_stage.py', str(tmp_path), args=['--x'])
+    assert result['status'] == 'done'
+    assert (tmp_path / 'squares.txt').read_text() == '0 1 4 9 16'
+    # The working directory and arguments of the calling process are restored
+    assert (os.getcwd(), sys.argv) == (cwd, argv)
+
+
+def test_failed_stages_do_not_stop_the_run(tmp_path):
+    (tmp_path / 'fail.py').write_text('import sys\nsys.exit(2)\n')
+    (tmp_path / 'error.py').write_text('raise RuntimeError("broken")\n')
+    (tmp_path / 'ok.py').write_text('open("ok.txt", "w").close()\n')
+
+    results = run_stages(['fail.py', 'error.py', 'ok.py'], str(tmp_path))
+    assert [x['status'] for x in results] == ['failed', 'failed', 'done']
+    assert (tmp_path / 'ok.txt').exists()
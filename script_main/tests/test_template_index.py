@@ -0,0 +1,87 @@
+import json
+import os
+
+from template_index import TemplateIndex, read_pdb_metadata
+
+PDB = '\n'.join([
+    'HEADER    TRANSFERASE',
+    'ATOM      1  N   MET A   1      11.104   6.134  -6.504  1.00  0.00           N',
+    'ATOM      2  CA  MET A   1      11.639   6.071  -5.147  1.00  0.00           C',
+    'ATOM      3  N   LYS A   2      12.000   7.000  -4.000  1.00  0.00           N',
+    'ATOM      4  N   THR A   2A     13.000   8.000  -3.000  1.00  0.00           N',
+    'HETATM    5  SE  MSE A   3      14.000   9.000  -2.000  1.00  0.00          SE',
+    'ATOM      6  N   GLY B1001      15.000  10.000  -1.000  1.00  0.00           N',
+    'HETATM    7  C1  ATP A 401      16.000  11.000   0.000  1.00  0.00           C',
+    'HETATM    8  C2  ATP A 401      16.500  11.500   0.500  1.00  0.00           C',
+    'HETATM    9 MG    MG B 402      17.000  12.000   1.000  1.00  0.00          MG',
+    'HETATM   10  O   HOH A 501      18.000  13.000   2.000  1.00  0.00           O',
+    'ENDMDL',
+    'ATOM     11  N   ALA C   1      19.000  14.000   3.000  1.00  0.00           N',
+    'END', ''])
+
+
+def test_read_pdb_metadata_uses_fixed_columns(tmp_path):
+    (tmp_path / '1abc.pdb').write_text(PDB)
+    metadata = read_pdb_metadata(str(tmp_path / '1abc.pdb'))
+
+    assert metadata['chain_order'] == ['A', 'B']  # chain C is in the second model
+    assert metadata['chains']['A'] == {'first': '1', 'last': '3', 'sequence': 'MKTM'}
+    assert metadata['chains']['B'] == {'first': '1001', 'last': '1001', 'sequence': 'G'}
+    assert metadata['ligands'] == [['ATP', 'A', '401'], ['MG', 'B', '402']]  # waters are not ligands
+
+
+def test_template_index_reuses_unchanged_entries(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / '1abc.pdb').write_text(PDB)
+    (tmp_path / 'notes.txt').write_text('not a template')
+    index_file = str(tmp_path / 'cache' / 'index.json')
+
+    index = TemplateIndex(index_file)
+    assert index.detect_templates() == [('1abc', 'A')]
+    assert index.chain_sequence('1abc.pdb', 'B') == 'G'
+    assert index.chain_sequence('1abc.pdb', 'Z') == ''
+    assert index.count_ligands('1abc.pdb', 'A') == 1
+    with open(index_file) as f:
+        assert list(json.load(f)) == [os.path.abspath('1abc.pdb')]
+
+    # A later run reads the saved index instead of the PDB file
+    reopened = TemplateIndex(index_file)
+    monkeypatch.setattr('template_index.read_pdb_metadata', None)
+    assert reopened.get('1abc.pdb')['chain_order'] == ['A', 'B']
+
+
+def test_template_index_reparses_changed_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / '1abc.pdb').write_text(PDB)
+    index = TemplateIndex(str(tmp_path / 'index.json'))
+    assert index.count_ligands('1abc.pdb', 'B') == 1
+
+    (tmp_path / '1abc.pdb').write_text(PDB.replace('HETATM    9 MG    MG B 402', 'HETATM    9  O   HOH B 402'))
+    os.utime('1abc.pdb', (1, 1))
+    assert index.count_ligands('1abc.pdb', 'B') == 0
+
+
+def test_ligand_counts_of_missing_templates_are_unknown(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'atom_files').mkdir()
+    (tmp_path / 'atom_files' / '1abc.pdb').write_text(PDB)
+    index = TemplateIndex(str(tmp_path / 'index.json'))
+
+    assert index.ligand_counts([('1abc', 'A'), ('1abc', 'B')], ['.', 'atom_files']) == {'1abcA': 1, '1abcB': 1}
+    assert index.ligand_counts([('1abc', 'A'), ('2xyz', 'A')], ['.', 'atom_files']) is None
+    assert 'Ligands of template 2xyzA unknown' in capsys.readouterr().out
+
+
+def test_template_index_saves_entries_read_by_lookups(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / '1abc.pdb').write_text(PDB)
+    index_file = str(tmp_path / 'index.json')
+
+    index = TemplateIndex(index_file)
+    assert index.count_ligands('1abc.pdb', 'A') == 1
+    index.save()
+
+    reopened = TemplateIndex(index_file)
+    monkeypatch.setattr('template_index.read_pdb_metadata', None)
+    assert reopened.chain_sequence('1abc.pdb', 'A') == 'MKTM'
+    assert not reopened._dirty
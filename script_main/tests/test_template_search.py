@@ -0,0 +1,84 @@
+import numpy as np
+
+from template_search import (KMER_SIZE, UNKNOWN, SequenceDatabase, encode_sequence, kmer_ids, read_pir_entries,
+                             read_target_sequence, select_diverse_templates)
+
+PIR = ('>P1;1abcA\n'
+       'structureX:1abc:1:A:20:A::::\n'
+       'MKTAYIAKQRQISFVKSHFS\n'
+       'RQ*\n'
+       '>P1;2xyzB\n'
+       'structureX:2xyz:1:B:12:B::::\n'
+       'GSHMLEDPVAGW*\n'
+       '>P1;3nopA\n'
+       'structureX:3nop:1:A:20:A::::\n'
+       'MKTAYIAKQRQISFVKSHXX*\n')
+
+
+def write_database(tmp_path):
+    path = tmp_path / 'pdball.pir'
+    path.write_text(PIR)
+    return str(path)
+
+
+def test_kmer_ids():
+    codes = encode_sequence('ACDX')
+    assert list(codes) == [0, 1, 2, UNKNOWN]
+    assert list(kmer_ids(codes)) == [0 * UNKNOWN ** 2 + 1 * UNKNOWN + 2, -1]
+    assert len(kmer_ids(encode_sequence('AC'))) == 0
+    assert list(encode_sequence('acd')) == [0, 1, 2]
+
+
+def test_read_pir_entries(tmp_path):
+    path = write_database(tmp_path)
+    entries = list(read_pir_entries(path))
+    assert [(code, pdb_id, chain) for code, pdb_id, chain, _, _ in entries] == [
+        ('1abcA', '1abc', 'A'), ('2xyzB', '2xyz', 'B'), ('3nopA', '3nop', 'A')]
+    assert entries[0][3] == 'MKTAYIAKQRQISFVKSHFSRQ'
+
+    # The byte offset points at the header of the entry
+    with open(path, 'rb') as f:
+        f.seek(entries[1][4])
+        assert f.readline() == b'>P1;2xyzB\n'
+
+    assert read_target_sequence(path, '2xyzB') == 'GSHMLEDPVAGW'
+
+
+def test_sequence_database_prefilter(tmp_path):
+    path = write_database(tmp_path)
+    db = SequenceDatabase(path).open()
+    assert db.is_current()
+    assert db.meta['codes'] == ['1abcA', '2xyzB', '3nopA']
+    assert len(db.kptr) == UNKNOWN ** KMER_SIZE + 1
+    assert list(db.nkmer)[1] == len(np.unique(kmer_ids(encode_sequence('GSHMLEDPVAGW'))))
+
+    hits = db.prefilter('MKTAYIAKQRQISFVKSHFSRQ', min_shared=0.5)
+    assert [x for x, _ in hits] == [0, 2]
+    assert hits[0][1] == 1.0 and hits[1][1] < 1.0
+    assert db.prefilter('MKTAYIAKQRQISFVKSHFSRQ', min_shared=0.5, max_candidates=1)[0][0] == 0
+    assert db.prefilter('XX') == []
+
+    output = tmp_path / 'hits.pir'
+    db.write_entries([1], str(output))
+    assert output.read_text() == '>P1;2xyzB\nstructureX:2xyz:1:B:12:B::::\nGSHMLEDPVAGW*\n'
+
+
+def test_chunked_build_matches(tmp_path):
+    path = write_database(tmp_path)
+    SequenceDatabase(path).build(chunk_size=1)
+    chunked = SequenceDatabase(path).open()
+    assert chunked.prefilter('GSHMLEDPVAGW') == [(1, 1.0)]
+
+
+def test_select_diverse_templates_drops_redundant_chains():
+    target = 'MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQ'
+    templates = {('1abc', 'A'): 'MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQ',
+                 ('1abd', 'A'): 'MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQ',  # identical to 1abcA
+                 ('2xyz', 'B'): 'MKTAYIAKQRQGGWPPHDDNE',  # shares its first half with the target
+                 ('3nop', 'A'): 'GSHMLEDPVAGW'}
+
+    assert select_diverse_templates(target, templates) == [('1abc', 'A'), ('2xyz', 'B'), ('3nop', 'A')]
+    assert select_diverse_templates(target, templates, max_templates=2) == [('1abc', 'A'), ('2xyz', 'B')]
+    assert select_diverse_templates(target, templates, min_coverage=0.1) == [('1abc', 'A'), ('2xyz', 'B')]
+    assert select_diverse_templates(target, templates, max_identity=1.0)[:2] == [('1abc', 'A'), ('1abd', 'A')]
+    assert select_diverse_templates(target, {}) == []
@@ -0,0 +1,46 @@
+import os
+
+import worker_pool
+from run_config import SCRIPT_MAIN_DIR
+from worker_pool import WorkerPool
+
+
+class FakeJob(list):
+    def __init__(self):
+        super().__init__()
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def queue_task(self, task):
+        pass
+
+    def run_all_tasks(self):
+        pass
+
+
+def test_pool_reuses_one_job_per_worker_count(monkeypatch):
+    monkeypatch.setattr(worker_pool, 'Job', FakeJob)
+    monkeypatch.setenv('PYTHONPATH', '/opt/lib')
+    pool = WorkerPool()
+
+    job = pool.job(2)
+    assert job.started and len(job) == 2
+    assert pool.job(2) is job
+    assert pool.job(0) is not job and len(pool.job(0)) == 1
+    assert pool.stats[2]['uses'] == 2
+    assert pool.report()[0].startswith('1 workers started')
+
+    # script_main is added to the worker environment once, not once per job
+    assert os.environ['PYTHONPATH'] == os.pathsep.join([SCRIPT_MAIN_DIR, '/opt/lib'])
+
+
+def test_disabled_pool_starts_a_job_per_request(monkeypatch):
+    monkeypatch.setattr(worker_pool, 'Job', FakeJob)
+    pool = WorkerPool(enabled=False)
+
+    first, second = pool.job(3), pool.job(3)
+    assert first is not second and len(first) == 3
+    assert not first.started  # started by the model that runs on it
+    assert pool.jobs == {} and pool.report() == []
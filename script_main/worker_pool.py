@@ -0,0 +1,126 @@
+# Long-lived MODELLER worker pools shared by the modeling modes of one run
+import os
+import time
+import atexit
+from modeller.parallel import Job, LocalWorker, Task
+
+from run_config import SCRIPT_MAIN_DIR, stage_environment
+
+
+class _WarmupTask(Task):
+    """Empty task: returns once a worker has started and connected."""
+
+    def run(self):
+        return os.getpid()
+
+
+class WorkerPool:
+    """
+    Keeps one MODELLER parallel job per worker count for the lifetime of the process. Every modeling
+    mode (single/multi-template, loop refinement, tiers, pocket ensemble) asking for the same number
+    of CPUs gets the same job back, so the workers start, import MODELLER and read the libraries once
+    per run instead of once per mode. The startup time of every job is measured for the report.
+
+    The pool belongs to one process: shard processes and the branches of concurrent modeling cannot
+    share its workers and would start workers of their own next to it, so execute_modeller.py disables
+    the pool in these modes. A disabled pool starts a new job for every request.
+
+    Args:
+        enabled (bool, optional): Reuse the jobs. Defaults to True.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.jobs = {}  # number of workers -> Job
+        self.stats = {}  # number of workers -> {'startup_time': seconds, 'uses': count}
+
+    def job(self, num_cpus):
+        """
+        Returns the running job with num_cpus workers, starting it on first use (on every use if the
+        pool is disabled).
+
+        Args:
+            num_cpus (int): Number of workers.
+
+        Returns:
+            Job: MODELLER parallel job.
+        """
+
+        num_cpus = max(num_cpus, 1)
+        if not self.enabled:
+            return new_job(num_cpus)
+
+        if num_cpus not in self.jobs:
+            # Workers unpickle the model classes of script_main
+            export_script_main_path()
+
+            job = new_job(num_cpus)
+
+            # Cold startup: until every worker has run one task
+            start = time.perf_counter()
+            job.start()
+            for _ in range(num_cpus):
+                job.queue_task(_WarmupTask())
+            job.run_all_tasks()
+
+            self.jobs[num_cpus] = job
+            self.stats[num_cpus] = {'startup_time': time.perf_counter() - start, 'uses': 0}
+            print("Worker pool: %d workers started in %.1f s" % (num_cpus, self.stats[num_cpus]['startup_time']))
+
+        self.stats[num_cpus]['uses'] += 1
+        return self.jobs[num_cpus]
+
+    def report(self):
+        """
+        Summarizes the startup cost of the pool.
+
+        Returns:
+            list: One line per job: workers, startup time, number of uses and the startup time saved
+                by reusing the job (one startup per extra use).
+        """
+
+        lines = []
+        for num_cpus, stats in sorted(self.stats.items()):
+            saved = stats['startup_time'] * (stats['uses'] - 1)
+            lines.append("%d workers started in %.1f s, used by %d runs, about %.1f s of startup saved"
+                         % (num_cpus, stats['startup_time'], stats['uses'], saved))
+        return lines
+
+    def close(self):
+        """Drops the jobs; their workers exit once the connections to this process are closed."""
+        self.jobs.clear()
+
+
+# Make script_main importable by the local workers, which inherit the environment of this process
+def export_script_main_path():
+    if SCRIPT_MAIN_DIR not in os.environ.get('PYTHONPATH', '').split(os.pathsep):
+        os.environ['PYTHONPATH'] = stage_environment()['PYTHONPATH']
+
+
+# New MODELLER parallel job with num_cpus local workers
+def new_job(num_cpus):
+    job = Job()
+    for _ in range(max(num_cpus, 1)):
+        job.append(LocalWorker())
+    return job
+
+
+# Pool of this process
+_POOL = WorkerPool()
+
+
+# Shared job with num_cpus workers
+def shared_job(num_cpus):
+    return _POOL.job(num_cpus)
+
+
+# Enable or disable the reuse of the jobs of this process
+def set_pool_enabled(enabled):
+    _POOL.enabled = enabled
+
+
+# Print the pool summary when the run ends
+@atexit.register
+def _report_pool():
+    for line in _POOL.report():
+        print('Worker pool: ' + line)